@@ -0,0 +1,145 @@
+"""
+HTTP client used by the Streamlit frontend.
+
+One keep-alive Session is shared by every call, GET responses are kept in a
+short TTL cache (and revalidated with ETags once they expire), and images for
+a page are downloaded concurrently through a bounded thread pool.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from cachetools import LRUCache, TTLCache
+from requests.adapters import HTTPAdapter
+
+
+class CursorExpired(Exception):
+    """The server no longer keeps the events after a cursor (410); reload everything"""
+
+
+class ApiClient:
+    """Pooled, caching client for the Django API"""
+
+    def __init__(self, base_url, ttl=5, image_workers=4, pool_size=10,
+                 max_cached_responses=256, max_cached_images=128):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.image_workers = image_workers
+        self._lock = threading.Lock()
+        # Bodies still fresh enough to reuse without asking the server
+        self._fresh = TTLCache(maxsize=max_cached_responses, ttl=ttl)
+        # Last body and validators per URL, for If-None-Match once fresh expires
+        self._validated = LRUCache(maxsize=max_cached_responses)
+        # Image URLs never change content (new uploads get new names)
+        self._images = LRUCache(maxsize=max_cached_images)
+
+    def url(self, path):
+        return self.base_url + path
+
+    @staticmethod
+    def _cache_key(url, params):
+        return url + '?' + str(sorted((params or {}).items()))
+
+    def get_json(self, path, params=None, timeout=5):
+        """
+        GET a JSON endpoint. Returns the decoded body, or None for any
+        non-200 answer. Connection errors propagate to the caller.
+        """
+        url = self.url(path)
+        key = self._cache_key(url, params)
+        with self._lock:
+            if key in self._fresh:
+                return self._fresh[key]
+            cached = self._validated.get(key)
+
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self.session.get(url, params=params, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached is not None:
+            data = cached['data']
+        elif response.status_code == 200:
+            data = response.json()
+            cached = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'data': data,
+            }
+        else:
+            return None
+
+        with self._lock:
+            self._fresh[key] = data
+            if cached['etag'] or cached['last_modified']:
+                self._validated[key] = cached
+        return data
+
+    def get_events(self, since=None, limit=100, wait=0, timeout=5):
+        """
+        Change events after since from /events/ (without since, just the
+        current cursor). Never cached: each answer is only good once.
+        Returns the decoded body, or None for any other non-200 answer.
+        Raises CursorExpired on 410, for a cursor older than the history
+        the server keeps.
+        """
+        params = {'limit': limit}
+        if since is not None:
+            params['since'] = since
+        if wait:
+            params['wait'] = wait
+        response = self.session.get(self.url('/events/'), params=params, timeout=timeout + wait)
+        if response.status_code == 410:
+            raise CursorExpired(since)
+        if response.status_code != 200:
+            return None
+        return response.json()
+
+    def post(self, path, **kwargs):
+        try:
+            return self.session.post(self.url(path), **kwargs)
+        finally:
+            self.invalidate()
+
+    def delete(self, path, **kwargs):
+        try:
+            return self.session.delete(self.url(path), **kwargs)
+        finally:
+            self.invalidate()
+
+    def invalidate(self):
+        """Forget fresh responses after our own writes so the next read sees them"""
+        with self._lock:
+            self._fresh.clear()
+
+    def _fetch_image(self, url, timeout):
+        with self._lock:
+            if url in self._images:
+                return self._images[url]
+        try:
+            response = self.session.get(url, timeout=timeout)
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        with self._lock:
+            self._images[url] = response.content
+        return response.content
+
+    def fetch_images(self, urls, timeout=5):
+        """Download several images concurrently; returns {url: bytes or None}"""
+        urls = list(dict.fromkeys(u for u in urls if u))
+        if not urls:
+            return {}
+        workers = min(self.image_workers, len(urls))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            bodies = pool.map(lambda u: self._fetch_image(u, timeout), urls)
+            return dict(zip(urls, bodies))
@@ -7,5 +7,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Under ASGI the read endpoints run as async views
+os.environ.setdefault('DJANGO_ASYNC_READS', '1')
 
 application = get_asgi_application()
\ No newline at end of file
@@ -4,6 +4,7 @@ Django settings for mini_social_media project.
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,6 +39,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # MUST be first
+    'posts.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,16 +68,55 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
+
+# Serve the read endpoints with async views (see posts.async_views);
+# config.asgi turns this on
+ASYNC_READS = os.environ.get('DJANGO_ASYNC_READS', '0') == '1'
 
 
 # Database
+# DJANGO_DB_PROFILE=production tunes SQLite for concurrent gunicorn workers
+DB_PROFILE = os.environ.get('DJANGO_DB_PROFILE', 'development')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DJANGO_DB_PATH', BASE_DIR / 'db.sqlite3'),
+        # A real file, not the shared-cache in-memory database, whose table
+        # locks ignore busy_timeout and fail concurrent writers at once
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), f'social-test-{os.getpid()}.sqlite3')},
     }
 }
 
+if DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        # Keep connections (and their page cache and mmap) across requests.
+        # Not under ASGI, where each request runs its queries on a fresh
+        # thread and a persistent connection would never be reused
+        'CONN_MAX_AGE': 0 if ASYNC_READS else 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock at BEGIN so transactions wait on the busy
+            # timeout instead of failing when they try to upgrade a read lock
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA busy_timeout=20000;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+    })
+
+# Extra attempts for a write that still hits "database is locked"
+SQLITE_LOCK_RETRIES = 3
+# Seconds before the first retry; doubles on each further attempt
+SQLITE_LOCK_RETRY_DELAY = 0.05
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -111,6 +152,45 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Media files (User uploaded files)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Prefix for media URLs handed to clients, e.g. a CDN such as
+# https://cdn.example.com/media/; empty serves MEDIA_URL from the requesting
+# host (see posts.storage)
+MEDIA_BASE_URL = os.environ.get('DJANGO_MEDIA_BASE_URL', '')
+# Stored names whose URL each process remembers
+MEDIA_URL_CACHE_SIZE = 10000
+
+# Upload limits, checked before an image is decoded (see posts.uploads): the
+# largest image file accepted, and the most pixels it may have
+MEDIA_MAX_UPLOAD_BYTES = int(os.environ.get('DJANGO_MEDIA_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+MEDIA_MAX_IMAGE_PIXELS = int(os.environ.get('DJANGO_MEDIA_MAX_IMAGE_PIXELS', 40_000_000))
+# Bytes read at a time while an upload is hashed and stored (see posts.storage)
+MEDIA_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploads.LimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'posts.storage.MediaStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Derivatives generated for every uploaded post image (see posts.images)
+IMAGE_VARIANT_WIDTHS = [320, 640, 1280]
+IMAGE_VARIANT_FORMATS = ['webp', 'jpeg']
+
+# Background jobs (see posts.jobs and `manage.py run_jobs`)
+JOB_MAX_ATTEMPTS = 3
+# Seconds before the first retry; doubles on each further attempt
+JOB_RETRY_BACKOFF = 5
+# Seconds after which a running job whose worker died may be claimed again
+JOB_LOCK_TIMEOUT = 600
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -124,8 +204,69 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # Same JSON as DRF's JSONRenderer, rendered by orjson (see posts.renderers)
+    'DEFAULT_RENDERER_CLASSES': [
+        'posts.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Cache
+# Local memory by default; point DJANGO_CACHE_BACKEND at
+# django.core.cache.backends.filebased.FileBasedCache (with a directory as
+# DJANGO_CACHE_LOCATION) to share cached responses between worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'mini-social-media'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
 }
 
+# Seconds a cached feed or comment page may live; writes invalidate sooner
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Users kept in each process's username lookup cache (see posts.users)
+USER_CACHE_SIZE = 10000
+# Seconds a cached user is trusted; bounds how stale another process's
+# entries get when the Django cache isn't shared between processes
+USER_CACHE_TIMEOUT = 300
+
+# Largest number of items accepted by the batch write endpoints
+BATCH_MAX_ITEMS = 500
+
+# Seconds /api/stats/ reuses its counts
+STATS_CACHE_TIMEOUT = 10
+
+# Admin changelists count rows exactly only up to this many (see posts.admin)
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Request timings (see posts.metrics): a Server-Timing header on every
+# response, and per-endpoint histograms served at /metrics
+SERVER_TIMING = os.environ.get('DJANGO_SERVER_TIMING', '1' if DEBUG else '0') == '1'
+METRICS_ENABLED = os.environ.get('DJANGO_METRICS', '0') == '1'
+
+# Change events (see posts.events): seconds between checks for new events
+# while a client waits, the longest a long-poll may wait, how long one
+# Server-Sent Events response stays open, and how often an idle stream
+# sends a heartbeat. EventSource clients reconnect after EVENTS_RETRY_MS.
+EVENTS_POLL_INTERVAL = 0.5
+EVENTS_MAX_WAIT = 25
+EVENTS_STREAM_SECONDS = 30
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_RETRY_MS = 1000
+# Days the change log (and so deletion tombstones) is kept; older entries
+# are removed by `manage.py compact_events`
+EVENTS_RETENTION_DAYS = int(os.environ.get('DJANGO_EVENTS_RETENTION_DAYS', '7'))
+
+# Feed settings
+# Number of most recent comments embedded with each post in the feed
+COMMENT_PREVIEW_SIZE = 3
+
 # CORS Settings (Allow Streamlit to connect)
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -143,6 +284,7 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'last-event-id',
     'origin',
     'user-agent',
     'x-csrftoken',
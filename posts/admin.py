@@ -1,18 +1,121 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
-from .models import Post, Comment
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.functional import cached_property
+from .models import Post, Comment, Job
+from . import search
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs COUNT(*) over a whole table.
+
+    Small result sets are counted exactly. Past ADMIN_EXACT_COUNT_LIMIT rows an
+    unfiltered changelist reports the primary key span (two index lookups,
+    slightly high if rows were deleted) and a filtered one stops counting at
+    the limit.
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        queryset = self.object_list
+        # Django turns a sliced count into COUNT(*) over a LIMITed subquery
+        count = queryset[:limit + 1].count()
+        if count <= limit:
+            return count
+        if queryset.query.where:
+            return limit
+        # Separate queries: SQLite only answers a lone MIN or MAX from the index
+        ids = queryset.model._default_manager.values_list('pk', flat=True)
+        first, last = ids.order_by('pk').first(), ids.order_by('-pk').first()
+        return max(last - first + 1, count)
+
+
+class UserAutocompleteFilter(admin.FieldListFilter):
+    """
+    Filter on a user foreign key through the admin's autocomplete widget, so
+    the sidebar never lists every user.
+    """
+    template = 'admin/posts/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        super().__init__(field, request, params, model, model_admin, field_path)
+        value = self.used_parameters.get(self.lookup_kwarg)
+        self.value = value[-1] if value else None
+        # The widget only loads the selected user; the rest come over AJAX
+        choice_field = forms.ModelChoiceField(
+            field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        )
+        self.widget_media = choice_field.widget.media
+        self.rendered_widget = choice_field.widget.render(
+            self.lookup_kwarg, self.value, {'id': f'filter_{field_path}'}
+        )
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def get_facet_counts(self, pk_attname, filtered_qs):
+        return {}
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value is None,
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg, 'p']),
+            'display': 'All',
+        }
+
+
+class FullTextSearchMixin:
+    """
+    Answer the changelist search box from the full-text index (see
+    posts.search) instead of LIKE '%term%' scans over content. An exact
+    username also matches.
+    """
+    search_kind = None
+    search_help_text = 'Words in the content (use word* for a prefix), or an exact username'
+
+    def search_condition(self, expression):
+        return Q(pk__in=RawSQL(search.matching_ids_sql(self.search_kind), [expression]))
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        # Filter on user_id through a subquery rather than joining auth_user,
+        # so SQLite can answer each side of the OR from an index
+        condition = Q(user_id__in=User.objects.filter(username=term).values('pk'))
+        expression = search.match_expression(term)
+        if expression:
+            condition |= self.search_condition(expression)
+        return queryset.filter(condition), False
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(FullTextSearchMixin, admin.ModelAdmin):
     """Admin interface for Post model"""
     list_display = ['id', 'user', 'content_preview', 'has_image', 'comments_count', 'created_at']
-    list_filter = ['created_at', 'user']
+    list_filter = ['created_at', ('user', UserAutocompleteFilter)]
+    list_select_related = ['user']
+    list_per_page = 50
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    autocomplete_fields = ['user']
     search_fields = ['content', 'user__username']
-    readonly_fields = ['created_at', 'updated_at']
+    search_kind = search.POST
+    readonly_fields = ['comments_count', 'created_at', 'updated_at']
     
     fieldsets = (
         ('Post Information', {
-            'fields': ('user', 'content', 'image')
+            'fields': ('user', 'content', 'image', 'comments_count')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -25,21 +128,26 @@ class PostAdmin(admin.ModelAdmin):
     content_preview.short_description = 'Content'
     
     def has_image(self, obj):
-        return '✓' if obj.image else '✗'
+        return bool(obj.image)
     has_image.short_description = 'Image'
     has_image.boolean = True
-    
-    def comments_count(self, obj):
-        return obj.comments.count()
-    comments_count.short_description = 'Comments'
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, admin.ModelAdmin):
     """Admin interface for Comment model"""
     list_display = ['id', 'user', 'post', 'content_preview', 'created_at']
-    list_filter = ['created_at', 'user']
+    list_filter = ['created_at', ('user', UserAutocompleteFilter)]
+    # Comment and Post __str__ both show the author's username
+    list_select_related = ['user', 'post__user']
+    list_per_page = 50
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Newest first along the primary key; Meta.ordering has no index to use
+    ordering = ['-id']
+    autocomplete_fields = ['post', 'user']
     search_fields = ['content', 'user__username', 'post__content']
+    search_kind = search.COMMENT
     readonly_fields = ['created_at']
     
     fieldsets = (
@@ -54,4 +162,18 @@ class CommentAdmin(admin.ModelAdmin):
     
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
-    content_preview.short_description = 'Content'
\ No newline at end of file
+    content_preview.short_description = 'Content'
+    
+    def search_condition(self, expression):
+        # Comments also match through their post's content
+        post_ids = RawSQL(search.matching_ids_sql(search.POST), [expression])
+        return super().search_condition(expression) | Q(post_id__in=post_ids)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Admin interface for background jobs"""
+    list_display = ['id', 'name', 'status', 'attempts', 'run_after', 'updated_at']
+    list_filter = ['status', 'name']
+    search_fields = ['key']
+    readonly_fields = ['created_at', 'updated_at', 'locked_at', 'last_error']
@@ -0,0 +1,192 @@
+"""
+Async versions of the read endpoints, for serving under ASGI.
+
+With ASYNC_READS on (the default when served through config.asgi), GET and
+HEAD requests to get-posts, get-comments, the post and comment list and
+detail routes and the change event endpoints are answered here with the
+async ORM, so a worker waiting on the database, a slow client or a
+long-polling one holds no thread. Bodies, status codes,
+validators and cache entries are the same as the sync views in posts.views,
+whose serializers and pagination these reuse.
+
+Everything else on those URLs (writes, OPTIONS, the browsable API, objects
+that don't exist) goes to the sync view, and format suffixes and non-numeric
+ids don't match the async routes at all, so the async path only has to
+handle the common case.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+
+from . import events, fast_serializers
+from .cache import FEED_VERSION_KEY, acached_data, aget_version, comments_version_key, response_key
+from .conditional import afeed_position, comment_condition, feed_condition, post_condition
+from .models import Post, Comment
+from .pagination import CommentPagination, KeysetPagination, PostPagination
+from .renderers import ORJSONRenderer
+from .serializers import CommentSerializer, PostSerializer
+from .views import event_stream_response
+
+renderer = ORJSONRenderer()
+
+
+class FallBack(Exception):
+    """Raised by an async view to hand the request to the sync view"""
+
+
+def respond(data, status_code=status.HTTP_200_OK):
+    """What DRF's Response renders for a JSON client"""
+    response = HttpResponse(renderer.render(data), status=status_code, content_type=renderer.media_type)
+    response['Vary'] = 'Accept'
+    return response
+
+
+def read_view(async_view, sync_view):
+    """
+    Serve GET and HEAD with async_view and anything else, or anything
+    async_view raises FallBack for, with sync_view.
+    """
+    run_sync = sync_to_async(sync_view)
+
+    @wraps(async_view)
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD') and 'text/html' not in request.headers.get('Accept', ''):
+            try:
+                return await async_view(request, *args, **kwargs)
+            except FallBack:
+                pass
+        return await run_sync(request, *args, **kwargs)
+    return view
+
+
+@feed_condition
+async def get_posts(request):
+    """Get one page of posts with comments, newest first"""
+    request = Request(request)
+    try:
+        async def build():
+            paginator = PostPagination()
+            rows = await paginator.apaginate_queryset(fast_serializers.post_values(Post.objects.all()), request)
+            return {
+                'count': len(rows),
+                'next_cursor': paginator.next_cursor,
+                'posts': await fast_serializers.aserialize_posts(rows, request)
+            }
+
+        version = f'{await aget_version(FEED_VERSION_KEY)}.{await afeed_position(request)}'
+        key = response_key('feed', version, request)
+        return respond(await acached_data(key, build))
+    except ValidationError as e:
+        return respond({'errors': e.detail}, status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return respond({'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@post_condition
+async def get_comments(request, post_id):
+    """Get one page of a post's comments, oldest first"""
+    request = Request(request)
+    try:
+        async def build():
+            post = await Post.objects.aget(pk=post_id)
+            paginator = CommentPagination()
+            rows = await paginator.apaginate_queryset(fast_serializers.comment_values(post.comments.all()), request)
+            return {
+                'count': len(rows),
+                'next_cursor': paginator.next_cursor,
+                'comments': fast_serializers.serialize_comments(rows)
+            }
+
+        version = await aget_version(comments_version_key(post_id))
+        key = response_key('comments', version, request)
+        return respond(await acached_data(key, build))
+    except ValidationError as e:
+        return respond({'errors': e.detail}, status.HTTP_400_BAD_REQUEST)
+    except Post.DoesNotExist:
+        return respond({'error': 'Post not found'}, status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return respond({'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+async def _list(request, queryset, paginator, serialize):
+    request = Request(request)
+    try:
+        rows = await paginator.apaginate_queryset(queryset, request)
+    except ValidationError as e:
+        return respond(e.detail, status.HTTP_400_BAD_REQUEST)
+    return respond({
+        'next': paginator.get_next_link(),
+        'next_cursor': paginator.next_cursor,
+        'results': await serialize(rows, request),
+    })
+
+
+async def list_posts(request):
+    """PostViewSet.list"""
+    queryset = fast_serializers.post_values(Post.objects.all())
+    return await _list(request, queryset, PostPagination(), fast_serializers.aserialize_posts)
+
+
+async def list_comments(request):
+    """CommentViewSet.list"""
+    async def serialize(rows, request):
+        return fast_serializers.serialize_comments(rows)
+    queryset = fast_serializers.comment_values(Comment.objects.all())
+    return await _list(request, queryset, CommentPagination(), serialize)
+
+
+@post_condition
+async def retrieve_post(request, pk):
+    """PostViewSet.retrieve"""
+    post = await Post.objects.for_feed().filter(pk=pk).afirst()
+    if post is None:
+        raise FallBack
+    return respond(PostSerializer(post, context={'request': Request(request)}).data)
+
+
+@comment_condition
+async def retrieve_comment(request, pk):
+    """CommentViewSet.retrieve"""
+    comment = await Comment.objects.select_related('user').filter(pk=pk).afirst()
+    if comment is None:
+        raise FallBack
+    return respond(CommentSerializer(comment, context={'request': Request(request)}).data)
+
+
+async def get_events(request):
+    """Change events after ?since; the long-poll waits without holding a thread"""
+    request = Request(request)
+    try:
+        params = request.query_params
+        limit = KeysetPagination().get_limit(request)
+        wait = events.parse_wait(params.get('wait'))
+        if params.get('since') in (None, ''):
+            return respond({'events': [], 'cursor': await sync_to_async(events.latest_seq)()})
+        since = events.parse_seq(params['since'])
+        await sync_to_async(events.check_cursor)(since)
+        found = await events.await_events(since, limit, wait, request)
+        return respond({
+            'events': found,
+            'cursor': found[-1]['seq'] if found else since
+        })
+    except ValidationError as e:
+        return respond({'errors': e.detail}, status.HTTP_400_BAD_REQUEST)
+    except events.CursorExpired as e:
+        return respond({'error': str(e)}, status.HTTP_410_GONE)
+    except Exception as e:
+        return respond({'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+async def stream_events(request):
+    """Server-Sent Events; an open stream costs no thread between polls"""
+    if request.method != 'GET':
+        raise FallBack
+    try:
+        since = await sync_to_async(events.stream_start)(request)
+    except (ValidationError, events.CursorExpired):
+        raise FallBack
+    return event_stream_response(aiter(events.EventStream(since, request)))
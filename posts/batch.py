@@ -0,0 +1,78 @@
+"""
+Bulk versions of create_post and add_comment.
+
+Every item is validated before anything is written, usernames are resolved
+together, and rows are inserted with bulk_create in one transaction. Because
+bulk_create skips model signals, the comment counters, response cache
+versions and change events they normally maintain are written here explicitly.
+"""
+from collections import Counter
+
+from django.db import transaction
+
+from . import events
+from .db import retry_on_lock
+from .cache import bump_comments_version, bump_feed_version
+from .models import ChangeEvent, Post, Comment
+from .serializers import BatchCommentItemSerializer
+from .users import resolve_usernames
+
+
+def validate_items(items, serializer_class):
+    """Return (validated items, per-item errors); errors is empty when all pass"""
+    validated, errors = [], []
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if serializer.is_valid():
+            validated.append(serializer.validated_data)
+        else:
+            errors.append({'index': index, 'errors': serializer.errors})
+    return validated, errors
+
+
+def validate_comment_items(items):
+    """validate_items for comments, checking every referenced post in one query"""
+    validated, errors = validate_items(items, BatchCommentItemSerializer)
+    if errors:
+        return validated, errors
+    existing = set(
+        Post.objects.filter(pk__in={item['post'] for item in validated}).values_list('pk', flat=True)
+    )
+    for index, item in enumerate(validated):
+        if item['post'] not in existing:
+            errors.append({'index': index, 'errors': {'post': ['Post not found']}})
+    return validated, errors
+
+
+@retry_on_lock
+def create_posts(items):
+    """Insert validated post items; returns the new Post objects in order"""
+    user_ids = resolve_usernames(item['username'] for item in items)
+    with transaction.atomic():
+        posts = Post.objects.bulk_create([
+            Post(user_id=user_ids[item['username']], content=item['content'])
+            for item in items
+        ])
+        events.record_many(ChangeEvent.POST, ChangeEvent.CREATED, [(post.pk, post.pk) for post in posts])
+        bump_feed_version()
+    return posts
+
+
+@retry_on_lock
+def create_comments(items):
+    """Insert validated comment items; returns the new Comment objects in order"""
+    user_ids = resolve_usernames(item['username'] for item in items)
+    with transaction.atomic():
+        comments = Comment.objects.bulk_create([
+            Comment(post_id=item['post'], user_id=user_ids[item['username']], content=item['content'])
+            for item in items
+        ])
+        events.record_many(
+            ChangeEvent.COMMENT, ChangeEvent.CREATED, [(comment.pk, comment.post_id) for comment in comments]
+        )
+        per_post = Counter(comment.post_id for comment in comments)
+        for post_id, added in per_post.items():
+            Post.objects.filter(pk=post_id).add_to_comments_count(added)
+            bump_comments_version(post_id)
+        bump_feed_version()
+    return comments
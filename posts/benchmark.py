@@ -0,0 +1,331 @@
+"""
+In-process benchmark of every endpoint in posts.urls.
+
+Each case below builds one request for a URL name; measure() sends it
+through Django's test client a number of times and records latency
+percentiles, the most queries any request ran and the response size.
+Streaming responses are read to the end inside the timed section, since that
+is where their work happens; event streams end after their first poll
+instead of staying open. The response cache is cleared before every
+request so reads measure the view and serializers rather than a cache hit.
+
+Results can be saved as a JSON baseline and later runs compared against it
+with compare(), which lists every metric that got worse by more than a
+threshold. `manage.py benchmark_endpoints` runs all of this on a throwaway
+database filled by posts.synthetic.
+
+scratch_database() is that throwaway database for every benchmark command:
+a migrated SQLite file in a temporary directory, and the environment that
+points manage.py (or a server) at it. The commands rerun themselves with
+--worker as a child process there, so the database the parent has open,
+including the test database under call_command, is never touched.
+"""
+import gc
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, reverse
+
+from . import urls
+from .models import Post, Comment, Job
+
+PERCENTILES = (50, 95, 99)
+
+# Latency regressions smaller than this many ms are noise, whatever the ratio
+LATENCY_SLACK_MS = 1.0
+
+BATCH_SIZE = 20
+
+CASES = []
+
+
+def case(url_name, method='get'):
+    """Register a function fixture -> (path, data) as the request for url_name"""
+    def register(build):
+        CASES.append((url_name, method, build))
+        return build
+    return register
+
+
+# Reads
+
+@case('api-root')
+def _api_root(fixture):
+    return reverse('api-root'), None
+
+
+@case('post-list')
+def _post_list(fixture):
+    return reverse('post-list'), None
+
+
+@case('post-detail')
+def _post_detail(fixture):
+    return reverse('post-detail', args=[fixture['post']]), None
+
+
+@case('comment-list')
+def _comment_list(fixture):
+    return reverse('comment-list'), None
+
+
+@case('comment-detail')
+def _comment_detail(fixture):
+    return reverse('comment-detail', args=[fixture['comment']]), None
+
+
+@case('get-posts')
+def _get_posts(fixture):
+    return reverse('get-posts'), None
+
+
+@case('get-comments')
+def _get_comments(fixture):
+    return reverse('get-comments', args=[fixture['post']]), None
+
+
+@case('search')
+def _search(fixture):
+    return reverse('search'), {'q': fixture['term']}
+
+
+@case('export')
+def _export(fixture):
+    return reverse('export'), None
+
+
+@case('events')
+def _events(fixture):
+    return reverse('events'), {'since': 0}
+
+
+@case('event-stream')
+def _event_stream(fixture):
+    return reverse('event-stream'), {'since': 0}
+
+
+@case('changes')
+def _changes(fixture):
+    return reverse('changes'), {'since': 0}
+
+
+@case('cache-stats')
+def _cache_stats(fixture):
+    return reverse('cache-stats'), None
+
+
+@case('get-job')
+def _get_job(fixture):
+    return reverse('get-job', args=[fixture['job']]), None
+
+
+@case('stats')
+def _stats(fixture):
+    return reverse('stats'), None
+
+
+@case('health')
+def _health(fixture):
+    return reverse('health'), None
+
+
+# Writes, measured after every read so reads all see the same data
+
+@case('create-post', 'post')
+def _create_post(fixture):
+    return reverse('create-post'), {'content': 'benchmark post', 'username': fixture['username']}
+
+
+@case('add-comment', 'post')
+def _add_comment(fixture):
+    data = {'content': 'benchmark comment', 'username': fixture['username']}
+    return reverse('add-comment', args=[fixture['post']]), data
+
+
+@case('batch-create-posts', 'post')
+def _batch_create_posts(fixture):
+    posts = [{'content': f'batch post {i}', 'username': fixture['username']} for i in range(BATCH_SIZE)]
+    return reverse('batch-create-posts'), {'posts': posts}
+
+
+@case('batch-add-comments', 'post')
+def _batch_add_comments(fixture):
+    comments = [
+        {'post': fixture['post'], 'content': f'batch comment {i}', 'username': fixture['username']}
+        for i in range(BATCH_SIZE)
+    ]
+    return reverse('batch-add-comments'), {'comments': comments}
+
+
+@case('delete-post', 'delete')
+def _delete_post(fixture):
+    # A fresh post per request; creating it is not part of the timing
+    post = Post.objects.create(user_id=fixture['user'], content='to be deleted')
+    return reverse('delete-post', args=[post.pk]), None
+
+
+def url_names(patterns=None):
+    """Every named URL in posts.urls, including the router's"""
+    names = set()
+    for pattern in urls.urlpatterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            names |= url_names(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+def missing_endpoints():
+    """URL names that have no benchmark case"""
+    return url_names() - {url_name for url_name, _, _ in CASES}
+
+
+def build_fixture():
+    """Pick the objects the cases point at: the newest commented post and so on"""
+    post = Post.objects.filter(comments_count__gt=0).select_related('user').order_by('-id').first()
+    if post is None:
+        raise ValueError('The benchmark needs at least one post with a comment')
+    comment = Comment.objects.filter(post=post).order_by('id').first()
+    job = Job.objects.create(name='benchmark', status=Job.SUCCEEDED)
+    return {
+        'post': post.pk,
+        'comment': comment.pk,
+        'user': post.user_id,
+        'username': post.user.username,
+        'job': job.pk,
+        'term': post.content.split()[0],
+    }
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[rank - 1]
+
+
+def _send(client, method, path, data):
+    if method == 'get':
+        return client.get(path, data)
+    if method == 'post':
+        return client.post(path, data, content_type='application/json')
+    return client.generic(method.upper(), path)
+
+
+def _run_once(client, url_name, method, build, fixture):
+    path, data = build(fixture)
+    cache.clear()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = _send(client, method, path, data)
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        elapsed = (time.perf_counter() - started) * 1000
+    if response.status_code >= 400:
+        raise RuntimeError(f'{url_name}: {method.upper()} {path} returned {response.status_code}')
+    return elapsed, len(queries), size
+
+
+def measure(requests=20, warmup=2, progress=None):
+    """
+    Run every case warmup + requests times and return
+    {url_name: {'p50', 'p95', 'p99', 'queries', 'bytes'}} with times in ms.
+    """
+    client = Client()
+    fixture = build_fixture()
+    results = {}
+    with override_settings(EVENTS_STREAM_SECONDS=0):
+        for url_name, method, build in CASES:
+            for _ in range(warmup):
+                _run_once(client, url_name, method, build, fixture)
+            timings, queries, sizes = [], [], []
+            # As timeit does: a collection landing in one request is noise
+            gc.collect()
+            gc.disable()
+            try:
+                for _ in range(requests):
+                    elapsed, count, size = _run_once(client, url_name, method, build, fixture)
+                    timings.append(elapsed)
+                    queries.append(count)
+                    sizes.append(size)
+            finally:
+                gc.enable()
+            result = {f'p{p}': round(percentile(timings, p), 3) for p in PERCENTILES}
+            result.update(queries=max(queries), bytes=round(statistics.median(sizes)))
+            results[url_name] = result
+            if progress:
+                progress(url_name, result)
+    return results
+
+
+def compare(results, baseline, threshold=0.5):
+    """
+    Return a description of every regression against baseline: a p50 more
+    than threshold (a fraction) slower, any extra query, or a response more
+    than threshold larger. p95 and p99 are reported but, over a few dozen
+    requests, too noisy to gate on.
+    """
+    regressions = []
+    for url_name, before in baseline.items():
+        after = results.get(url_name)
+        if after is None:
+            continue
+        slower = after['p50'] - before['p50']
+        if after['p50'] > before['p50'] * (1 + threshold) and slower > LATENCY_SLACK_MS:
+            regressions.append(f"{url_name}: p50 {before['p50']:.2f}ms -> {after['p50']:.2f}ms")
+        if after['queries'] > before['queries']:
+            regressions.append(f"{url_name}: queries {before['queries']} -> {after['queries']}")
+        if after['bytes'] > before['bytes'] * (1 + threshold):
+            regressions.append(f"{url_name}: bytes {before['bytes']} -> {after['bytes']}")
+    return regressions
+
+
+class ScratchDatabase:
+    """A migrated SQLite database in directory and how to run manage.py against it"""
+
+    def __init__(self, directory, **env):
+        self.env = dict(
+            os.environ,
+            DJANGO_DB_PATH=os.path.join(directory, 'scratch.sqlite3'),
+            DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'),
+            **env,
+        )
+        self.run('migrate', '--verbosity', '0', check=True)
+
+    def command(self, *args):
+        return [sys.executable, str(settings.BASE_DIR / 'manage.py'), *map(str, args)]
+
+    def run(self, *args, **kwargs):
+        """subprocess.run of manage.py with args"""
+        return subprocess.run(self.command(*args), env=self.env, **kwargs)
+
+    def start(self, *args, **kwargs):
+        """subprocess.Popen of manage.py with args"""
+        return subprocess.Popen(self.command(*args), env=self.env, **kwargs)
+
+    def worker(self, name, *args):
+        """Run `manage.py name --worker args`; returns its stdout"""
+        process = self.run(name, '--worker', *args, stdout=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            raise CommandError(f'{name} worker exited with {process.returncode}')
+        return process.stdout
+
+
+@contextmanager
+def scratch_database(**env):
+    """Yield a ScratchDatabase, with env added to its environment, and remove it afterwards"""
+    with tempfile.TemporaryDirectory() as directory:
+        yield ScratchDatabase(directory, **env)
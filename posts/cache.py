@@ -0,0 +1,147 @@
+"""
+Versioned response cache for the feed and comment threads.
+
+Cached entries are never deleted. Instead every key embeds a version number
+that write paths bump (see posts.signals), so a write simply makes the old
+entries unreachable and they age out on their own. Only plain get/set/add/incr
+are used, so any Django cache backend works, including local-memory and
+file-based caches.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+FEED_VERSION_KEY = 'posts:feed:version'
+USERS_VERSION_KEY = 'posts:users:version'
+HITS_KEY = 'posts:cache:hits'
+MISSES_KEY = 'posts:cache:misses'
+
+
+def comments_version_key(post_id):
+    return f'posts:comments:{post_id}:version'
+
+
+def _incr(key):
+    """Increment a counter, creating it if it does not exist yet"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock rather than 1: if the version key is ever evicted
+        # the new sequence must not collide with entries cached under the old one
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key) or time.time_ns()
+    return version
+
+
+async def _aincr(key):
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        if await cache.aadd(key, 1, timeout=None):
+            return 1
+        return await cache.aincr(key)
+
+
+async def aget_version(key):
+    """get_version for async views"""
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key) or time.time_ns()
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def bump_feed_version():
+    """Invalidate cached feed pages once the current transaction commits"""
+    transaction.on_commit(lambda: bump_version(FEED_VERSION_KEY))
+
+
+def bump_users_version():
+    """Invalidate every process's username lookup cache once the current transaction commits"""
+    transaction.on_commit(lambda: bump_version(USERS_VERSION_KEY))
+
+
+def bump_comments_version(post_id):
+    """Invalidate a post's cached comment pages once the current transaction commits"""
+    transaction.on_commit(lambda: bump_version(comments_version_key(post_id)))
+
+
+def bump_comments_versions(post_ids):
+    """
+    bump_comments_version for many posts at once, for bulk writes. New
+    versions are clock values (as get_version seeds them) written with one
+    set_many, instead of an incr per post.
+    """
+    keys = [comments_version_key(post_id) for post_id in post_ids]
+    if keys:
+        transaction.on_commit(
+            lambda: cache.set_many({key: time.time_ns() for key in keys}, timeout=None)
+        )
+
+
+def response_key(namespace, version, request):
+    """
+    Build a cache key from the version and everything in the request that
+    changes the body: the query string, and the host because image URLs are
+    absolute.
+    """
+    raw = f'{request.scheme}://{request.get_host()}{request.get_full_path()}'
+    digest = hashlib.sha1(raw.encode()).hexdigest()
+    return f'posts:{namespace}:v{version}:{digest}'
+
+
+def cached_data(key, build):
+    """Return the cached payload for key, building and storing it on a miss"""
+    data = cache.get(key)
+    if data is not None:
+        _incr(HITS_KEY)
+        return data
+    _incr(MISSES_KEY)
+    data = build()
+    cache.set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+    return data
+
+
+async def acached_data(key, build):
+    """cached_data for async views; build is a coroutine function"""
+    data = await cache.aget(key)
+    if data is not None:
+        await _aincr(HITS_KEY)
+        return data
+    await _aincr(MISSES_KEY)
+    data = await build()
+    await cache.aset(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+    return data
+
+
+def cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,153 @@
+"""
+Conditional GET support for the read endpoints.
+
+Validators never look at the serialized body, so a client that already has
+the current representation gets a 304 without any serialization work.
+
+The feed's ETag is the newest change event id (posts.events): every write
+that can change a feed page appends an event in its own transaction, user
+renames included, so it is one primary-key lookup instead of scanning both
+tables for counts and maxima, and every process reads the same value. The
+feed has no Last-Modified, so clients revalidate it with If-None-Match.
+A post or comment is validated from its own row (and its post's comment
+aggregates) plus the users version (posts.cache), so a renamed author
+changes the ETag.
+
+Async views (posts.async_views) get the same validators from the async ORM:
+they are computed before Django's condition() runs and left on the request,
+where its callbacks find them without a query.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+from .cache import USERS_VERSION_KEY, aget_version, get_version
+from .events import alatest_seq, latest_seq
+from .models import Post, Comment
+
+_VALIDATORS_ATTR = '_posts_validators'
+
+
+def _newest(*timestamps):
+    timestamps = [t for t in timestamps if t is not None]
+    return max(timestamps) if timestamps else None
+
+
+def conditional(compute, acompute):
+    """
+    Build a view decorator answering If-None-Match/If-Modified-Since from
+    compute(request, *args, **kwargs), which returns a (parts, last_modified)
+    pair, or None when there is nothing to validate (e.g. a missing object).
+    acompute is the same as a coroutine function, used for async views.
+    """
+    def validators(request, *args, **kwargs):
+        # The ETag and Last-Modified callbacks share one lookup per request
+        if not hasattr(request, _VALIDATORS_ATTR):
+            setattr(request, _VALIDATORS_ATTR, compute(request, *args, **kwargs))
+        return getattr(request, _VALIDATORS_ATTR)
+
+    def etag(request, *args, **kwargs):
+        result = validators(request, *args, **kwargs)
+        if result is None:
+            return None
+        parts, _ = result
+        # Pages and hosts (absolute image URLs) have different bodies
+        raw = ':'.join([request.get_host(), request.get_full_path(), *map(str, parts)])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        result = validators(request, *args, **kwargs)
+        return result[1] if result else None
+
+    decorate = condition(etag_func=etag, last_modified_func=last_modified)
+
+    def decorator(view):
+        if not iscoroutinefunction(view):
+            return decorate(view)
+        conditional_view = decorate(view)
+
+        @wraps(view)
+        async def async_view(request, *args, **kwargs):
+            setattr(request, _VALIDATORS_ATTR, await acompute(request, *args, **kwargs))
+            return await conditional_view(request, *args, **kwargs)
+        return async_view
+
+    return decorator
+
+
+def _feed_validators(request, *args, **kwargs):
+    return (latest_seq(),), None
+
+
+async def _afeed_validators(request, *args, **kwargs):
+    return (await alatest_seq(),), None
+
+
+def feed_position(request):
+    """
+    The event id the feed's ETag was computed from, to key its cached body
+    on: a body cached before a write can't be served under the new ETag
+    """
+    validators = getattr(request, _VALIDATORS_ATTR, None)
+    return validators[0][0] if validators else latest_seq()
+
+
+async def afeed_position(request):
+    """feed_position for async views"""
+    validators = getattr(request, _VALIDATORS_ATTR, None)
+    return validators[0][0] if validators else await alatest_seq()
+
+
+def _post_row(pk=None, post_id=None):
+    return (
+        Post.objects.filter(pk=pk if pk is not None else post_id)
+        .annotate(
+            comment_total=Count('comments'),
+            comment_max_id=Max('comments__id'),
+            comment_modified=Max('comments__updated_at'),
+        )
+        .values('updated_at', 'comment_total', 'comment_max_id', 'comment_modified')
+    )
+
+
+def _post_result(row, users_version):
+    if row is None:
+        return None
+    parts = (row['updated_at'], row['comment_total'], row['comment_max_id'], row['comment_modified'], users_version)
+    return parts, _newest(row['updated_at'], row['comment_modified'])
+
+
+def _post_validators(request, *args, pk=None, post_id=None, **kwargs):
+    return _post_result(_post_row(pk, post_id).first(), get_version(USERS_VERSION_KEY))
+
+
+async def _apost_validators(request, *args, pk=None, post_id=None, **kwargs):
+    return _post_result(await _post_row(pk, post_id).afirst(), await aget_version(USERS_VERSION_KEY))
+
+
+def _comment_result(row, users_version):
+    if row is None:
+        return None
+    return (row['id'], row['updated_at'], users_version), row['updated_at']
+
+
+def _comment_validators(request, *args, pk=None, **kwargs):
+    return _comment_result(
+        Comment.objects.filter(pk=pk).values('id', 'updated_at').first(), get_version(USERS_VERSION_KEY),
+    )
+
+
+async def _acomment_validators(request, *args, pk=None, **kwargs):
+    return _comment_result(
+        await Comment.objects.filter(pk=pk).values('id', 'updated_at').afirst(),
+        await aget_version(USERS_VERSION_KEY),
+    )
+
+
+feed_condition = conditional(_feed_validators, _afeed_validators)
+post_condition = conditional(_post_validators, _apost_validators)
+comment_condition = conditional(_comment_validators, _acomment_validators)
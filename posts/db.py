@@ -0,0 +1,70 @@
+"""
+Helpers for running writes against SQLite under concurrent workers.
+"""
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+
+def is_lock_error(error):
+    message = str(error).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_on_lock(func):
+    """
+    Re-run func when SQLite reports lock contention that outlasted the busy
+    timeout. func must be its own transaction: inside an outer atomic block
+    the failed statement can't be retried on its own, so the error is raised.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = settings.SQLITE_LOCK_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if attempt == retries or connection.in_atomic_block or not is_lock_error(e):
+                    raise
+                # Jittered exponential backoff so retrying writers spread out
+                delay = settings.SQLITE_LOCK_RETRY_DELAY * 2 ** attempt
+                time.sleep(delay * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+# Settings for one connection while it bulk loads: skip fsyncs (a crash may
+# lose the last batches, which a resumable import re-runs anyway), give the
+# page cache 256MB and keep sort/temp structures in memory
+BULK_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'cache_size': -262144,
+    'temp_store': 'MEMORY',
+}
+
+
+@contextmanager
+def bulk_load():
+    """
+    Apply BULK_LOAD_PRAGMAS for the duration, then restore the previous
+    values. Does nothing inside a transaction, where SQLite refuses to change
+    synchronous.
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+    previous = {}
+    with connection.cursor() as cursor:
+        for name, value in BULK_LOAD_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}')
+            previous[name] = cursor.fetchone()[0]
+            cursor.execute(f'PRAGMA {name} = {value}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for name, value in previous.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,281 @@
+"""
+Append-only log of post and comment changes, so clients can follow the site
+by applying deltas instead of refetching the feed.
+
+Every write to a post or comment appends a ChangeEvent in the same
+transaction: the model signals in posts.signals cover single writes, and the
+bulk paths (posts.batch, posts.importer, posts.synthetic) call record_many.
+Renaming a user logs an update of each of their posts and comments, since
+those embed the username. The newest id therefore changes with everything a
+feed page shows, which is what posts.conditional validates the feed with.
+Event ids come from an AUTOINCREMENT key and SQLite admits one writer at a
+time, so ids grow in commit order and a client that has seen event N has
+seen everything before it.
+
+Events only name the object. events_since() attaches its current serialized
+form, and for comment events the current form of the post too (its count
+and comment preview change with every comment), so a client catching up on
+a backlog gets each object as it is now and applying an event twice is
+harmless. Objects deleted since come back as None; their deleted event
+follows. Comments deleted along with their post get no events of their
+own; the post's deleted event covers its thread.
+
+Clients read the log as JSON from /api/events/, optionally long-polling with
+wait, or as Server-Sent Events from /api/events/stream/. Both poll the
+table's primary key, so an idle check is one indexed lookup. /api/changes/
+collapses the same events into the current state of what changed plus
+tombstones, for a client syncing a local copy.
+
+The log is kept for EVENTS_RETENTION_DAYS; `manage.py compact_events` drops
+older entries. A cursor from before the oldest kept entry can't be answered
+(CursorExpired) and the client starts over from a full load.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import fast_serializers
+from .models import ChangeEvent, Post, Comment
+
+
+def record(kind, action, object_id, post_id):
+    """Append one event; call inside the transaction making the change"""
+    ChangeEvent.objects.create(kind=kind, action=action, object_id=object_id, post_id=post_id)
+
+
+def record_many(kind, action, pairs):
+    """Append one event per (object_id, post_id) pair, for bulk writes"""
+    ChangeEvent.objects.bulk_create([
+        ChangeEvent(kind=kind, action=action, object_id=object_id, post_id=post_id)
+        for object_id, post_id in pairs
+    ])
+
+
+class CursorExpired(Exception):
+    """The events after a cursor have been compacted away; the client must reload"""
+
+
+def latest_seq():
+    """Sequence number of the newest event, 0 when there are none"""
+    return ChangeEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+async def alatest_seq():
+    """latest_seq for async views"""
+    return await ChangeEvent.objects.order_by('-id').values_list('id', flat=True).afirst() or 0
+
+
+def history_start():
+    """
+    The oldest cursor the log can still answer for: every event after it is
+    kept. Compaction deletes from the start and ids have no gaps, so it is
+    the oldest kept id minus one.
+    """
+    first = ChangeEvent.objects.order_by('id').values_list('id', flat=True).first()
+    return first - 1 if first else 0
+
+
+def check_cursor(seq):
+    """Raise CursorExpired when events after seq may have been compacted"""
+    if seq < history_start():
+        raise CursorExpired(f'Changes after {seq} are no longer kept; reload and resume from the new cursor')
+
+
+def parse_seq(value, name='since'):
+    """A sequence number from a query parameter or header, or ValidationError"""
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({name: 'Must be an integer'})
+    if seq < 0:
+        raise ValidationError({name: 'Must not be negative'})
+    return seq
+
+
+def parse_wait(value):
+    """Seconds a long-poll may wait, capped at EVENTS_MAX_WAIT; 0 when not given"""
+    if value in (None, ''):
+        return 0.0
+    try:
+        wait = float(value)
+    except ValueError:
+        raise ValidationError({'wait': 'Must be a number of seconds'})
+    if not wait >= 0:
+        raise ValidationError({'wait': 'Must not be negative'})
+    return min(wait, settings.EVENTS_MAX_WAIT)
+
+
+def stream_start(request):
+    """Where an event stream starts: Last-Event-ID on a reconnect, else since, else now"""
+    value = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    if value in (None, ''):
+        return latest_seq()
+    seq = parse_seq(value)
+    check_cursor(seq)
+    return seq
+
+
+def _serialize(kind, ids, request):
+    """{id: serialized form} for the posts or comments among ids that still exist"""
+    if not ids:
+        return {}
+    if kind == ChangeEvent.POST:
+        rows = list(fast_serializers.post_values(Post.objects.filter(pk__in=ids).order_by('pk')))
+        data = fast_serializers.serialize_posts(rows, request)
+    else:
+        rows = fast_serializers.comment_values(Comment.objects.filter(pk__in=ids).order_by('pk'))
+        data = fast_serializers.serialize_comments(rows)
+    return {item['id']: item for item in data}
+
+
+def _current_objects(events, request):
+    """Serialized form of every live object the events name, and their posts, by (kind, id)"""
+    wanted = {ChangeEvent.POST: set(), ChangeEvent.COMMENT: set()}
+    for event in events:
+        if event.action != ChangeEvent.DELETED:
+            wanted[event.kind].add(event.object_id)
+        wanted[ChangeEvent.POST].add(event.post_id)
+    return {
+        (kind, pk): data
+        for kind, ids in wanted.items()
+        for pk, data in _serialize(kind, ids, request).items()
+    }
+
+
+def events_since(seq, limit, request=None):
+    """
+    Up to limit events after seq, oldest first, each as
+    {'seq', 'type' ('post.created' and so on), 'id', 'post', 'data'}, plus
+    'post_data' for comment events.
+    """
+    events = list(ChangeEvent.objects.filter(id__gt=seq).order_by('id')[:limit])
+    found = _current_objects(events, request)
+    result = []
+    for event in events:
+        item = {
+            'seq': event.id,
+            'type': f'{event.kind}.{event.action}',
+            'id': event.object_id,
+            'post': event.post_id,
+            'data': found.get((event.kind, event.object_id)),
+        }
+        if event.kind == ChangeEvent.COMMENT:
+            item['post_data'] = found.get((ChangeEvent.POST, event.post_id))
+        result.append(item)
+    return result
+
+
+def changes_since(seq, limit, request=None):
+    """
+    What changed after seq, reading at most limit events: the current form
+    of every post and comment created or updated since, and tombstones (ids
+    under 'deleted') for those deleted since; a post's tombstone stands for
+    its comments too. Each object appears once however often it changed.
+    The work is proportional to the events read, not to the tables.
+    """
+    events = list(
+        ChangeEvent.objects.filter(id__gt=seq).order_by('id')
+        .values_list('id', 'kind', 'action', 'object_id')[:limit]
+    )
+    # The last action per object wins
+    last_action = {}
+    for _, kind, action, object_id in events:
+        last_action[kind, object_id] = action
+    changes = {}
+    deleted = {}
+    for kind, key in ((ChangeEvent.POST, 'posts'), (ChangeEvent.COMMENT, 'comments')):
+        touched = {pk for (k, pk) in last_action if k == kind}
+        live = _serialize(kind, {pk for pk in touched if last_action[kind, pk] != ChangeEvent.DELETED}, request)
+        changes[key] = list(live.values())
+        deleted[key] = sorted(touched - live.keys())
+    return {
+        **changes,
+        'deleted': deleted,
+        'cursor': events[-1][0] if events else seq,
+        'has_more': len(events) == limit,
+    }
+
+
+def wait_for_events(seq, limit, wait, request=None):
+    """events_since, polling for up to wait seconds while there are none"""
+    deadline = time.monotonic() + wait
+    while True:
+        events = events_since(seq, limit, request)
+        if events or time.monotonic() >= deadline:
+            return events
+        time.sleep(settings.EVENTS_POLL_INTERVAL)
+
+
+async def await_events(seq, limit, wait, request=None):
+    """wait_for_events for async views"""
+    deadline = time.monotonic() + wait
+    read = sync_to_async(events_since)
+    while True:
+        events = await read(seq, limit, request)
+        if events or time.monotonic() >= deadline:
+            return events
+        await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+
+
+class EventStream:
+    """
+    The body of a Server-Sent Events response: every event after seq as it
+    is written, with a comment line as heartbeat while idle. The response
+    ends after EVENTS_STREAM_SECONDS so a worker isn't held forever; clients
+    reconnect (EventSource does so by itself) sending the last id they saw
+    as Last-Event-ID. Iterate it under WSGI, async-iterate it under ASGI.
+    """
+
+    def __init__(self, seq, request=None, limit=100):
+        self.seq = seq
+        self.request = request
+        self.limit = limit
+        self.encoder = JSONEncoder()
+
+    def _start(self):
+        now = time.monotonic()
+        self.deadline = now + settings.EVENTS_STREAM_SECONDS
+        self.last_sent = now
+        return f'retry: {settings.EVENTS_RETRY_MS}\n\n'
+
+    def _poll(self):
+        """Chunks for everything new since the last poll, or a heartbeat when due"""
+        events = events_since(self.seq, self.limit, self.request)
+        now = time.monotonic()
+        if events:
+            self.seq = events[-1]['seq']
+            self.last_sent = now
+            return [
+                f"id: {event['seq']}\nevent: {event['type']}\ndata: {self.encoder.encode(event)}\n\n"
+                for event in events
+            ], len(events) == self.limit
+        if now - self.last_sent >= settings.EVENTS_HEARTBEAT_SECONDS:
+            self.last_sent = now
+            return [': keep-alive\n\n'], False
+        return [], False
+
+    def __iter__(self):
+        yield self._start()
+        while True:
+            chunks, more = self._poll()
+            yield from chunks
+            if time.monotonic() >= self.deadline:
+                return
+            if not more:
+                time.sleep(settings.EVENTS_POLL_INTERVAL)
+
+    async def __aiter__(self):
+        yield self._start()
+        poll = sync_to_async(self._poll)
+        while True:
+            chunks, more = await poll()
+            for chunk in chunks:
+                yield chunk
+            if time.monotonic() >= self.deadline:
+                return
+            if not more:
+                await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
@@ -0,0 +1,162 @@
+"""
+NDJSON export of posts and comments.
+
+Rows are read in keyset batches on (created_at, id) with .values(), so memory
+stays flat however large the tables are, and each batch is encoded into one
+chunk of newline-terminated JSON records. The same generator backs the
+/api/export/ streaming response and `manage.py export_ndjson`; under ASGI
+the response async-iterates it with achunks(), so Django streams it instead
+of collecting it into a list first.
+
+Comments are either nested in their post's record (every comment of that
+post) or emitted as separate "comment" records after all posts, filtered by
+their own created_at and ordered by id.
+"""
+import zlib
+from datetime import datetime, time
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Post, Comment
+
+NESTED = 'nested'
+SEPARATE = 'separate'
+COMMENT_MODES = (NESTED, SEPARATE)
+
+POST_FIELDS = (
+    'id', 'user_id', 'user__username', 'content', 'image', 'image_width',
+    'image_height', 'image_variants', 'comments_count', 'created_at', 'updated_at',
+)
+COMMENT_FIELDS = ('id', 'post_id', 'user_id', 'user__username', 'content', 'created_at', 'updated_at')
+
+encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+
+def parse_bound(value, end_of_day=False):
+    """
+    Parse a since/until value: an ISO datetime, or a date meaning the start
+    (or, for until, the end) of that day. Naive values use the current time
+    zone. Raises ValueError if value is neither.
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Not an ISO date or datetime: {value}')
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _window(queryset, since, until):
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created_at__lte=until)
+    return queryset
+
+
+def _batches(queryset, fields, chunk_size, by_created=True):
+    """
+    Yield lists of value dicts, oldest first, one keyset page at a time.
+    Posts page on the (created_at, id) index; comments have no such index and
+    page on id instead, which follows creation order.
+    """
+    queryset = queryset.order_by(*(('created_at', 'id') if by_created else ('id',))).values(*fields)
+    rows = list(queryset[:chunk_size])
+    while rows:
+        yield rows
+        if len(rows) < chunk_size:
+            break
+        last = rows[-1]
+        after = Q(id__gt=last['id'])
+        if by_created:
+            after = Q(created_at__gt=last['created_at']) | Q(created_at=last['created_at'], id__gt=last['id'])
+        rows = list(queryset.filter(after)[:chunk_size])
+
+
+def _record(kind, row):
+    row['username'] = row.pop('user__username')
+    return {'type': kind, **row}
+
+
+def _nested_comments(post_ids):
+    comments = {post_id: [] for post_id in post_ids}
+    rows = (
+        Comment.objects.filter(post_id__in=post_ids)
+        .order_by('post_id', 'created_at', 'id')
+        .values(*COMMENT_FIELDS)
+    )
+    for row in rows.iterator():
+        row['username'] = row.pop('user__username')
+        comments[row.pop('post_id')].append(row)
+    return comments
+
+
+def records(since=None, until=None, comments=NESTED, chunk_size=1000):
+    """Yield lists of export records, one list per batch of rows"""
+    posts = _window(Post.objects.all(), since, until)
+    for rows in _batches(posts, POST_FIELDS, chunk_size):
+        batch = [_record('post', row) for row in rows]
+        if comments == NESTED:
+            by_post = _nested_comments([row['id'] for row in rows])
+            for record in batch:
+                record['comments'] = by_post[record['id']]
+        yield batch
+
+    if comments == SEPARATE:
+        comment_rows = _window(Comment.objects.all(), since, until)
+        for rows in _batches(comment_rows, COMMENT_FIELDS, chunk_size, by_created=False):
+            yield [_record('comment', row) for row in rows]
+
+
+def ndjson_chunks(since=None, until=None, comments=NESTED, chunk_size=1000, compress=False):
+    """
+    Yield the export as bytes, one chunk per batch, optionally as a single
+    gzip stream.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    for batch in records(since, until, comments, chunk_size):
+        chunk = ''.join(encoder.encode(record) + '\n' for record in batch).encode()
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+            if not chunk:
+                continue
+        yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+
+
+async def achunks(chunks):
+    """
+    Async-iterate a chunk generator such as ndjson_chunks(), running each
+    step in the thread that holds the database connection
+    """
+    step = sync_to_async(next)
+    try:
+        while (chunk := await step(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
+
+
+def accepts_gzip(header):
+    """Whether an Accept-Encoding header allows gzip, honouring q-values (RFC 9110)"""
+    qualities = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
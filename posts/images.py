@@ -0,0 +1,115 @@
+"""
+Resized derivatives of uploaded post images.
+
+Each upload is decoded once, right after it is stored, and written out at a
+few fixed widths in every configured format. Clients then pick the smallest
+variant that fits instead of downloading and decoding the original.
+Variants are saved through the content-addressed storage (posts.storage),
+so the same image posted twice shares its variant files too.
+"""
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+# EXIF orientations that swap width and height
+ORIENTATION_TAG = 0x0112
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Pillow save() format name and options per output format
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+VARIANT_DIR = posixpath.join('posts', 'variants')
+
+
+class ImageTooLarge(ValueError):
+    """The stored image has more pixels than MEDIA_MAX_IMAGE_PIXELS"""
+
+
+def _target_widths(original_width):
+    # Never upscale: widths wider than the original collapse onto it
+    return sorted({min(width, original_width) for width in settings.IMAGE_VARIANT_WIDTHS})
+
+
+def _flatten(image, fmt):
+    """Convert to a mode the output format can store; JPEG gets a white background"""
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    if fmt == 'JPEG':
+        if has_alpha:
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            return background
+        return image if image.mode == 'RGB' else image.convert('RGB')
+    target = 'RGBA' if has_alpha else 'RGB'
+    return image if image.mode == target else image.convert(target)
+
+
+def build_variants(post):
+    """
+    Decode post.image once and store every width/format derivative.
+
+    Returns (width, height, variants) where variants is a list of
+    {'width', 'height', 'format', 'path'} dicts ordered by width.
+    """
+    with post.image.open('rb') as source:
+        image = Image.open(source)
+        original_width, original_height = image.size
+        # Uploads are checked before they are stored (posts.uploads); this
+        # covers files that got here another way, before any pixel is decoded
+        if original_width * original_height > settings.MEDIA_MAX_IMAGE_PIXELS:
+            raise ImageTooLarge(f'{post.image.name} is {original_width}x{original_height} pixels')
+        if image.getexif().get(ORIENTATION_TAG) in ROTATED_ORIENTATIONS:
+            original_width, original_height = original_height, original_width
+        # Let the JPEG decoder downscale by a power of two while decoding; it
+        # never goes below the requested box, so every variant stays sharp
+        largest = max(settings.IMAGE_VARIANT_WIDTHS)
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    stem = posixpath.splitext(posixpath.basename(post.image.name))[0]
+    variants = []
+    for width in _target_widths(original_width):
+        height = max(1, round(original_height * width / original_width))
+        if image.size == (width, height):
+            resized = image
+        else:
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        for ext, (fmt, options) in FORMATS.items():
+            if ext not in settings.IMAGE_VARIANT_FORMATS:
+                continue
+            buffer = BytesIO()
+            _flatten(resized, fmt).save(buffer, fmt, **options)
+            name = posixpath.join(VARIANT_DIR, f'{stem}-{width}w.{ext}')
+            path = default_storage.save(name, ContentFile(buffer.getvalue()))
+            variants.append({'width': width, 'height': height, 'format': ext, 'path': path})
+    return original_width, original_height, variants
+
+
+def process_post_image(post):
+    """
+    Generate derivatives for post.image and record them on the post. The
+    variants it replaces are released by posts.signals when the post is saved.
+    """
+    if not post.image:
+        post.image_width = post.image_height = None
+        post.image_variants = []
+    else:
+        post.image_width, post.image_height, post.image_variants = build_variants(post)
+    with transaction.atomic():
+        post.save(update_fields=['image_width', 'image_height', 'image_variants', 'updated_at'])
+        # Saving took the write lock, so no file can be deleted from here to
+        # commit; one identical to a variant released elsewhere may have gone
+        # before it. The job then fails and the retry stores it again.
+        missing = [v['path'] for v in post.image_variants if not default_storage.exists(v['path'])]
+        if missing:
+            raise FileNotFoundError(f"Variants deleted before they were recorded: {', '.join(missing)}")
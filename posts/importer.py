@@ -0,0 +1,371 @@
+"""
+Bulk import of users, posts and comments from NDJSON or CSV files.
+
+Files are streamed a record at a time. Records are buffered and written in
+batches, one transaction per batch, with each username looked up (or
+created) once per import and remembered in Importer.user_ids. Posts and
+comments go in as multi-row INSERTs with thousands of rows per statement:
+FTS5 (posts.search) flushes its pending index at every statement, so rows per
+statement is what bounds throughput.
+Like bulk_create this skips model signals, so comment counters, media
+reference counts, change events and response cache versions are written
+here, as in posts.batch, for the rows actually inserted.
+
+The NDJSON layout is the one posts.export writes: one object per line with a
+"type" of user, post or comment. Posts may carry their comments nested under
+"comments". CSV files hold one record per row, with a type column or a type
+given by the caller.
+
+Records that carry an "id" keep it, and rows whose id already exists are left
+alone and counted as skipped, along with the comments nested under such a
+post. That makes re-running a batch harmless, which is what lets an
+interrupted import resume from its last committed batch.
+"""
+import csv
+import gzip
+import json
+import os
+from collections import ChainMap, Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import storage
+from .cache import bump_comments_versions, bump_feed_version
+from .db import retry_on_lock
+from .models import ChangeEvent, Post, Comment
+
+FORMATS = {'.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'ndjson', '.csv': 'csv'}
+RECORD_TYPES = ('user', 'post', 'comment')
+
+
+class ImportFileError(Exception):
+    """A record that can't be read at all; the import stops there"""
+
+
+def detect_format(path):
+    """ndjson or csv from the file extension, ignoring a trailing .gz"""
+    stem = path[:-3] if path.endswith('.gz') else path
+    fmt = FORMATS.get(os.path.splitext(stem)[1].lower())
+    if fmt is None:
+        raise ImportFileError(f'{path}: can\'t tell the format from the extension; pass one explicitly')
+    return fmt
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_records(path, fmt, default_type=None, start=0):
+    """
+    Yield (number, record) for every record in path, numbering from 1 and
+    skipping the first start records (without decoding them, for NDJSON).
+    """
+    with _open(path) as handle:
+        if fmt == 'csv':
+            for number, row in enumerate(csv.DictReader(handle), 1):
+                if number <= start:
+                    continue
+                # Empty cells mean "not given"
+                record = {key: value for key, value in row.items() if value not in ('', None)}
+                record.setdefault('type', default_type)
+                yield number, record
+            return
+
+        number = 0
+        for line in handle:
+            if not line.strip():
+                continue
+            number += 1
+            if number <= start:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ImportFileError(f'{path}: record {number} is not valid JSON: {e}')
+            if not isinstance(record, dict):
+                raise ImportFileError(f'{path}: record {number} is not a JSON object')
+            record.setdefault('type', default_type)
+            yield number, record
+
+
+# Bind parameters per INSERT: SQLite's default limit since 3.32. Django's
+# bulk_create stays under 999, which means many more statements per batch.
+MAX_QUERY_PARAMS = 32766
+
+POST_FIELDS = (
+    'id', 'user', 'content', 'image', 'image_width', 'image_height',
+    'image_variants', 'created_at', 'updated_at', 'comments_count',
+)
+COMMENT_FIELDS = ('id', 'post', 'user', 'content', 'created_at', 'updated_at')
+EVENT_FIELDS = ('kind', 'action', 'object_id', 'post_id', 'created_at')
+USER_FIELDS = (
+    'username', 'password', 'is_superuser', 'first_name', 'last_name',
+    'email', 'is_staff', 'is_active', 'date_joined',
+)
+
+
+def _int(value):
+    return None if value is None else int(value)
+
+
+def _db_datetime(moment):
+    # The storage format Django's SQLite backend uses: naive UTC
+    return moment.astimezone(dt_timezone.utc).replace(tzinfo=None).isoformat(' ')
+
+
+def _timestamp(value, default):
+    if value is None:
+        return default
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f'invalid datetime {value!r}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return _db_datetime(moment)
+
+
+def insert_rows(model, fields, rows, ignore_conflicts=False, returning=False):
+    """
+    Multi-row INSERT of value tuples ordered like fields, with as many rows
+    per statement as the parameter limit allows. Values must already be in
+    database form. With returning, the new ids come back in row order (the
+    same guarantee Django's bulk_create relies on for SQLite).
+    """
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    placeholder = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    verb = 'INSERT OR IGNORE' if ignore_conflicts else 'INSERT'
+    per_statement = max(1, MAX_QUERY_PARAMS // len(fields))
+    ids = []
+    # A plain backend cursor: with DEBUG on, connection.cursor() would log
+    # (and keep in connection.queries) every multi-megabyte statement
+    connection.ensure_connection()
+    cursor = connection.create_cursor()
+    try:
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            sql = f"{verb} INTO {table} ({columns}) VALUES {', '.join([placeholder] * len(chunk))}"
+            if returning:
+                sql += ' RETURNING ' + quote(model._meta.pk.column)
+            cursor.execute(sql, [value for row in chunk for value in row])
+            if returning:
+                ids.extend(row[0] for row in cursor.fetchall())
+    finally:
+        cursor.close()
+    return ids
+
+
+class Importer:
+    """Buffers records and writes each batch in one transaction"""
+
+    def __init__(self):
+        self.written = Counter()
+        self.skipped = Counter()
+        # username -> id for every user seen so far in this import
+        self.user_ids = {}
+        self._reset()
+
+    def _reset(self):
+        self.users, self.posts, self.comments = {}, [], []
+        self.now = _db_datetime(timezone.now())
+
+    def __len__(self):
+        return len(self.users) + len(self.posts) + len(self.comments)
+
+    def add(self, record):
+        """Buffer one record; invalid records are counted in skipped"""
+        kind = record.get('type')
+        if kind not in RECORD_TYPES:
+            self.skipped['unknown type'] += 1
+            return
+        try:
+            if kind == 'user':
+                self._add_user(record)
+            elif kind == 'post':
+                post = self._add_post(record)
+                for comment in record.get('comments') or []:
+                    self._add_comment(comment, parent=post)
+            else:
+                self._add_comment(record)
+        except (TypeError, ValueError, AttributeError):
+            self.skipped[kind] += 1
+
+    def _add_user(self, record):
+        username = record['username'].strip() if record.get('username') else ''
+        if not username:
+            raise ValueError('username is required')
+        self.users[username] = {
+            'first_name': record.get('first_name', ''),
+            'last_name': record.get('last_name', ''),
+            'email': record.get('email', ''),
+        }
+
+    def _add_post(self, record):
+        content = record.get('content', '').strip()
+        if not content:
+            raise ValueError('content is required')
+        variants = record.get('image_variants') or '[]'
+        if not isinstance(variants, str):
+            variants = json.dumps(variants)
+        post = {
+            'id': _int(record.get('id')),
+            'username': record.get('username') or 'admin',
+            'content': content,
+            'image': record.get('image') or '',
+            'image_width': _int(record.get('image_width')),
+            'image_height': _int(record.get('image_height')),
+            'image_variants': variants,
+            'created_at': _timestamp(record.get('created_at'), self.now),
+        }
+        self.posts.append(post)
+        return post
+
+    def _add_comment(self, record, parent=None):
+        content = record.get('content', '').strip()
+        if not content:
+            raise ValueError('content is required')
+        post_id = None if parent is not None else _int(record.get('post_id', record.get('post')))
+        if parent is None and post_id is None:
+            raise ValueError('post_id is required')
+        self.comments.append({
+            'id': _int(record.get('id')),
+            'post_id': post_id,
+            'parent': parent,
+            'username': record.get('username') or 'anonymous',
+            'content': content,
+            'created_at': _timestamp(record.get('created_at'), self.now),
+        })
+
+    def _user_row(self, username, first_name='', last_name='', email=''):
+        # Same as User.objects.create(username=...): no usable password
+        return (username, '', False, first_name, last_name, email, False, True, self.now)
+
+    @staticmethod
+    def _lookup_users(names):
+        return dict(User.objects.filter(username__in=names).values_list('username', 'pk'))
+
+    def _resolve_users(self):
+        """
+        Return username -> id for the batch's usernames not yet in user_ids,
+        creating missing users. user_ids itself is only updated once the
+        batch commits: a rolled back batch may have created some of them.
+        """
+        if self.users:
+            rows = [self._user_row(name, **fields) for name, fields in self.users.items()]
+            insert_rows(User, USER_FIELDS, rows, ignore_conflicts=True)
+        names = {post['username'] for post in self.posts}
+        names.update(comment['username'] for comment in self.comments)
+        missing = list(names - self.user_ids.keys())
+        if not missing:
+            return {}
+        resolved = self._lookup_users(missing)
+        absent = [name for name in missing if name not in resolved]
+        if absent:
+            insert_rows(User, USER_FIELDS, [self._user_row(name) for name in absent], ignore_conflicts=True)
+            resolved.update(self._lookup_users(absent))
+        return resolved
+
+    @staticmethod
+    def _insert(model, fields, rows):
+        """
+        Insert rows (dicts keyed like fields) and return the ones written.
+        Rows with an id skip ids that already exist (a resumed batch); rows
+        without get their new id set.
+        """
+        values = lambda row: tuple(row[name] for name in fields)
+        # Ascending ids: FTS5 indexes out-of-order rowids several times slower
+        with_ids = sorted((row for row in rows if row['id'] is not None), key=lambda row: row['id'])
+        written = []
+        if with_ids:
+            # OR IGNORE returns only the ids it inserted
+            inserted = set(insert_rows(
+                model, fields, [values(row) for row in with_ids], ignore_conflicts=True, returning=True,
+            ))
+            for row in with_ids:
+                if row['id'] in inserted:
+                    # A repeated id is inserted once
+                    inserted.discard(row['id'])
+                    written.append(row)
+        without_ids = [row for row in rows if row['id'] is None]
+        if without_ids:
+            ids = insert_rows(model, fields, [values(row) for row in without_ids], returning=True)
+            for row, pk in zip(without_ids, ids):
+                row['id'] = pk
+            written.extend(without_ids)
+        return written
+
+    @retry_on_lock
+    def flush(self):
+        """Write everything buffered in one transaction"""
+        if not len(self):
+            return
+        # Retries start over from the buffered records, so work on copies
+        posts = [dict(post) for post in self.posts]
+        comments = [dict(comment) for comment in self.comments]
+        with transaction.atomic():
+            resolved = self._resolve_users()
+            user_ids = ChainMap(resolved, self.user_ids)
+
+            for post in posts:
+                post.update(user=user_ids[post['username']], updated_at=self.now, comments_count=0)
+            written = {id(post) for post in self._insert(Post, POST_FIELDS, posts)}
+            new_ids = {id(original): post['id'] for original, post in zip(self.posts, posts) if id(post) in written}
+            posts = [post for post in posts if id(post) in written]
+            storage.retain(
+                name for post in posts
+                for name in storage.post_media(post['image'], json.loads(post['image_variants']))
+            )
+
+            # Comments may only point at posts that exist, and nested ones
+            # only at their post if this batch inserted it
+            referenced = {c['post_id'] for c in comments if c['parent'] is None}
+            existing = set(Post.objects.filter(pk__in=referenced).values_list('pk', flat=True))
+            rows, orphaned = [], 0
+            for comment in comments:
+                if comment['parent'] is not None:
+                    if id(comment['parent']) not in new_ids:
+                        orphaned += 1
+                        continue
+                    comment['post_id'] = new_ids[id(comment['parent'])]
+                elif comment['post_id'] not in existing:
+                    continue
+                comment.update(post=comment['post_id'], user=user_ids[comment['username']], updated_at=self.now)
+                rows.append(comment)
+            missing = len(comments) - len(rows) - orphaned
+            inserted = self._insert(Comment, COMMENT_FIELDS, rows)
+            insert_rows(ChangeEvent, EVENT_FIELDS, [
+                (ChangeEvent.POST, ChangeEvent.CREATED, post['id'], post['id'], self.now) for post in posts
+            ] + [
+                (ChangeEvent.COMMENT, ChangeEvent.CREATED, comment['id'], comment['post'], self.now)
+                for comment in inserted
+            ])
+
+            touched = {comment['post'] for comment in inserted}
+            if touched:
+                Post.objects.filter(pk__in=touched).recount_comments()
+            bump_comments_versions(existing & touched)
+            if posts or inserted:
+                bump_feed_version()
+
+        # Only remembered and counted once committed, so a retried batch
+        # neither reuses ids it rolled back nor is counted twice
+        self.user_ids.update(resolved)
+        self.written.update(user=len(self.users), post=len(posts), comment=len(inserted))
+        skipped = {
+            'post (id exists)': len(self.posts) - len(posts),
+            'comment (id exists)': len(rows) - len(inserted),
+            'comment (missing post)': missing,
+            'comment (post not imported)': orphaned,
+        }
+        self.skipped.update({reason: count for reason, count in skipped.items() if count})
+        self._reset()
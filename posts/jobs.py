@@ -0,0 +1,135 @@
+"""
+Database-backed background jobs.
+
+Request handlers call enqueue() inside their own transaction, so a job only
+becomes visible to workers once the row that needs it has committed. Workers
+(`manage.py run_jobs`) claim jobs with a conditional UPDATE, which is safe
+across threads and processes without row locks, and retry failures with
+exponential backoff.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .images import process_post_image
+from .models import Post, Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+def task(name):
+    """Register a function as a job task under name"""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, key=None, max_attempts=None):
+    """
+    Queue a job. With a key, enqueueing again returns the existing job
+    instead of creating a duplicate.
+    """
+    if name not in TASKS:
+        raise ValueError(f'Unknown job task: {name}')
+    fields = {
+        'name': name,
+        'payload': payload or {},
+        'max_attempts': max_attempts or settings.JOB_MAX_ATTEMPTS,
+    }
+    if key is None:
+        return Job.objects.create(**fields)
+    try:
+        with transaction.atomic():
+            job, created = Job.objects.get_or_create(key=key, defaults=fields)
+    except IntegrityError:
+        # Another request inserted the same key between our read and write
+        job = Job.objects.get(key=key)
+    return job
+
+
+def claimable():
+    """Jobs that are due, plus running jobs whose worker appears to have died"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    return Job.objects.filter(
+        Q(status=Job.PENDING, run_after__lte=now)
+        | Q(status=Job.RUNNING, locked_at__lt=stale)
+    )
+
+
+def claim_next():
+    """Atomically take one due job, or return None if there is none"""
+    for candidate in claimable().order_by('run_after', 'id').values('id', 'status', 'locked_at')[:10]:
+        # Only one worker's UPDATE can match the row in its previous state
+        claimed = Job.objects.filter(
+            pk=candidate['id'], status=candidate['status'], locked_at=candidate['locked_at']
+        ).update(status=Job.RUNNING, locked_at=timezone.now(), updated_at=timezone.now())
+        if claimed:
+            return Job.objects.get(pk=candidate['id'])
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record the outcome"""
+    job.attempts += 1
+    try:
+        TASKS[job.name](**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            logger.error('Job %s failed permanently', job, exc_info=True)
+        else:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=settings.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1))
+            logger.warning('Job %s failed, retrying', job, exc_info=True)
+    else:
+        job.status = Job.SUCCEEDED
+        job.last_error = ''
+    job.locked_at = None
+    job.save(update_fields=['status', 'attempts', 'run_after', 'locked_at', 'last_error', 'updated_at'])
+    return job
+
+
+def run_pending(limit=None):
+    """Run due jobs in this thread until none are left; returns how many ran"""
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim_next()
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+@task('process_post_image')
+def process_post_image_task(post_id, image_name):
+    post = Post.objects.filter(pk=post_id).first()
+    # The post may be gone or have had its image replaced since queuing
+    if post is None or post.image.name != image_name:
+        return
+    process_post_image(post)
+
+
+@task('delete_media')
+def delete_media_task(paths):
+    for path in paths:
+        default_storage.delete(path)
+
+
+def queue_image_processing(post):
+    return enqueue(
+        'process_post_image',
+        {'post_id': post.pk, 'image_name': post.image.name},
+        key=f'process_post_image:{post.pk}:{post.image.name}',
+    )
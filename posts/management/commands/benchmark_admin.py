@@ -0,0 +1,127 @@
+import argparse
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.utils import override_settings
+
+from posts.benchmark import scratch_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the Post and Comment admin changelists on a throwaway SQLite "
+        "database grown to each requested number of posts (one comment per post)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+            help='Post counts to measure, ascending (default: 1k 10k 100k 1M)',
+        )
+        parser.add_argument(
+            '--requests', type=int, default=5,
+            help='Page loads per changelist and size; the median is reported (default: 5)',
+        )
+        # Internal: seed and measure in this process, print JSON lines
+        parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        sizes = options['sizes']
+        if sizes != sorted(sizes) or sizes[0] < 1 or options['requests'] < 1:
+            raise CommandError('--sizes must be positive and ascending, --requests positive')
+        if options['worker']:
+            return self.run_worker(sizes, options['requests'], options['verbosity'])
+
+        with scratch_database() as database:
+            output = database.worker(
+                'benchmark_admin', '--requests', options['requests'], '--verbosity', options['verbosity'],
+                '--sizes', *sizes,
+            )
+            results = [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+
+        self.stdout.write(f"{'posts':>9}  {'page':<16} {'median ms':>9}  {'queries':>7}")
+        for result in results:
+            self.stdout.write(
+                f"{result['posts']:>9}  {result['page']:<16} "
+                f"{result['ms']:>9.1f}  {result['queries']:>7}"
+            )
+        for page in dict.fromkeys(r['page'] for r in results):
+            timings = [r['ms'] for r in results if r['page'] == page]
+            self.stdout.write(f'  {page}: {timings[-1] / timings[0]:.2f}x from smallest to largest')
+
+    def run_worker(self, sizes, requests, verbosity):
+        # Imported here so the parent process never needs a test client
+        from django.contrib.auth.models import User
+        from django.test import Client
+
+        admin = User.objects.create_superuser('benchmark', password='benchmark')
+        client = Client()
+        client.force_login(admin)
+        pages = {
+            'posts': '/admin/posts/post/',
+            'posts by user': f'/admin/posts/post/?user__id__exact={admin.pk}',
+            'comments': '/admin/posts/comment/',
+        }
+
+        for size in sizes:
+            started = time.perf_counter()
+            grow(size, admin.pk)
+            if verbosity > 1:
+                self.stderr.write(f'seeded {size} posts in {time.perf_counter() - started:.1f}s')
+            for label, url in pages.items():
+                timings = []
+                with override_settings(DEBUG=True):
+                    for _ in range(requests):
+                        reset_queries()
+                        started = time.perf_counter()
+                        response = client.get(url)
+                        timings.append((time.perf_counter() - started) * 1000)
+                        if response.status_code != 200:
+                            raise CommandError(f'{url} returned {response.status_code}')
+                    queries = len(connection.queries)
+                self.stdout.write(json.dumps({
+                    'posts': size, 'page': label,
+                    'ms': statistics.median(timings), 'queries': queries,
+                }))
+
+
+def grow(size, admin_id):
+    """
+    Top the database up to size posts and comments, and a user per hundred
+    posts, with INSERT ... SELECT over a recursive sequence.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM auth_user')
+        users = cursor.fetchone()[0]
+        if users < size // 100:
+            cursor.execute(
+                "WITH RECURSIVE seq(n) AS (SELECT %s UNION ALL SELECT n + 1 FROM seq WHERE n < %s) "
+                "INSERT INTO auth_user (username, password, is_superuser, first_name, last_name, "
+                "email, is_staff, is_active, date_joined) "
+                "SELECT 'user' || n, '', 0, '', '', '', 0, 1, datetime('now') FROM seq",
+                [users + 1, size // 100],
+            )
+        cursor.execute('SELECT COUNT(*), MAX(id) FROM auth_user')
+        users, last_user = cursor.fetchone()
+
+        cursor.execute('SELECT COUNT(*) FROM posts_post')
+        posts = cursor.fetchone()[0]
+        if posts >= size:
+            return
+        cursor.execute(
+            "WITH RECURSIVE seq(n) AS (SELECT %s UNION ALL SELECT n + 1 FROM seq WHERE n < %s) "
+            "INSERT INTO posts_post (user_id, content, image, image_variants, comments_count, "
+            "created_at, updated_at) "
+            "SELECT CASE WHEN n %% 10 = 0 THEN %s ELSE %s - n %% %s END, "
+            "'benchmark post number ' || n, '', '[]', 1, "
+            "datetime('now', '-' || n || ' seconds'), datetime('now') FROM seq",
+            [posts + 1, size, admin_id, last_user, users],
+        )
+        cursor.execute(
+            "INSERT INTO posts_comment (post_id, user_id, content, created_at, updated_at) "
+            "SELECT id, user_id, 'comment on ' || id, created_at, created_at "
+            "FROM posts_post WHERE id > (SELECT COALESCE(MAX(post_id), 0) FROM posts_comment)"
+        )
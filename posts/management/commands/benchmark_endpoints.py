@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark, synthetic
+
+DATA_OPTIONS = ('users', 'posts', 'comments_per_post', 'image_ratio', 'seed')
+
+
+class Command(BaseCommand):
+    help = (
+        "Time every API endpoint in-process on a throwaway SQLite database "
+        "filled with deterministic synthetic data, reporting p50/p95/p99 "
+        "latency, queries and response bytes. Compares against a JSON "
+        "baseline and fails if any endpoint regressed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Synthetic users (default: 50)')
+        parser.add_argument('--posts', type=int, default=1000, help='Synthetic posts (default: 1000)')
+        parser.add_argument(
+            '--comments-per-post', type=int, default=5,
+            help='Average comments per post (default: 5)',
+        )
+        parser.add_argument(
+            '--image-ratio', type=float, default=0.2,
+            help='Share of posts with images (default: 0.2)',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Data generator seed (default: 0)')
+        parser.add_argument(
+            '--requests', type=int, default=30,
+            help='Timed requests per endpoint (default: 30)',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=3,
+            help='Untimed requests per endpoint first (default: 3)',
+        )
+        parser.add_argument(
+            '--baseline', default='benchmarks/endpoints.json',
+            help='Baseline file to compare with (default: benchmarks/endpoints.json)',
+        )
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Write this run as the new baseline instead of comparing',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.5,
+            help='Allowed p50 slowdown or response growth as a fraction (default: 0.5, i.e. 50%%; '
+                 'run-to-run noise on a shared machine is often 30%%)',
+        )
+        # Internal: generate and measure in this process, print JSON
+        parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['warmup'] < 0 or options['threshold'] < 0:
+            raise CommandError('--requests must be positive, --warmup and --threshold non-negative')
+        data = {name: options[name] for name in DATA_OPTIONS}
+        if options['worker']:
+            return self.run_worker(data, options['requests'], options['warmup'])
+
+        args = ['--requests', options['requests'], '--warmup', options['warmup']]
+        for name, value in data.items():
+            args += ['--' + name.replace('_', '-'), value]
+        with benchmark.scratch_database() as database:
+            results = json.loads(database.worker('benchmark_endpoints', *args).splitlines()[-1])
+
+        self.stdout.write(
+            f"{'endpoint':<20} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>7} {'bytes':>9}"
+        )
+        for url_name, result in results.items():
+            self.stdout.write(
+                f"{url_name:<20} {result['p50']:>8.2f} {result['p95']:>8.2f} {result['p99']:>8.2f} "
+                f"{result['queries']:>7} {result['bytes']:>9}"
+            )
+
+        run = {'data': data, 'requests': options['requests'], 'results': results}
+        path = options['baseline']
+        if options['save']:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w') as handle:
+                json.dump(run, handle, indent=2, sort_keys=True)
+                handle.write('\n')
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline to {path}'))
+            return
+        if not os.path.exists(path):
+            self.stdout.write(f'No baseline at {path}; rerun with --save to record one.')
+            return
+
+        with open(path) as handle:
+            baseline = json.load(handle)
+        if baseline['data'] != data:
+            raise CommandError(f'{path} was recorded with different data options: {baseline["data"]}')
+        regressions = benchmark.compare(results, baseline['results'], options['threshold'])
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(f'  {regression}'))
+            raise CommandError(f'{len(regressions)} regressions against {path}')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {path}.'))
+
+    def run_worker(self, data, requests, warmup):
+        missing = benchmark.missing_endpoints()
+        if missing:
+            raise CommandError(f"No benchmark case for: {', '.join(sorted(missing))}")
+        written = synthetic.generate(**data)
+        self.stderr.write(f"generated {written['posts']} posts, {written['comments']} comments")
+        results = benchmark.measure(
+            requests, warmup,
+            progress=lambda url_name, result: self.stderr.write(f"{url_name}: p50 {result['p50']:.2f}ms"),
+        )
+        self.stdout.write(json.dumps(results))
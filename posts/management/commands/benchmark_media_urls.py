@@ -0,0 +1,74 @@
+import random
+import statistics
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from posts.storage import MediaStorage, media_urls
+from posts.synthetic import _image_fields
+
+# MEDIA_BASE_URL per mode
+MODES = {'host': '', 'cdn': 'https://cdn.example.com/media/'}
+
+
+def per_object(request, storage, names):
+    """How URLs were built before: resolve and absolutize every name on its own"""
+    return [request.build_absolute_uri(storage.url(name)) for name in names]
+
+
+def per_response(request, storage, names):
+    url = media_urls(request, storage)
+    return [url(name) for name in names]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time building the media URLs of a feed page: per object through "
+        "FileSystemStorage and request.build_absolute_uri, against "
+        "posts.storage (URLs cached by the storage, host resolved once per "
+        "response), on the first page and on later ones, with and without "
+        "MEDIA_BASE_URL. No database is needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000, help='Posts with images on the page (default: 1000)')
+        parser.add_argument('--rounds', type=int, default=20, help='Timed pages per case (default: 20)')
+
+    def handle(self, *args, **options):
+        posts, rounds = options['posts'], options['rounds']
+        if posts < 1 or rounds < 1:
+            raise CommandError('--posts and --rounds must be positive')
+        rng = random.Random(0)
+        names = []
+        for number in range(1, posts + 1):
+            fields = _image_fields(rng, number)
+            names.append(fields['image'])
+            names.extend(variant['path'] for variant in fields['image_variants'])
+        request = RequestFactory().get('/api/get-posts/')
+
+        self.stdout.write(f"{'mode':<5} {'case':<10} {'page ms':>8} {'us/post':>8}")
+        for mode, base_url in MODES.items():
+            with override_settings(MEDIA_BASE_URL=base_url):
+                before = FileSystemStorage(base_url=base_url or None)
+                # Every round a new storage, so each page starts from an empty cache
+                cases = {
+                    'per-object': lambda: per_object(request, before, names),
+                    'cold': lambda: per_response(request, MediaStorage(), names),
+                }
+                warm = MediaStorage()
+                cases['warm'] = lambda: per_response(request, warm, names)
+                expected = per_object(request, before, names)
+                for case, run in cases.items():
+                    if run() != expected:
+                        raise CommandError(f'{mode}/{case} built different URLs')
+                    timings = []
+                    for _ in range(rounds):
+                        started = time.perf_counter()
+                        run()
+                        timings.append((time.perf_counter() - started) * 1000)
+                    page = statistics.median(timings)
+                    self.stdout.write(f"{mode:<5} {case:<10} {page:>8.2f} {page * 1000 / posts:>8.2f}")
+        self.stdout.write(f'{len(names) // posts} URLs per post (image and variants).')
@@ -0,0 +1,95 @@
+import argparse
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from posts import fast_serializers, synthetic
+from posts.benchmark import scratch_database
+from posts.models import Post
+from posts.renderers import ORJSONRenderer
+from posts.serializers import PostSerializer
+
+
+def drf_page(limit, request):
+    """A feed page the way the ModelSerializers build it"""
+    posts = list(Post.objects.for_feed()[:limit])
+    return PostSerializer(posts, many=True, context={'request': request}).data
+
+
+def fast_page(limit, request):
+    """The same page through posts.fast_serializers"""
+    rows = list(fast_serializers.post_values(Post.objects.all())[:limit])
+    return fast_serializers.serialize_posts(rows, request)
+
+
+# path -> (page builder, renderer)
+PATHS = {'drf': (drf_page, JSONRenderer()), 'fast': (fast_page, ORJSONRenderer())}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time building and rendering a page of posts with PostSerializer and "
+        "DRF's JSONRenderer against the .values() serializer and the orjson "
+        "renderer, on a throwaway database filled with synthetic data. Fails "
+        "if the two produce different bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000, help='Synthetic posts, all on one page (default: 1000)')
+        parser.add_argument('--rounds', type=int, default=20, help='Timed rounds per path (default: 20)')
+        # Internal: generate and measure in this process, print JSON
+        parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['posts'] < 1 or options['rounds'] < 1:
+            raise CommandError('--posts and --rounds must be positive')
+        if options['worker']:
+            return self.run_worker(options['posts'], options['rounds'], options['verbosity'])
+
+        with scratch_database() as database:
+            output = database.worker(
+                'benchmark_serializers', '--posts', options['posts'], '--rounds', options['rounds'],
+                '--verbosity', options['verbosity'],
+            )
+            results = json.loads(output.splitlines()[-1])
+
+        self.stdout.write(f"{'path':<6} {'build ms':>9} {'render ms':>9} {'total ms':>9} {'posts/s':>9}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<6} {result['build']:>9.1f} {result['render']:>9.1f} "
+                f"{result['total']:>9.1f} {result['posts_per_second']:>9.0f}"
+            )
+        speedup = results['drf']['total'] / results['fast']['total']
+        self.stdout.write(self.style.SUCCESS(f'Identical output; fast path {speedup:.1f}x faster.'))
+
+    def run_worker(self, posts, rounds, verbosity):
+        synthetic.generate(posts=posts)
+        request = RequestFactory().get('/api/get-posts/')
+        bodies = {name: renderer.render(page(posts, request)) for name, (page, renderer) in PATHS.items()}
+        if bodies['drf'] != bodies['fast']:
+            raise CommandError('The fast path rendered different JSON than PostSerializer')
+
+        results = {}
+        for name, (page, renderer) in PATHS.items():
+            builds, renders = [], []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                data = page(posts, request)
+                built = time.perf_counter()
+                renderer.render(data)
+                builds.append((built - started) * 1000)
+                renders.append((time.perf_counter() - built) * 1000)
+            build, render = statistics.median(builds), statistics.median(renders)
+            results[name] = {
+                'build': build,
+                'render': render,
+                'total': build + render,
+                'posts_per_second': posts / (build + render) * 1000,
+            }
+            if verbosity > 1:
+                self.stderr.write(f"{name}: {build + render:.1f}ms per {posts} posts")
+        self.stdout.write(json.dumps(results))
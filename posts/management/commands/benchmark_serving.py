@@ -0,0 +1,174 @@
+import asyncio
+import importlib.util
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.benchmark import percentile, scratch_database
+
+# gunicorn arguments per serving mode
+SERVERS = {
+    'wsgi': ['config.wsgi:application'],
+    'asgi': ['config.asgi:application', '--worker-class', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare request throughput of the WSGI deployment (gunicorn sync "
+        "workers) with the ASGI one (gunicorn with uvicorn workers and the "
+        "async read views) at several numbers of concurrent connections, on "
+        "a throwaway database filled with synthetic data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Server worker processes (default: 2)')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 16, 64],
+            help='Concurrent client connections to measure (default: 1 16 64)',
+        )
+        parser.add_argument(
+            '--duration', type=float, default=5.0,
+            help='Seconds of load per mode and concurrency (default: 5)',
+        )
+        parser.add_argument('--posts', type=int, default=1000, help='Synthetic posts (default: 1000)')
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='Disable the response cache so every request reaches the database',
+        )
+        parser.add_argument(
+            '--modes', nargs='+', choices=list(SERVERS), default=list(SERVERS),
+            help='Serving modes to compare (default: wsgi asgi)',
+        )
+
+    def handle(self, *args, **options):
+        for module in ('gunicorn', 'uvicorn', 'uvicorn_worker'):
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f'{module} is not installed (pip install -r requirements.txt)')
+        if options['workers'] < 1 or options['duration'] <= 0 or min(options['concurrency']) < 1:
+            raise CommandError('--workers, --duration and --concurrency must be positive')
+
+        env = {'DJANGO_DB_PROFILE': 'production'}
+        if options['no_cache']:
+            env['DJANGO_CACHE_BACKEND'] = 'django.core.cache.backends.dummy.DummyCache'
+        with scratch_database(**env) as database:
+            database.run('generate_data', '--posts', options['posts'], check=True, stdout=subprocess.DEVNULL)
+
+            paths = ['/api/get-posts/', '/api/posts/', '/api/posts/1/', '/api/get-comments/1/']
+            results = []
+            for mode in options['modes']:
+                with self.server(mode, options['workers'], database.env) as port:
+                    for concurrency in options['concurrency']:
+                        result = asyncio.run(load(port, paths, concurrency, options['duration']))
+                        results.append({'mode': mode, 'concurrency': concurrency, **result})
+                        self.stderr.write(f"{mode} x{concurrency}: {result['rps']:.0f} req/s")
+
+        self.stdout.write(f"{'mode':<6} {'conns':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+        for r in results:
+            self.stdout.write(
+                f"{r['mode']:<6} {r['concurrency']:>5} {r['rps']:>8.0f} "
+                f"{r['p50']:>8.1f} {r['p99']:>8.1f} {r['errors']:>6}"
+            )
+
+    @contextmanager
+    def server(self, mode, workers, env):
+        """Run gunicorn in the given mode on a free port; yields the port"""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', *SERVERS[mode],
+             '--workers', str(workers), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                if process.poll() is not None:
+                    raise CommandError(f'{mode} server exited with {process.returncode}')
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise CommandError(f'{mode} server did not start listening')
+                    time.sleep(0.2)
+            yield port
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+async def _request(reader, writer, path):
+    """One GET on a keep-alive connection; returns (status, keep connection open)"""
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept: application/json\r\n\r\n'.encode())
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = int(head[0].split()[1])
+    headers = {}
+    for line in head[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection') != 'close'
+
+
+async def load(port, paths, concurrency, duration):
+    """Keep concurrency connections busy for duration seconds; return throughput and latency"""
+    timings, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client(offset):
+        nonlocal errors
+        connection = None
+        count = offset
+        while time.perf_counter() < deadline:
+            path = paths[count % len(paths)]
+            count += 1
+            started = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = await asyncio.open_connection('127.0.0.1', port)
+                status, keep = await _request(*connection, path)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                status, keep = None, False
+            else:
+                timings.append((time.perf_counter() - started) * 1000)
+                if status >= 400:
+                    errors += 1
+            if not keep and connection is not None:
+                connection[1].close()
+                connection = None
+        if connection is not None:
+            connection[1].close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'rps': len(timings) / elapsed,
+        'p50': statistics.median(timings) if timings else 0.0,
+        'p99': percentile(timings, 99) if timings else 0.0,
+        'errors': errors,
+    }
@@ -0,0 +1,44 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import MediaBlob
+
+# Names checked for a MediaBlob row per query
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete stored media no post can refer to: content-addressed files "
+        "whose MediaBlob row was rolled back, and incoming files left by an "
+        "interrupted upload. Only files untouched for --hours are considered, "
+        "so uploads still in a transaction are left alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float, default=24.0,
+            help='Only delete files last modified this many hours ago (default: 24)',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='List the files without deleting them')
+
+    def handle(self, *args, **options):
+        if options['hours'] < 0:
+            raise CommandError('--hours must not be negative')
+        candidates = default_storage.orphans(time.time() - options['hours'] * 3600)
+        deleted = 0
+        while batch := [name for _, name in zip(range(BATCH_SIZE), candidates)]:
+            counted = set(MediaBlob.objects.filter(name__in=batch).values_list('name', flat=True))
+            for name in batch:
+                if name in counted:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f'  {name}')
+                else:
+                    # delete() checks for a row again inside its transaction
+                    default_storage.delete(name)
+                deleted += 1
+        verb = 'would be deleted' if options['dry_run'] else 'deleted'
+        self.stdout.write(self.style.SUCCESS(f'Done: {deleted} orphaned media files {verb}.'))
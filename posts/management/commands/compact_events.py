@@ -0,0 +1,64 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from posts import events
+from posts.db import retry_on_lock
+from posts.models import ChangeEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete change events (including deletion tombstones) older than the "
+        "retention window, oldest first in primary-key batches. The newest "
+        "event is always kept so the log still knows its position. Clients "
+        "holding a cursor from before the cut get 410 and reload."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float, default=None,
+            help='Keep this many days of events (default: EVENTS_RETENTION_DAYS)',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Events deleted per transaction (default: 10000)',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.0,
+            help='Seconds to pause between batches to give writers room',
+        )
+
+    def handle(self, *args, **options):
+        days = settings.EVENTS_RETENTION_DAYS if options['days'] is None else options['days']
+        batch_size = options['batch_size']
+        if days < 0 or batch_size < 1:
+            raise CommandError('--days must not be negative and --batch-size must be positive')
+
+        cutoff = timezone.now() - timedelta(days=days)
+        # Ids grow with time, so everything up to the newest expired event goes
+        upto = (
+            ChangeEvent.objects.filter(created_at__lt=cutoff, id__lt=events.latest_seq())
+            .order_by('-created_at', '-id').values_list('id', flat=True).first()
+        )
+        if upto is None:
+            self.stdout.write(f'No events older than {cutoff:%Y-%m-%d %H:%M}.')
+            return
+
+        delete = retry_on_lock(lambda low, high: ChangeEvent.objects.filter(id__gt=low, id__lte=high).delete()[0])
+        deleted = 0
+        low = events.history_start()
+        while low < upto:
+            high = min(low + batch_size, upto)
+            deleted += delete(low, high)
+            low = high
+            self.stdout.write(f'  up to event {high}: {deleted} deleted')
+            if options['sleep'] and low < upto:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {deleted} events older than {cutoff:%Y-%m-%d %H:%M} deleted; '
+            f'clients can resume from cursor {upto}.'
+        ))
@@ -0,0 +1,61 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = (
+        "Write every post and comment as NDJSON, oldest first, reading the "
+        "database in keyset batches so memory use stays flat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', '-o', default='-',
+            help='File to write, or - for stdout (default: -)',
+        )
+        parser.add_argument('--since', help='Only rows created at or after this ISO date/datetime')
+        parser.add_argument('--until', help='Only rows created at or before this ISO date/datetime')
+        parser.add_argument(
+            '--comments', choices=export.COMMENT_MODES, default=export.NESTED,
+            help='Nest comments in their post, or emit them as separate records (default: nested)',
+        )
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Rows fetched per query (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        bounds = {}
+        for name in ('since', 'until'):
+            if options[name]:
+                try:
+                    bounds[name] = export.parse_bound(options[name], end_of_day=name == 'until')
+                except ValueError as e:
+                    raise CommandError(f'--{name}: {e}')
+
+        chunks = export.ndjson_chunks(
+            comments=options['comments'], chunk_size=options['chunk_size'],
+            compress=options['gzip'], **bounds,
+        )
+        if options['output'] == '-':
+            if options['gzip']:
+                for chunk in chunks:
+                    sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+            else:
+                for chunk in chunks:
+                    self.stdout.write(chunk.decode(), ending='')
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as handle:
+            for chunk in chunks:
+                handle.write(chunk)
+                written += len(chunk)
+        self.stderr.write(f"Wrote {written} bytes to {options['output']}")
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        "Add deterministic synthetic users, posts and comments: the same "
+        "options and seed always produce the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Users to spread posts over (default: 50)')
+        parser.add_argument('--posts', type=int, default=1000, help='Posts to create (default: 1000)')
+        parser.add_argument(
+            '--comments-per-post', type=int, default=5,
+            help='Average comments per post (default: 5)',
+        )
+        parser.add_argument(
+            '--image-ratio', type=float, default=0.2,
+            help='Share of posts with image metadata, 0 to 1 (default: 0.2)',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+
+    def handle(self, *args, **options):
+        try:
+            written = synthetic.generate(
+                users=options['users'],
+                posts=options['posts'],
+                comments_per_post=options['comments_per_post'],
+                image_ratio=options['image_ratio'],
+                seed=options['seed'],
+                progress=lambda done: self.stdout.write(f"  {done['posts']} posts, {done['comments']} comments"),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {written['posts']} posts and {written['comments']} comments "
+            f"from {written['users']} users."
+        ))
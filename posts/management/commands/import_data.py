@@ -0,0 +1,102 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.db import bulk_load
+from posts.importer import RECORD_TYPES, ImportFileError, Importer, detect_format, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Import users, posts and comments from NDJSON or CSV files (optionally "
+        ".gz), streaming each file and writing batches as multi-row INSERTs. "
+        "Progress is checkpointed after every batch so --resume can pick up "
+        "where a failed run stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files to import, in order')
+        parser.add_argument(
+            '--format', choices=['ndjson', 'csv'],
+            help='File format (default: from each file extension)',
+        )
+        parser.add_argument(
+            '--type', choices=RECORD_TYPES,
+            help='Record type for rows without a "type" field, e.g. a CSV of posts',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Rows per transaction (default: 5000)',
+        )
+        parser.add_argument(
+            '--state', default='.import-state.json',
+            help='Checkpoint file (default: .import-state.json)',
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Skip records already committed by a previous run, per the checkpoint file',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        for path in options['paths']:
+            if not os.path.exists(path):
+                raise CommandError(f'No such file: {path}')
+
+        state_path = options['state']
+        state = {}
+        if options['resume'] and os.path.exists(state_path):
+            with open(state_path) as handle:
+                state = json.load(handle)
+
+        def checkpoint(key, number, done=False):
+            state[key] = {'records': number, 'done': done}
+            with open(state_path + '.tmp', 'w') as handle:
+                json.dump(state, handle)
+            # Atomic on POSIX, so a crash never leaves half a checkpoint
+            os.replace(state_path + '.tmp', state_path)
+
+        importer = Importer()
+        started = time.perf_counter()
+        try:
+            with bulk_load():
+                for path in options['paths']:
+                    key = os.path.abspath(path)
+                    progress = state.get(key, {'records': 0, 'done': False})
+                    if progress['done']:
+                        self.stdout.write(f'{path}: already imported, skipping')
+                        continue
+                    if progress['records']:
+                        self.stdout.write(f"{path}: resuming after record {progress['records']}")
+
+                    fmt = options['format'] or detect_format(path)
+                    number = progress['records']
+                    for number, record in read_records(path, fmt, options['type'], start=number):
+                        importer.add(record)
+                        if len(importer) >= options['batch_size']:
+                            importer.flush()
+                            checkpoint(key, number)
+                            self.report(path, number, importer, started)
+                    importer.flush()
+                    checkpoint(key, number, done=True)
+                    self.report(path, number, importer, started)
+        except ImportFileError as e:
+            raise CommandError(f'{e} (committed batches are kept; fix the file and rerun with --resume)')
+
+        os.remove(state_path)
+        elapsed = time.perf_counter() - started
+        rows = sum(importer.written.values())
+        summary = ', '.join(f'{count} {kind}s' for kind, count in sorted(importer.written.items()) if count)
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {summary or "nothing"} in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s).'
+        ))
+        for reason, count in sorted(importer.skipped.items()):
+            self.stdout.write(self.style.WARNING(f'Skipped {count} invalid records: {reason}'))
+
+    def report(self, path, number, importer, started):
+        rows = sum(importer.written.values())
+        rate = rows / max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(f'  {path}: record {number}, {rows} rows written ({rate:.0f} rows/s)')
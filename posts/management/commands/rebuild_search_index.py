@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-index every post and comment in the full-text search table. Rows "
+        "are replaced in place batch by batch, so search stays available."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows per transaction (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        def progress(label, indexed):
+            self.stdout.write(f'  {label}: {indexed} indexed')
+
+        posts, comments = search.rebuild(batch_size=batch_size, progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {posts} posts and {comments} comments indexed.'
+        ))
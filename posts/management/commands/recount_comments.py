@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill or verify Post.comments_count in primary-key batches. Each "
+        "batch is its own short transaction so writers are never blocked for long."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Posts per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.0,
+            help='Seconds to pause between batches to give writers room',
+        )
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only touch posts whose counter disagrees with the comments table',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        scanned = fixed = 0
+        last_pk = 0
+        while True:
+            # Walk the primary key index so sparse ids never produce empty batches
+            ids = list(
+                Post.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            batch = Post.objects.filter(pk__gte=ids[0], pk__lte=ids[-1])
+            with transaction.atomic():
+                if options['verify']:
+                    stale = list(batch.with_stale_comments_count().values_list('pk', flat=True))
+                    if stale:
+                        Post.objects.filter(pk__in=stale).recount_comments()
+                    fixed += len(stale)
+                else:
+                    fixed += batch.recount_comments()
+            scanned += len(ids)
+            last_pk = ids[-1]
+            self.stdout.write(f'  up to id {last_pk}: {scanned} scanned, {fixed} updated')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        if not scanned:
+            self.stdout.write('No posts to process.')
+            return
+        verb = 'repaired' if options['verify'] else 'recounted'
+        self.stdout.write(self.style.SUCCESS(f'Done: {scanned} posts scanned, {fixed} {verb}.'))
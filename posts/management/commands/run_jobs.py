@@ -0,0 +1,64 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from posts.jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Worker threads (default: 2)',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds an idle worker waits before looking for new jobs',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no due jobs are left instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive')
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.completed = 0
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = [
+                pool.submit(self.work, options['poll_interval'], options['once'])
+                for _ in range(options['workers'])
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except KeyboardInterrupt:
+                self.stop.set()
+                self.stdout.write('Stopping after current jobs...')
+
+        self.stdout.write(self.style.SUCCESS(f'Ran {self.completed} job(s).'))
+
+    def work(self, poll_interval, once):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                ran = run_pending(limit=50)
+                with self.lock:
+                    self.completed += ran
+                if ran:
+                    self.stdout.write(f'[{threading.current_thread().name}] ran {ran} job(s)')
+                    continue
+                if once:
+                    break
+                time.sleep(poll_interval)
+        finally:
+            # Each thread has its own connection
+            connection.close()
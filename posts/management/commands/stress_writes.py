@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from posts.benchmark import scratch_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer create_post and add_comment from several processes against a "
+        "throwaway SQLite database and report lock errors and write throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=4,
+            help='Concurrent writer processes (default: 4)',
+        )
+        parser.add_argument(
+            '--writes', type=int, default=200,
+            help='Writes per process, alternating posts and comments (default: 200)',
+        )
+        parser.add_argument(
+            '--profile', choices=['production', 'development'], default='production',
+            help='DJANGO_DB_PROFILE for the writers (default: production)',
+        )
+        # Internal: run as one writer and print a JSON summary
+        parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            return self.run_worker(options['writes'])
+        if options['processes'] < 1 or options['writes'] < 1:
+            raise CommandError('--processes and --writes must be positive')
+
+        with scratch_database(DJANGO_DB_PROFILE=options['profile']) as database:
+            started = time.perf_counter()
+            workers = [
+                database.start('stress_writes', '--worker', '--writes', options['writes'],
+                               stdout=subprocess.PIPE, text=True)
+                for _ in range(options['processes'])
+            ]
+            results = []
+            for worker in workers:
+                out, _ = worker.communicate()
+                if worker.returncode != 0:
+                    raise CommandError(f'Writer process exited with {worker.returncode}')
+                results.append(json.loads(out.strip().splitlines()[-1]))
+            elapsed = time.perf_counter() - started
+
+        ok = sum(r['ok'] for r in results)
+        locked = sum(r['locked'] for r in results)
+        failed = sum(r['failed'] for r in results)
+        self.stdout.write(
+            f"profile={options['profile']} processes={options['processes']} "
+            f"writes={ok + locked + failed}"
+        )
+        self.stdout.write(f'  succeeded:   {ok}')
+        self.stdout.write(f'  lock errors: {locked}')
+        self.stdout.write(f'  other errors: {failed}')
+        self.stdout.write(f'  throughput:  {ok / elapsed:.0f} writes/s over {elapsed:.2f}s')
+        if locked or failed:
+            raise CommandError('Writers hit errors under concurrency')
+        self.stdout.write(self.style.SUCCESS('No lock errors.'))
+
+    def run_worker(self, writes):
+        # Imported here so the parent process never needs a test client
+        from django.test import Client
+
+        client = Client()
+        ok = locked = failed = 0
+        post_id = None
+        for i in range(writes):
+            if post_id is None or i % 2 == 0:
+                response = client.post(
+                    '/api/create-post/', {'content': f'stress {os.getpid()} {i}', 'username': f'w{os.getpid()}'}
+                )
+            else:
+                response = client.post(
+                    f'/api/add-comment/{post_id}/', {'content': 'stress', 'username': 'commenter'},
+                    content_type='application/json',
+                )
+            if response.status_code == 201:
+                ok += 1
+                if 'post' in response.json():
+                    post_id = response.json()['post']['id']
+            elif 'locked' in response.content.decode().lower():
+                locked += 1
+            else:
+                failed += 1
+        connection.close()
+        self.stdout.write(json.dumps({'ok': ok, 'locked': locked, 'failed': failed}))
@@ -0,0 +1,228 @@
+"""
+Per-request timings: a Server-Timing header and Prometheus histograms.
+
+RequestMetricsMiddleware times every request and, through an execute
+wrapper installed on every database connection as it opens, counts its
+queries and the time spent in them. The wrapper is permanent rather than
+per request because under ASGI queries run on other threads, each with its
+own connection; outside a timed request it costs one context variable read. Serializers
+report their own time through serializing() (see posts.serializers), so a
+slow response can be split into SQL, serialization and everything else
+(routing, URL building, rendering). Queries run while serializing, such as
+a lazily evaluated queryset, count as SQL and not as serialization.
+
+SERVER_TIMING adds the numbers to each response as a Server-Timing header,
+which browser dev tools display. METRICS_ENABLED aggregates them into
+per-endpoint histograms served in the Prometheus text format at /metrics.
+Histograms live in process memory, so each worker reports its own. With
+both settings off the middleware removes itself at startup.
+
+For streaming responses the numbers cover the time until the response
+starts, not the stream itself.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Prometheus client defaults, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Requests to these views are not recorded in the histograms
+UNRECORDED_VIEWS = {'metrics'}
+
+_current = ContextVar('posts_request_timings', default=None)
+
+
+class RequestTimings:
+    """What one request has spent so far, in seconds"""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.serialize = 0.0
+        self._serializing = False
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.sql += time.perf_counter() - started
+        timings.queries += 1
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # A thread's connection object outlives reconnects, so add it only once
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+@contextmanager
+def serializing():
+    """
+    Count the enclosed block as serialization for the current request.
+    Nested blocks (a serializer inside a serializer) are counted once, by
+    the outermost.
+    """
+    timings = _current.get()
+    if timings is None or timings._serializing:
+        yield
+        return
+    timings._serializing = True
+    sql_before = timings.sql
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timings.serialize += elapsed - (timings.sql - sql_before)
+        timings._serializing = False
+
+
+class Histogram:
+    """A Prometheus histogram with one series per label set"""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        counts = self.series.get(labels)
+        if counts is None:
+            counts = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        # Stored per bucket and summed at render time, so this is one increment
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self, label_names):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, counts in sorted(self.series.items()):
+            pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{pairs},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{pairs}}} {counts[-1]}')
+            lines.append(f'{self.name}_count{{{pairs}}} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+LABELS = ('endpoint', 'method')
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to produce the response.', DURATION_BUCKETS,
+)
+SQL_SECONDS = Histogram(
+    'http_request_sql_duration_seconds', 'Time spent in database queries.', DURATION_BUCKETS,
+)
+SERIALIZE_SECONDS = Histogram(
+    'http_request_serialize_duration_seconds', 'Time spent in DRF serializers.', DURATION_BUCKETS,
+)
+SQL_QUERIES = Histogram(
+    'http_request_sql_queries', 'Database queries per request.', QUERY_BUCKETS,
+)
+HISTOGRAMS = (REQUEST_SECONDS, SQL_SECONDS, SERIALIZE_SECONDS, SQL_QUERIES)
+
+_lock = threading.Lock()
+
+
+def record(endpoint, method, total, timings):
+    labels = (endpoint, method)
+    with _lock:
+        REQUEST_SECONDS.observe(labels, total)
+        SQL_SECONDS.observe(labels, timings.sql)
+        SERIALIZE_SECONDS.observe(labels, timings.serialize)
+        SQL_QUERIES.observe(labels, timings.queries)
+
+
+def render():
+    """Every histogram in the Prometheus text exposition format"""
+    with _lock:
+        lines = [line for histogram in HISTOGRAMS for line in histogram.render(LABELS)]
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        for histogram in HISTOGRAMS:
+            histogram.series.clear()
+
+
+def server_timing(total, timings):
+    """The Server-Timing header value; durations in milliseconds"""
+    return (
+        f'sql;dur={timings.sql * 1000:.1f};desc="{timings.queries} queries", '
+        f'serialize;dur={timings.serialize * 1000:.1f}, '
+        f'total;dur={total * 1000:.1f}'
+    )
+
+
+class RequestMetricsMiddleware:
+    """Times each request; see the module docstring"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not (settings.SERVER_TIMING or settings.METRICS_ENABLED):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = settings.SERVER_TIMING
+        self.metrics = settings.METRICS_ENABLED
+        # Under ASGI stay async, so async views aren't pushed onto a thread
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, timings)
+
+    def finish(self, request, response, total, timings):
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(total, timings)
+        match = request.resolver_match
+        endpoint = match.view_name if match else 'unmatched'
+        if self.metrics and endpoint not in UNRECORDED_VIEWS:
+            record(endpoint, request.method, total, timings)
+        return response
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:18
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_comments_count(apps, schema_editor):
+    # One statement is fine for small databases; large ones should migrate
+    # and then run `manage.py recount_comments`, which works in batches.
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    totals = (
+        Comment.objects.filter(post=models.OuterRef('pk'))
+        .order_by()
+        .values('post')
+        .annotate(total=models.Count('id'))
+        .values('total')
+    )
+    Post.objects.update(comments_count=Coalesce(models.Subquery(totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_comment_post_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of comments, maintained by posts.signals'),
+        ),
+        migrations.RunPython(backfill_comments_count, migrations.RunPython.noop),
+    ]
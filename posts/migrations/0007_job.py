@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_post_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Registered task name, see posts.jobs', max_length=100)),
+                ('key', models.CharField(blank=True, help_text='Idempotency key; enqueueing the same key twice yields one job', max_length=255, null=True, unique=True)),
+                ('payload', models.JSONField(blank=True, default=dict, help_text='Keyword arguments passed to the task')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', help_text='Where the job is in its lifecycle', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='How many times the job has been started')),
+                ('max_attempts', models.PositiveIntegerField(default=3, help_text='Attempts before the job is marked failed')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, help_text='Earliest time the job may run, pushed back between retries')),
+                ('locked_at', models.DateTimeField(blank=True, help_text='When a worker claimed the job', null=True)),
+                ('last_error', models.TextField(blank=True, help_text='Traceback of the most recent failure')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, help_text='When the job was queued')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='When the job last changed state')),
+            ],
+            options={
+                'verbose_name': 'Job',
+                'verbose_name_plural': 'Jobs',
+                'ordering': ['run_after', 'id'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx')],
+            },
+        ),
+    ]
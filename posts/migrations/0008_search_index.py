@@ -0,0 +1,74 @@
+from django.db import migrations
+
+# See posts.search: posts use rowid id * 2, comments id * 2 + 1
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE posts_search USING fts5(
+        content, post_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER posts_post_search_insert AFTER INSERT ON posts_post BEGIN
+        INSERT INTO posts_search(rowid, content, post_id) VALUES (new.id * 2, new.content, new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER posts_post_search_update AFTER UPDATE OF content ON posts_post BEGIN
+        UPDATE posts_search SET content = new.content WHERE rowid = new.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER posts_post_search_delete AFTER DELETE ON posts_post BEGIN
+        DELETE FROM posts_search WHERE rowid = old.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER posts_comment_search_insert AFTER INSERT ON posts_comment BEGIN
+        INSERT INTO posts_search(rowid, content, post_id) VALUES (new.id * 2 + 1, new.content, new.post_id);
+    END
+    """,
+    """
+    CREATE TRIGGER posts_comment_search_update AFTER UPDATE OF content, post_id ON posts_comment BEGIN
+        UPDATE posts_search SET content = new.content, post_id = new.post_id WHERE rowid = new.id * 2 + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER posts_comment_search_delete AFTER DELETE ON posts_comment BEGIN
+        DELETE FROM posts_search WHERE rowid = old.id * 2 + 1;
+    END
+    """,
+    # Index whatever already exists
+    "INSERT INTO posts_search(rowid, content, post_id) SELECT id * 2, content, id FROM posts_post",
+    "INSERT INTO posts_search(rowid, content, post_id) SELECT id * 2 + 1, content, post_id FROM posts_comment",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS posts_post_search_insert',
+    'DROP TRIGGER IF EXISTS posts_post_search_update',
+    'DROP TRIGGER IF EXISTS posts_post_search_delete',
+    'DROP TRIGGER IF EXISTS posts_comment_search_insert',
+    'DROP TRIGGER IF EXISTS posts_comment_search_update',
+    'DROP TRIGGER IF EXISTS posts_comment_search_delete',
+    'DROP TABLE IF EXISTS posts_search',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # FTS5 is SQLite-only; other backends simply have no search index
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_SQL), run(DROP_SQL)),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_post_user_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Post'), ('comment', 'Comment')], help_text='What changed: a post or a comment', max_length=10)),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], help_text='How it changed', max_length=10)),
+                ('object_id', models.BigIntegerField(help_text='Id of the post or comment')),
+                ('post_id', models.BigIntegerField(help_text='Post the change belongs to; the post itself for post events')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, help_text='When the change was written')),
+            ],
+            options={
+                'verbose_name': 'Change event',
+                'verbose_name_plural': 'Change events',
+                'ordering': ['id'],
+            },
+        ),
+    ]
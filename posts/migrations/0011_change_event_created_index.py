@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_change_event'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['created_at'], name='changeevent_created_idx'),
+        ),
+    ]
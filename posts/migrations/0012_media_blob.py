@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_change_event_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Storage name, derived from the content hash', max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField(help_text='File size in bytes')),
+                ('refcount', models.PositiveIntegerField(default=0, help_text='Posts referring to this file, maintained by posts.signals')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, help_text='When the content was first stored')),
+            ],
+            options={
+                'verbose_name': 'Media blob',
+                'verbose_name_plural': 'Media blobs',
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:05
+
+import re
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import migrations
+
+# <directory>/<first two hex digits>/<sha256><ext>, as posts.storage names files
+CONTENT_ADDRESSED = re.compile(r'(?:.*/)?([0-9a-f]{2})/\1[0-9a-f]{62}(?:\.\w+)?')
+
+
+def backfill_media_blobs(apps, schema_editor):
+    # Content-addressed files stored before 0012 have no MediaBlob, and
+    # MediaStorage.delete() would remove them while another post still
+    # shares them. Count the references every post makes now.
+    Post = apps.get_model('posts', 'Post')
+    MediaBlob = apps.get_model('posts', 'MediaBlob')
+    counts = Counter()
+    for image, variants in Post.objects.values_list('image', 'image_variants').iterator():
+        names = {variant['path'] for variant in variants or []}
+        if image:
+            names.add(image)
+        counts.update(name for name in names if CONTENT_ADDRESSED.fullmatch(name))
+    for name, refcount in counts.items():
+        if not default_storage.exists(name):
+            continue
+        MediaBlob.objects.update_or_create(
+            name=name, defaults={'size': default_storage.size(name), 'refcount': refcount},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_media_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_media_blobs, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,63 @@
 from django.db import models
+from django.conf import settings
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 from django.contrib.auth.models import User
 
+
+class PostQuerySet(models.QuerySet):
+    """Query helpers for Post"""
+
+    def for_feed(self):
+        """
+        Load everything PostSerializer touches in a fixed number of queries:
+        the author by join and the latest comments and their authors by one
+        windowed prefetch. The comment count is the stored counter column.
+        """
+        return (
+            self.select_related('user')
+            .prefetch_related(
+                # Slicing a prefetch makes Django partition by post with
+                # ROW_NUMBER(), so this stays one query however many posts.
+                models.Prefetch(
+                    'comments',
+                    queryset=Comment.objects.select_related('user')
+                    .order_by('-created_at', '-id')[:settings.COMMENT_PREVIEW_SIZE],
+                    to_attr='latest_comments',
+                )
+            )
+        )
+
+    def add_to_comments_count(self, delta):
+        """Atomically shift the stored comment counter, never below zero"""
+        return self.update(
+            comments_count=Greatest(models.F('comments_count') + delta, 0)
+        )
+
+    def _actual_comments_count(self):
+        return Coalesce(
+            models.Subquery(
+                Comment.objects.filter(post=models.OuterRef('pk'))
+                .order_by()
+                .values('post')
+                .annotate(total=models.Count('id'))
+                .values('total')
+            ),
+            0,
+        )
+
+    def recount_comments(self):
+        """Recompute the stored counter from the comments table"""
+        return self.update(comments_count=self._actual_comments_count())
+
+    def with_stale_comments_count(self):
+        """Posts whose stored counter disagrees with the comments table"""
+        return (
+            self.annotate(actual_comments_count=self._actual_comments_count())
+            .exclude(comments_count=models.F('actual_comments_count'))
+        )
+
+
 class Post(models.Model):
     """
     Model for social media posts
@@ -21,6 +77,24 @@ class Post(models.Model):
         null=True,
         help_text="Optional image for the post"
     )
+    image_width = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Width of the original image in pixels"
+    )
+    image_height = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Height of the original image in pixels"
+    )
+    image_variants = models.JSONField(
+        default=list,
+        blank=True,
+        editable=False,
+        help_text="Resized derivatives: width, height, format and storage path"
+    )
     created_at = models.DateTimeField(
         default=timezone.now,
         help_text="When the post was created"
@@ -29,11 +103,26 @@ class Post(models.Model):
         auto_now=True,
         help_text="When the post was last updated"
     )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Number of comments, maintained by posts.signals"
+    )
+
+    objects = PostQuerySet.as_manager()
     
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
         verbose_name = 'Post'
         verbose_name_plural = 'Posts'
+        indexes = [
+            # Backs keyset pagination of the feed on (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='post_created_id_idx'),
+            # Lets conditional GETs read MAX(updated_at) without a table scan
+            models.Index(fields=['updated_at'], name='post_updated_idx'),
+            # Serves one user's posts newest first (admin user filter)
+            models.Index(fields=['user', 'created_at', 'id'], name='post_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - Post {self.id} - {self.content[:50]}..."
@@ -62,11 +151,186 @@ class Comment(models.Model):
         default=timezone.now,
         help_text="When the comment was created"
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text="When the comment was last updated"
+    )
     
     class Meta:
         ordering = ['created_at']
         verbose_name = 'Comment'
         verbose_name_plural = 'Comments'
+        indexes = [
+            # Backs paginated comment threads and the per-post preview window
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_idx'),
+            models.Index(fields=['updated_at'], name='comment_updated_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.username} commented on Post {self.post.id}"
\ No newline at end of file
+        return f"{self.user.username} commented on Post {self.post.id}"
+
+
+class Job(models.Model):
+    """
+    Background work queued by request handlers and run by `manage.py run_jobs`
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(
+        max_length=100,
+        help_text="Registered task name, see posts.jobs"
+    )
+    key = models.CharField(
+        max_length=255,
+        unique=True,
+        null=True,
+        blank=True,
+        help_text="Idempotency key; enqueueing the same key twice yields one job"
+    )
+    payload = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Keyword arguments passed to the task"
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        help_text="Where the job is in its lifecycle"
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        help_text="How many times the job has been started"
+    )
+    max_attempts = models.PositiveIntegerField(
+        default=3,
+        help_text="Attempts before the job is marked failed"
+    )
+    run_after = models.DateTimeField(
+        default=timezone.now,
+        help_text="Earliest time the job may run, pushed back between retries"
+    )
+    locked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When a worker claimed the job"
+    )
+    last_error = models.TextField(
+        blank=True,
+        help_text="Traceback of the most recent failure"
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="When the job was queued"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text="When the job last changed state"
+    )
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        verbose_name = 'Job'
+        verbose_name_plural = 'Jobs'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+
+class ChangeEvent(models.Model):
+    """
+    One entry in the append-only log of post and comment writes (see
+    posts.events). The id is the sequence number clients resume from.
+    """
+    POST = 'post'
+    COMMENT = 'comment'
+    KIND_CHOICES = [
+        (POST, 'Post'),
+        (COMMENT, 'Comment'),
+    ]
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    ]
+
+    kind = models.CharField(
+        max_length=10,
+        choices=KIND_CHOICES,
+        help_text="What changed: a post or a comment"
+    )
+    action = models.CharField(
+        max_length=10,
+        choices=ACTION_CHOICES,
+        help_text="How it changed"
+    )
+    # Plain ids rather than foreign keys: events outlive the rows they describe
+    object_id = models.BigIntegerField(
+        help_text="Id of the post or comment"
+    )
+    post_id = models.BigIntegerField(
+        help_text="Post the change belongs to; the post itself for post events"
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="When the change was written"
+    )
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Change event'
+        verbose_name_plural = 'Change events'
+        indexes = [
+            # Lets compaction find the newest expired event without a scan
+            models.Index(fields=['created_at'], name='changeevent_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind}.{self.action} {self.object_id}"
+
+
+class MediaBlob(models.Model):
+    """
+    A stored file named after the SHA-256 of its content (see
+    posts.storage). Posts uploading the same bytes share it; refcount is
+    the number of posts whose image or variants name it, and the file is
+    deleted once that reaches zero.
+    """
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        help_text="Storage name, derived from the content hash"
+    )
+    size = models.PositiveBigIntegerField(
+        help_text="File size in bytes"
+    )
+    refcount = models.PositiveIntegerField(
+        default=0,
+        help_text="Posts referring to this file, maintained by posts.signals"
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="When the content was first stored"
+    )
+
+    class Meta:
+        verbose_name = 'Media blob'
+        verbose_name_plural = 'Media blobs'
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
@@ -0,0 +1,136 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(created_at, pk):
+    """Pack a (created_at, id) position into an opaque URL-safe token"""
+    payload = json.dumps({'c': created_at.isoformat(), 'i': pk}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Unpack a token produced by encode_cursor, raising ValidationError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        created_at = parse_datetime(payload['c'])
+        pk = int(payload['i'])
+    except (ValueError, TypeError, KeyError, UnicodeDecodeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    if created_at is None:
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return created_at, pk
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination on (created_at, id).
+
+    Each page is fetched with a range condition on the last row seen instead of
+    an OFFSET, so deep pages cost the same as the first one as long as the
+    ordering is backed by an index.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    default_limit = 20
+    max_limit = 100
+    descending = True
+
+    def get_ordering(self):
+        prefix = '-' if self.descending else ''
+        return [prefix + 'created_at', prefix + 'id']
+
+    def get_limit(self, request):
+        raw = request.query_params.get(self.limit_query_param)
+        if raw in (None, ''):
+            return self.default_limit
+        try:
+            limit = int(raw)
+        except ValueError:
+            raise ValidationError({'limit': 'Limit must be an integer'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Limit must be positive'})
+        return min(limit, self.max_limit)
+
+    def filter_after(self, queryset, created_at, pk):
+        """Restrict queryset to rows strictly after the given position"""
+        if self.descending:
+            return queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+        return queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        )
+
+    def page_queryset(self, queryset, request):
+        """The slice to fetch for this request's page, one row longer than the page"""
+        self.request = request
+        self.limit = self.get_limit(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+
+        queryset = queryset.order_by(*self.get_ordering())
+        if cursor:
+            queryset = self.filter_after(queryset, *decode_cursor(cursor))
+        # Fetch one extra row to learn whether another page exists
+        return queryset[:self.limit + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.page_from_rows(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset with the async ORM, for async views"""
+        return self.page_from_rows([row async for row in self.page_queryset(queryset, request)])
+
+    def page_from_rows(self, rows):
+        page = rows[:self.limit]
+        if len(rows) > self.limit:
+            last = page[-1]
+            # Model instances, or dicts from .values() (posts.fast_serializers)
+            if isinstance(last, dict):
+                self.next_cursor = encode_cursor(last['created_at'], last['id'])
+            else:
+                self.next_cursor = encode_cursor(last.created_at, last.pk)
+        else:
+            self.next_cursor = None
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class PostPagination(KeysetPagination):
+    """Newest posts first"""
+    descending = True
+
+
+class CommentPagination(KeysetPagination):
+    """Oldest comments first, matching Comment.Meta.ordering"""
+    descending = False
@@ -0,0 +1,33 @@
+"""
+JSON rendering with orjson.
+
+ORJSONRenderer produces the same bytes as DRF's JSONRenderer with this
+project's settings (compact separators, UTF-8 rather than \\u escapes)
+several times faster. Whatever orjson would write differently is left to
+DRF: datetimes and other non-JSON types go through DRF's encoder, U+2028
+and U+2029 are escaped as DRF does, and indented output (an `indent`
+parameter in Accept) and anything orjson refuses, such as integers beyond
+64 bits, fall back to JSONRenderer itself.
+"""
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer, rendered by orjson"""
+    _default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            rendered = orjson.dumps(data, default=self._default, option=OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Keep the output a valid JavaScript literal, as JSONRenderer does
+        return rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
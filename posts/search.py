@@ -0,0 +1,215 @@
+"""
+Full-text search over post and comment content.
+
+Both kinds of content live in one SQLite FTS5 table, posts_search, created by
+migration 0008. Triggers on posts_post and posts_comment keep it in sync, so
+every write path (including bulk_create in the batch endpoints and deletes
+that cascade from a post) updates the index without any Python code.
+
+Rows are keyed by rowid: a post's is id * 2 and a comment's is id * 2 + 1, so
+the triggers and the admin can address one object's row without a second
+index. Results are ordered by FTS5's bm25 rank and paginated with a cursor on
+(rank, rowid), like the feed's keyset pagination.
+"""
+import base64
+import html
+import json
+import re
+
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Post, Comment
+
+SEARCH_TABLE = 'posts_search'
+
+POST = 'post'
+COMMENT = 'comment'
+KINDS = {POST: 0, COMMENT: 1}
+
+# Markers wrapped around matched terms in snippets. FTS5 inserts private-use
+# sentinels, the snippet is HTML-escaped, and only then do they become tags,
+# so user content can never smuggle markup into the response.
+SENTINELS = ('\ue000', '\ue001')
+HIGHLIGHT = ('<mark>', '</mark>')
+SNIPPET_TOKENS = 16
+
+# Words (optionally ending in * for a prefix match) accepted from the user
+TERM_RE = re.compile(r'\w+\*?')
+
+
+def match_expression(text):
+    """
+    Turn free text into an FTS5 query that matches documents containing every
+    word. Each term is quoted so FTS5 operators and punctuation in user input
+    are never interpreted. Returns None when the text has no searchable words.
+    """
+    terms = []
+    for term in TERM_RE.findall(text or ''):
+        if term.endswith('*'):
+            terms.append(f'"{term[:-1]}"*')
+        else:
+            terms.append(f'"{term}"')
+    return ' '.join(terms) or None
+
+
+def highlight(snippet):
+    """An FTS5 snippet made with SENTINELS as safe HTML with <mark> around matches"""
+    snippet = html.escape(snippet)
+    for sentinel, tag in zip(SENTINELS, HIGHLIGHT):
+        snippet = snippet.replace(sentinel, tag)
+    return snippet
+
+
+def encode_cursor(rank, rowid):
+    """Pack a (rank, rowid) position into an opaque URL-safe token"""
+    payload = json.dumps({'r': rank, 'i': rowid}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Unpack a token produced by encode_cursor, raising ValidationError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return float(payload['r']), int(payload['i'])
+    except (ValueError, TypeError, KeyError, UnicodeDecodeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+
+
+def search(text, kind=None, limit=20, cursor=None):
+    """
+    Rank matches for text, best first.
+
+    Returns (hits, next_cursor) where each hit is a dict with type, id,
+    post_id, rank and a highlighted snippet.
+    """
+    if kind is not None and kind not in KINDS:
+        raise ValidationError({'type': f"Type must be one of: {', '.join(KINDS)}"})
+    expression = match_expression(text)
+    if expression is None:
+        return [], None
+
+    where = [f'{SEARCH_TABLE} MATCH %s']
+    params = [expression]
+    if kind is not None:
+        where.append('(rowid & 1) = %s')
+        params.append(KINDS[kind])
+    if cursor:
+        rank, rowid = decode_cursor(cursor)
+        where.append('(rank > %s OR (rank = %s AND rowid > %s))')
+        params += [rank, rank, rowid]
+
+    start, end = SENTINELS
+    sql = (
+        f"SELECT rowid, post_id, rank, "
+        f"snippet({SEARCH_TABLE}, 0, %s, %s, '...', %s) "
+        f"FROM {SEARCH_TABLE} WHERE {' AND '.join(where)} "
+        f"ORDER BY rank, rowid LIMIT %s"
+    )
+    with connection.cursor() as db:
+        # Fetch one extra row to learn whether another page exists
+        db.execute(sql, [start, end, SNIPPET_TOKENS] + params + [limit + 1])
+        rows = db.fetchall()
+
+    hits = [
+        {
+            'type': COMMENT if rowid & 1 else POST,
+            'id': rowid >> 1,
+            'post_id': post_id,
+            'rank': rank,
+            'snippet': highlight(snippet),
+        }
+        for rowid, post_id, rank, snippet in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        rowid, _, rank, _ = rows[limit - 1]
+        next_cursor = encode_cursor(rank, rowid)
+    return hits, next_cursor
+
+
+def attach_objects(hits):
+    """
+    Add username, content and created_at from the matched rows, in one query
+    per kind. Hits whose object was deleted since the search are dropped.
+    """
+    objects = {}
+    for kind, model in ((POST, Post), (COMMENT, Comment)):
+        ids = [hit['id'] for hit in hits if hit['type'] == kind]
+        if ids:
+            objects[kind] = model.objects.select_related('user').in_bulk(ids)
+    results = []
+    for hit in hits:
+        obj = objects[hit['type']].get(hit['id'])
+        if obj is None:
+            continue
+        results.append({
+            **hit,
+            'username': obj.user.username,
+            'content': obj.content,
+            'created_at': obj.created_at,
+        })
+    return results
+
+
+def matching_ids_sql(kind):
+    """
+    SQL selecting the ids of objects of the given kind that match one
+    MATCH expression parameter, for use in a pk__in filter.
+    """
+    return (
+        f'SELECT rowid >> 1 FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s AND (rowid & 1) = {KINDS[kind]}'
+    )
+
+
+def rebuild(batch_size=1000, progress=None):
+    """
+    Re-index every post and comment in primary-key batches, then drop rows
+    whose object no longer exists. Each batch is its own short transaction and
+    replaces rows in place, so search keeps working while this runs.
+
+    Returns (posts, comments) indexed.
+    """
+    counts = []
+    for model, rowid_sql, post_id_column in (
+        (Post, 'id * 2', 'id'),
+        (Comment, 'id * 2 + 1', 'post_id'),
+    ):
+        table = connection.ops.quote_name(model._meta.db_table)
+        indexed = 0
+        last_pk = 0
+        while True:
+            ids = list(
+                model.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic(), connection.cursor() as db:
+                db.execute(
+                    f'INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, content, post_id) '
+                    f'SELECT {rowid_sql}, content, {post_id_column} FROM {table} '
+                    f'WHERE id BETWEEN %s AND %s',
+                    [ids[0], ids[-1]],
+                )
+            indexed += len(ids)
+            last_pk = ids[-1]
+            if progress:
+                progress(model._meta.verbose_name_plural, indexed)
+        counts.append(indexed)
+
+        parity = KINDS[POST if model is Post else COMMENT]
+        with connection.cursor() as db:
+            db.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE (rowid & 1) = %s '
+                f'AND (rowid >> 1) NOT IN (SELECT id FROM {table})',
+                [parity],
+            )
+
+    with connection.cursor() as db:
+        # Merge the b-tree segments left behind by many small transactions
+        db.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+    return tuple(counts)
@@ -1,9 +1,45 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Post, Comment
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils.functional import cached_property
+from .metrics import serializing
+from .models import Post, Comment, Job
+from .storage import media_urls
+from .uploads import check_upload
+from .users import get_user
 
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedListSerializer(serializers.ListSerializer):
+    """ListSerializer whose output is timed as serialization (see posts.metrics)"""
+    @property
+    def data(self):
+        with serializing():
+            return super().data
+
+
+class TimedSerializerMixin:
+    """Times .data as serialization, for single objects and (as TimedListSerializer) lists"""
+    @property
+    def data(self):
+        with serializing():
+            return super().data
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        # DRF's many_init, with TimedListSerializer unless Meta names another class
+        list_kwargs = {}
+        for key in serializers.LIST_SERIALIZER_KWARGS_REMOVE:
+            value = kwargs.pop(key, None)
+            if value is not None:
+                list_kwargs[key] = value
+        list_kwargs['child'] = cls(*args, **kwargs)
+        list_kwargs.update({key: value for key, value in kwargs.items() if key in serializers.LIST_SERIALIZER_KWARGS})
+        list_serializer_class = getattr(getattr(cls, 'Meta', None), 'list_serializer_class', TimedListSerializer)
+        return list_serializer_class(*args, **list_kwargs)
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for User model"""
     class Meta:
         model = User
@@ -11,7 +47,7 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Comment model"""
     user = UserSerializer(read_only=True)
     username = serializers.CharField(write_only=True, required=False)
@@ -24,44 +60,102 @@ class CommentSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         username = validated_data.pop('username', None)
         if username:
-            user, created = User.objects.get_or_create(username=username)
-            validated_data['user'] = user
+            validated_data['user'] = get_user(username)
         return super().create(validated_data)
 
 
-class PostSerializer(serializers.ModelSerializer):
+class MediaImageField(serializers.ImageField):
+    """ImageField with upload limits, whose URL comes from the parent serializer's media_url"""
+    def to_internal_value(self, data):
+        # Before Pillow verifies the whole file
+        if hasattr(data, 'size'):
+            try:
+                check_upload(data)
+            except DjangoValidationError as e:
+                raise serializers.ValidationError(e.messages)
+        return super().to_internal_value(data)
+    
+    def to_representation(self, value):
+        if not value:
+            return None
+        return self.parent.media_url(value.name)
+
+
+class PostSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Post model"""
     user = UserSerializer(read_only=True)
     username = serializers.CharField(write_only=True, required=False)
-    comments = CommentSerializer(many=True, read_only=True)
-    comments_count = serializers.SerializerMethodField()
-    image = serializers.ImageField(required=False, allow_null=True)
+    comments = serializers.SerializerMethodField()
+    image = MediaImageField(required=False, allow_null=True)
+    image_variants = serializers.SerializerMethodField()
     
     class Meta:
         model = Post
-        fields = ['id', 'user', 'username', 'content', 'image', 'comments', 
-                  'comments_count', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'user', 'comments', 'comments_count']
+        fields = ['id', 'user', 'username', 'content', 'image', 'image_width',
+                  'image_height', 'image_variants', 'comments', 'comments_count',
+                  'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'user', 'comments', 'comments_count',
+                            'image_width', 'image_height', 'image_variants']
     
-    def get_comments_count(self, obj):
-        return obj.comments.count()
+    def get_comments(self, obj):
+        # Only the latest few comments are embedded; the full thread is
+        # paginated through get_comments
+        comments = getattr(obj, 'latest_comments', None)
+        if comments is None:
+            comments = obj.comments.select_related('user').order_by(
+                '-created_at', '-id'
+            )[:settings.COMMENT_PREVIEW_SIZE]
+        # Newest-first from the query, shown oldest-first like the thread
+        comments = list(comments)[::-1]
+        return CommentSerializer(comments, many=True, context=self.context).data
     
     def create(self, validated_data):
         username = validated_data.pop('username', 'admin')
-        user, created = User.objects.get_or_create(username=username)
-        validated_data['user'] = user
+        validated_data['user'] = get_user(username)
         return super().create(validated_data)
     
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        
-        if instance.image:
-            request = self.context.get('request')
-            if request:
-                representation['image'] = request.build_absolute_uri(instance.image.url)
-            else:
-                representation['image'] = instance.image.url
-        else:
-            representation['image'] = None
-            
-        return representation
\ No newline at end of file
+    @cached_property
+    def media_url(self):
+        # One builder for the whole list, so the host is parsed once
+        return media_urls(self.context.get('request'))
+    
+    def get_image_variants(self, obj):
+        # Stored paths become URLs so clients can pick the smallest fit
+        return [
+            {
+                'width': variant['width'],
+                'height': variant['height'],
+                'format': variant['format'],
+                'url': self.media_url(variant['path']),
+            }
+            for variant in obj.image_variants or []
+        ]
+
+
+class JobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Read-only view of a background job's progress"""
+    last_error = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Job
+        fields = ['id', 'name', 'key', 'status', 'attempts', 'max_attempts',
+                  'run_after', 'last_error', 'created_at', 'updated_at']
+        read_only_fields = fields
+    
+    def get_last_error(self, obj):
+        # Just the exception line: the traceback stays in the row and admin
+        lines = obj.last_error.strip().splitlines()
+        return lines[-1] if lines else ''
+
+
+class BatchPostItemSerializer(serializers.Serializer):
+    """One entry of a batch create-posts request"""
+    content = serializers.CharField()
+    username = serializers.CharField(max_length=150, required=False, default='admin')
+
+
+class BatchCommentItemSerializer(serializers.Serializer):
+    """One entry of a batch add-comments request"""
+    post = serializers.IntegerField(min_value=1)
+    content = serializers.CharField()
+    username = serializers.CharField(max_length=150, required=False, default='anonymous')
@@ -0,0 +1,149 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import events, storage
+from .cache import bump_comments_version, bump_feed_version, bump_users_version
+from .jobs import enqueue
+from .users import user_cache
+from .models import ChangeEvent, Post, Comment
+
+
+@receiver(post_save, sender=Comment)
+def increment_comments_count(sender, instance, created, raw=False, **kwargs):
+    """Bump the parent post's counter when a comment is created"""
+    if created and not raw:
+        Post.objects.filter(pk=instance.post_id).add_to_comments_count(1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comments_count(sender, instance, origin=None, **kwargs):
+    """Drop the parent post's counter when a comment is deleted, including cascades"""
+    # When the post itself is being deleted there is nothing left to update
+    if isinstance(origin, Post) and origin.pk == instance.post_id:
+        return
+    Post.objects.filter(pk=instance.post_id).add_to_comments_count(-1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_responses(sender, instance, **kwargs):
+    """Posts appear in the feed, and deleting one empties its comment thread"""
+    bump_feed_version()
+    bump_comments_version(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_responses(sender, instance, origin=None, **kwargs):
+    """Comments appear in their thread and, as previews and counts, in the feed"""
+    if isinstance(origin, Post) and origin.pk == instance.post_id:
+        return
+    bump_feed_version()
+    bump_comments_version(instance.post_id)
+
+
+@receiver(post_save, sender=Post)
+def record_post_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        action = ChangeEvent.CREATED if created else ChangeEvent.UPDATED
+        events.record(ChangeEvent.POST, action, instance.pk, instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def record_post_deleted(sender, instance, **kwargs):
+    events.record(ChangeEvent.POST, ChangeEvent.DELETED, instance.pk, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def record_comment_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        action = ChangeEvent.CREATED if created else ChangeEvent.UPDATED
+        events.record(ChangeEvent.COMMENT, action, instance.pk, instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def record_comment_deleted(sender, instance, origin=None, **kwargs):
+    """Comments going with their post are covered by the post's event"""
+    if isinstance(origin, Post) and origin.pk == instance.post_id:
+        return
+    events.record(ChangeEvent.COMMENT, ChangeEvent.DELETED, instance.pk, instance.post_id)
+
+
+@receiver(pre_save, sender=User)
+def remember_username(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Note the stored username, for record_user_renamed"""
+    instance._previous_username = None
+    if raw or instance._state.adding or (update_fields is not None and 'username' not in update_fields):
+        return
+    instance._previous_username = User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def record_user_renamed(sender, instance, **kwargs):
+    """Posts and comments show their author's name, so a rename changes them all"""
+    previous = getattr(instance, '_previous_username', None)
+    if previous is None or previous == instance.username:
+        return
+    events.record_many(ChangeEvent.POST, ChangeEvent.UPDATED, [
+        (pk, pk) for pk in Post.objects.filter(user=instance).values_list('pk', flat=True)
+    ])
+    events.record_many(
+        ChangeEvent.COMMENT, ChangeEvent.UPDATED, Comment.objects.filter(user=instance).values_list('pk', 'post_id'),
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_responses(sender, instance, created=False, **kwargs):
+    """Usernames are embedded in every cached page and in the lookup caches"""
+    if not created:
+        user_cache.forget(instance.pk)
+        bump_users_version()
+    bump_feed_version()
+
+
+# Stored files are shared between posts with the same content and counted
+# in MediaBlob.refcount (see posts.storage); files a post stops referring to
+# are handed to a worker, which deletes those nothing else uses.
+
+MEDIA_FIELDS = {'image', 'image_variants'}
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_media(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Note what the stored row refers to, for count_post_media"""
+    instance._previous_media = None
+    if raw or (update_fields is not None and not MEDIA_FIELDS & set(update_fields)):
+        return
+    previous = None
+    if not instance._state.adding:
+        previous = Post.objects.filter(pk=instance.pk).values('image', 'image_variants').first()
+    instance._previous_media = storage.post_media(previous['image'], previous['image_variants']) if previous else set()
+
+
+@receiver(post_save, sender=Post)
+def count_post_media(sender, instance, raw=False, **kwargs):
+    """Move the reference counts from the files the post dropped to those it gained"""
+    previous = getattr(instance, '_previous_media', None)
+    if previous is None:
+        return
+    current = storage.post_media(instance.image.name, instance.image_variants)
+    storage.retain(current - previous)
+    dropped = previous - current
+    if dropped:
+        storage.release(dropped)
+        enqueue('delete_media', {'paths': sorted(dropped)})
+
+
+@receiver(post_delete, sender=Post)
+def release_post_media(sender, instance, **kwargs):
+    """The image and derivatives belong to the post; a worker removes the files"""
+    names = storage.post_media(instance.image.name, instance.image_variants)
+    if names:
+        storage.release(names)
+        enqueue(
+            'delete_media',
+            {'paths': sorted(names)},
+            key=f'delete_media:post:{instance.pk}',
+        )
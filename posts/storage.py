@@ -0,0 +1,194 @@
+"""
+The media storage backend and the URLs it hands out.
+
+Uploads are content-addressed. MediaStorage streams each file to a
+temporary file in MEDIA_UPLOAD_CHUNK_SIZE chunks while hashing it, then
+stores it as <directory>/<first two hex digits>/<sha256><ext>. The same
+bytes posted twice (or the same variant generated twice) land on the same
+name and are stored once. A MediaBlob row per stored name counts the posts
+referring to it: posts.signals moves the counts in the same transaction as
+the post row, and delete() only removes a file whose count is zero. Files
+stored before this scheme have no MediaBlob and are deleted as before.
+A file is moved into place before its MediaBlob row commits; if that
+transaction rolls back the file stays behind without a row, and
+`manage.py clean_media` removes such files once they are old enough that no
+transaction can still claim them.
+
+A feed page carries a URL for every image and image variant. Building each
+one meant quoting the path and joining it onto MEDIA_URL in the storage,
+then parsing the result again in request.build_absolute_uri to put the
+host in front. Stored names never change meaning, so MediaStorage keeps the
+URL of every name it has resolved in a bounded per-process LRU, and
+media_urls(request) works out the scheme and host once per response instead
+of once per file.
+
+MEDIA_BASE_URL (env DJANGO_MEDIA_BASE_URL) serves media from elsewhere,
+e.g. a CDN: every URL is that prefix plus the path, the same whichever
+host the request came to. Left empty, URLs are MEDIA_URL on the requesting
+host, as Django builds them.
+"""
+import contextlib
+import hashlib
+import os
+import posixpath
+import re
+import uuid
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils.functional import cached_property
+
+from .models import MediaBlob
+
+# Directory under MEDIA_ROOT where uploads are written while being hashed;
+# on the same filesystem so moving them into place is a rename
+INCOMING_DIR = '.incoming'
+
+# <directory>/<first two hex digits>/<sha256><ext>, as _save names files
+CONTENT_ADDRESSED = re.compile(r'(?:.*/)?([0-9a-f]{2})/\1[0-9a-f]{62}(?:\.\w+)?')
+
+
+class MediaStorage(FileSystemStorage):
+    """Content-addressed FileSystemStorage that remembers URLs and honours MEDIA_BASE_URL"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._urls = lru_cache(maxsize=settings.MEDIA_URL_CACHE_SIZE)(super().url)
+
+    @cached_property
+    def base_url(self):
+        if self._base_url is None and settings.MEDIA_BASE_URL:
+            return settings.MEDIA_BASE_URL.rstrip('/') + '/'
+        return super().base_url
+
+    def url(self, name):
+        return self._urls(name)
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content in _save, and equal content
+        # may share it, so there is nothing to make unique
+        return name
+
+    def _receive(self, content):
+        """Copy content to a new incoming file chunk by chunk; returns (path, sha256, size)"""
+        directory = self.path(INCOMING_DIR)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            # os.open honours the umask like FileSystemStorage, unlike tempfile
+            with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), 'wb') as incoming:
+                for chunk in content.chunks(settings.MEDIA_UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    incoming.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            raise
+        return path, digest.hexdigest(), size
+
+    def _save(self, name, content):
+        incoming, sha256, size = self._receive(content)
+        directory, filename = posixpath.split(name)
+        name = posixpath.join(directory, sha256[:2], sha256 + posixpath.splitext(filename)[1].lower())
+        try:
+            with transaction.atomic():
+                # Write the row first: that takes SQLite's write lock, so delete()
+                # can't remove the same file between the check below and commit
+                if not MediaBlob.objects.filter(name=name).update(size=size):
+                    MediaBlob.objects.create(name=name, size=size)
+                target = self.path(name)
+                if os.path.exists(target):
+                    os.remove(incoming)
+                    # A file without a row may be an orphan; keep clean_media off it
+                    os.utime(target)
+                else:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(incoming, target)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(target, self.file_permissions_mode)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(incoming)
+            raise
+        return name
+
+    def delete(self, name):
+        """Remove the file unless a post still refers to it"""
+        with transaction.atomic():
+            removed, _ = MediaBlob.objects.filter(name=name, refcount=0).delete()
+            if removed or not MediaBlob.objects.filter(name=name).exists():
+                super().delete(name)
+
+    def orphans(self, before):
+        """
+        Names of incoming and content-addressed files last modified before
+        the timestamp before: the candidates clean_media checks for rows
+        """
+        for root, _, filenames in os.walk(self.location):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.location).replace(os.sep, '/')
+                if not (name.startswith(INCOMING_DIR + '/') or CONTENT_ADDRESSED.fullmatch(name)):
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    if os.path.getmtime(path) < before:
+                        yield name
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting in ('MEDIA_URL', 'MEDIA_BASE_URL'):
+            self.__dict__.pop('base_url', None)
+            self._urls.cache_clear()
+
+
+def post_media(image, variants):
+    """The stored names a post refers to: its image and its variants"""
+    names = {variant['path'] for variant in variants or []}
+    if image:
+        names.add(str(image))
+    return names
+
+
+def retain(names):
+    """
+    Count one more reference per occurrence of each stored name (a bulk
+    write passes every post's names); call in the referring rows' transaction
+    """
+    by_count = defaultdict(list)
+    for name, count in Counter(names).items():
+        by_count[count].append(name)
+    for count, group in by_count.items():
+        MediaBlob.objects.filter(name__in=group).update(refcount=F('refcount') + count)
+
+
+def release(names):
+    """Count one reference less; the files go when delete() is called at zero"""
+    MediaBlob.objects.filter(name__in=names, refcount__gt=0).update(refcount=F('refcount') - 1)
+
+
+def media_urls(request=None, storage=default_storage):
+    """
+    A function from stored name to public URL for one response: what
+    request.build_absolute_uri(storage.url(name)) returns, with the
+    request's part worked out once. Without a request, or with
+    MEDIA_BASE_URL set, the storage's URLs are already final.
+    """
+    url = storage.url
+    if request is None or settings.MEDIA_BASE_URL:
+        return url
+    origin = request.build_absolute_uri('/')[:-1]
+
+    def absolute(name):
+        path = url(name)
+        # Host-relative paths just get the host; leave anything else to Django
+        if path.startswith('/') and not path.startswith('//') and '/.' not in path:
+            return origin + path
+        return request.build_absolute_uri(path)
+    return absolute
@@ -0,0 +1,126 @@
+"""
+Deterministic synthetic data for benchmarks and local testing.
+
+The same arguments and seed always produce the same users, posts, comments,
+timestamps and image metadata, so two benchmark runs measure the same
+workload. Image posts only get image metadata (name, size and variant
+paths); no files are written, so their URLs are built but don't resolve.
+
+Rows are written with bulk_create, which skips model signals, so comment
+counters are set directly and the media reference counts, change events
+and feed cache version are written here, as in posts.batch.
+"""
+import posixpath
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+
+from . import events, storage
+from .cache import bump_feed_version
+from .models import ChangeEvent, Post, Comment
+from .users import resolve_usernames
+
+# Vocabulary for post and comment text; the first word is in every post
+WORDS = (
+    'update', 'coffee', 'weekend', 'travel', 'music', 'python', 'django',
+    'sunset', 'garden', 'recipe', 'running', 'books', 'photo', 'city',
+    'mountain', 'ocean', 'friends', 'project', 'release', 'concert',
+    'morning', 'rain', 'market', 'museum', 'bicycle', 'library', 'winter',
+    'summer', 'festival', 'podcast',
+)
+
+# Every generated timestamp falls after this, one post every few minutes
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+IMAGE_SIZES = ((1600, 1200), (1080, 1080), (1920, 1080), (800, 1000))
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _image_fields(rng, number):
+    """Image metadata shaped like posts.images.build_variants output"""
+    width, height = rng.choice(IMAGE_SIZES)
+    name = f'synthetic-{number}'
+    variants = []
+    for target in sorted({min(w, width) for w in settings.IMAGE_VARIANT_WIDTHS}):
+        for ext in settings.IMAGE_VARIANT_FORMATS:
+            variants.append({
+                'width': target,
+                'height': max(1, round(height * target / width)),
+                'format': ext,
+                'path': posixpath.join('posts', 'variants', 'synthetic', f'{name}-{target}w.{ext}'),
+            })
+    return {
+        'image': f'posts/{name}.jpg',
+        'image_width': width,
+        'image_height': height,
+        'image_variants': variants,
+    }
+
+
+def generate(users=50, posts=1000, comments_per_post=5, image_ratio=0.2, seed=0,
+             batch_size=1000, progress=None):
+    """
+    Add users, posts and comments to the database.
+
+    Posts are spread over the users, a post has between 0 and twice
+    comments_per_post comments (comments_per_post on average), and about
+    image_ratio of posts carry image metadata. Returns the counts written.
+    """
+    if users < 1 or posts < 0 or comments_per_post < 0 or not 0 <= image_ratio <= 1:
+        raise ValueError('users must be positive, posts and comments_per_post non-negative, '
+                         'image_ratio between 0 and 1')
+    rng = random.Random(seed)
+    user_ids = resolve_usernames(f'user{n}' for n in range(1, users + 1))
+    user_ids = [user_ids[f'user{n}'] for n in range(1, users + 1)]
+
+    written = {'users': users, 'posts': 0, 'comments': 0}
+    moment = EPOCH
+    for start in range(0, posts, batch_size):
+        batch, threads = [], []
+        for number in range(start + 1, min(start + batch_size, posts) + 1):
+            moment += timedelta(seconds=rng.randint(30, 600))
+            fields = _image_fields(rng, number) if rng.random() < image_ratio else {}
+            thread = []
+            commented = moment
+            for _ in range(rng.randint(0, 2 * comments_per_post)):
+                commented += timedelta(seconds=rng.randint(5, 300))
+                thread.append({
+                    'user_id': rng.choice(user_ids),
+                    'content': _text(rng, rng.randint(3, 15)),
+                    'created_at': commented,
+                })
+            batch.append(Post(
+                user_id=rng.choice(user_ids),
+                content=f'{WORDS[0]} {_text(rng, rng.randint(5, 40))}',
+                created_at=moment,
+                comments_count=len(thread),
+                **fields,
+            ))
+            threads.append(thread)
+
+        with transaction.atomic():
+            created = Post.objects.bulk_create(batch)
+            storage.retain(
+                name for post in created for name in storage.post_media(post.image.name, post.image_variants)
+            )
+            comments = Comment.objects.bulk_create([
+                Comment(post_id=post.pk, **comment)
+                for post, thread in zip(created, threads)
+                for comment in thread
+            ])
+            events.record_many(ChangeEvent.POST, ChangeEvent.CREATED, [(post.pk, post.pk) for post in created])
+            events.record_many(
+                ChangeEvent.COMMENT, ChangeEvent.CREATED, [(comment.pk, comment.post_id) for comment in comments]
+            )
+            bump_feed_version()
+        written['posts'] += len(created)
+        written['comments'] += len(comments)
+        if progress:
+            progress(written)
+
+    return written
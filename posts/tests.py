@@ -0,0 +1,1756 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from PIL import Image, ImageFile
+from rest_framework.test import APITestCase
+
+from . import benchmark, events, export, fast_serializers, metrics, storage, synthetic
+from . import urls as posts_urls
+from .cache import FEED_VERSION_KEY, USERS_VERSION_KEY, get_version
+from .db import retry_on_lock
+from .importer import Importer
+from .jobs import enqueue, run_pending, task
+from .models import ChangeEvent, MediaBlob, Post, Comment, Job
+from .renderers import ORJSONRenderer
+from .serializers import CommentSerializer, PostSerializer
+from .storage import MediaStorage, media_urls
+from .uploads import LimitedUploadHandler
+from .users import get_user, user_cache
+
+
+class PostsAPITestCase(APITestCase):
+    """Starts every test with an empty response cache"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        user_cache.clear()
+
+
+def make_image(name='photo.png', size=(2000, 1000), fmt='PNG', mode='RGB'):
+    """An in-memory upload for image tests"""
+    buffer = BytesIO()
+    Image.new(mode, size, 'red').save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{fmt.lower()}')
+
+
+def make_posts(user, count, same_timestamp=False):
+    """Bulk-create posts with distinct (or identical) created_at values"""
+    now = timezone.now()
+    return Post.objects.bulk_create([
+        Post(
+            user=user,
+            content=f'post {i}',
+            created_at=now if same_timestamp else now - timedelta(seconds=i),
+        )
+        for i in range(count)
+    ])
+
+
+class FeedPaginationTests(PostsAPITestCase):
+    """Keyset pagination on get_posts and the post/comment viewsets"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='alice')
+
+    def walk(self, url, key, limit):
+        ids, cursor = [], None
+        while True:
+            params = {'limit': limit}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data[key])
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_get_posts_walks_every_post_once(self):
+        make_posts(self.user, 25)
+        ids = self.walk(reverse('get-posts'), 'posts', limit=10)
+        expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_ties_on_created_at_are_broken_by_id(self):
+        make_posts(self.user, 7, same_timestamp=True)
+        ids = self.walk(reverse('get-posts'), 'posts', limit=3)
+        self.assertEqual(ids, sorted(Post.objects.values_list('id', flat=True), reverse=True))
+
+    def test_limit_is_clamped_and_validated(self):
+        make_posts(self.user, 3)
+        response = self.client.get(reverse('get-posts'), {'limit': 1000})
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get(reverse('get-posts'), {'limit': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('get-posts'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_post_viewset_list_is_paginated(self):
+        make_posts(self.user, 5)
+        ids = self.walk(reverse('post-list'), 'results', limit=2)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+
+    def test_comment_viewset_list_is_oldest_first(self):
+        post = make_posts(self.user, 1)[0]
+        now = timezone.now()
+        Comment.objects.bulk_create([
+            Comment(post=post, user=self.user, content=str(i), created_at=now + timedelta(seconds=i))
+            for i in range(5)
+        ])
+        ids = self.walk(reverse('comment-list'), 'results', limit=2)
+        self.assertEqual(ids, list(Comment.objects.order_by('created_at', 'id').values_list('id', flat=True)))
+
+
+class QueryBudgetTests(PostsAPITestCase):
+    """
+    Every read endpoint must run a constant number of queries regardless of
+    how many posts, comments and authors are involved.
+    """
+    sizes = (10, 100, 1000)
+    comments_per_post = 2
+
+    def setUp(self):
+        super().setUp()
+        self.users = User.objects.bulk_create([User(username=f'user{i}') for i in range(20)])
+
+    def grow_to(self, size):
+        """Top the tables up to `size` posts, each with a few comments by different users"""
+        cache.clear()
+        missing = size - Post.objects.count()
+        now = timezone.now()
+        posts = Post.objects.bulk_create([
+            Post(user=self.users[i % len(self.users)], content=f'post {i}',
+                 created_at=now - timedelta(seconds=i))
+            for i in range(missing)
+        ])
+        Comment.objects.bulk_create([
+            Comment(post=post, user=self.users[(post.pk + j) % len(self.users)], content='hi')
+            for post in posts
+            for j in range(self.comments_per_post)
+        ])
+        # bulk_create bypasses the counter signals
+        Post.objects.filter(pk__in=[p.pk for p in posts]).recount_comments()
+
+    def assertWithinBudget(self, url, budget, params=None):
+        for size in self.sizes:
+            with self.subTest(posts=size):
+                self.grow_to(size)
+                with CaptureQueriesContext(connection) as ctx:
+                    response = self.client.get(url, params or {})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertLessEqual(
+                    len(ctx.captured_queries), budget,
+                    f'{url} ran {len(ctx.captured_queries)} queries at {size} posts '
+                    f'(budget {budget})'
+                )
+
+    def test_get_posts(self):
+        # The newest event id for the ETag, then posts and their comments
+        self.assertWithinBudget(reverse('get-posts'), 3, {'limit': 100})
+
+    def test_post_list(self):
+        self.assertWithinBudget(reverse('post-list'), 2, {'limit': 100})
+
+    def test_post_retrieve(self):
+        self.grow_to(1)
+        post = Post.objects.first()
+        self.assertWithinBudget(reverse('post-detail', args=[post.pk]), 3)
+
+    def test_get_comments(self):
+        self.grow_to(1)
+        post = Post.objects.first()
+        self.assertWithinBudget(reverse('get-comments', args=[post.pk]), 3)
+
+    def test_comment_list(self):
+        self.assertWithinBudget(reverse('comment-list'), 1, {'limit': 100})
+
+    def test_comments_count_matches_rows(self):
+        self.grow_to(10)
+        response = self.client.get(reverse('get-posts'))
+        for post in response.data['posts']:
+            self.assertEqual(post['comments_count'], self.comments_per_post)
+            self.assertEqual(len(post['comments']), self.comments_per_post)
+
+
+class CommentPreviewTests(PostsAPITestCase):
+    """The feed embeds a bounded preview; full threads are paginated"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='alice')
+        self.post = make_posts(self.user, 1)[0]
+        now = timezone.now()
+        self.comments = Comment.objects.bulk_create([
+            Comment(post=self.post, user=self.user, content=f'comment {i}',
+                    created_at=now + timedelta(seconds=i))
+            for i in range(10)
+        ])
+        Post.objects.filter(pk=self.post.pk).recount_comments()
+
+    def test_feed_embeds_latest_comments_oldest_first(self):
+        response = self.client.get(reverse('get-posts'))
+        post = response.data['posts'][0]
+        self.assertEqual(post['comments_count'], 10)
+        expected = [c.pk for c in self.comments[-settings.COMMENT_PREVIEW_SIZE:]]
+        self.assertEqual([c['id'] for c in post['comments']], expected)
+
+    def test_retrieve_embeds_same_preview(self):
+        response = self.client.get(reverse('post-detail', args=[self.post.pk]))
+        self.assertEqual(len(response.data['comments']), settings.COMMENT_PREVIEW_SIZE)
+
+    def test_get_comments_is_cursor_paginated(self):
+        url = reverse('get-comments', args=[self.post.pk])
+        first = self.client.get(url, {'limit': 4}).data
+        self.assertEqual(first['count'], 4)
+        second = self.client.get(url, {'limit': 100, 'cursor': first['next_cursor']}).data
+        self.assertIsNone(second['next_cursor'])
+        ids = [c['id'] for c in first['comments'] + second['comments']]
+        self.assertEqual(ids, [c.pk for c in self.comments])
+
+
+class CommentsCountTests(PostsAPITestCase):
+    """Post.comments_count follows every way a comment is created or removed"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.post, self.other = make_posts(self.alice, 2)
+
+    def count(self, post):
+        post.refresh_from_db(fields=['comments_count'])
+        return post.comments_count
+
+    def test_add_comment_increments(self):
+        url = reverse('add-comment', args=[self.post.pk])
+        self.client.post(url, {'content': 'one', 'username': 'bob'}, format='json')
+        self.client.post(url, {'content': 'two', 'username': 'bob'}, format='json')
+        self.assertEqual(self.count(self.post), 2)
+        response = self.client.get(reverse('post-detail', args=[self.post.pk]))
+        self.assertEqual(response.data['comments_count'], 2)
+
+    def test_viewset_create_move_and_destroy(self):
+        response = self.client.post(
+            reverse('comment-list'), {'post': self.post.pk, 'content': 'hi', 'username': 'bob'},
+            format='json'
+        )
+        comment_id = response.data['id']
+        self.assertEqual(self.count(self.post), 1)
+
+        self.client.patch(reverse('comment-detail', args=[comment_id]), {'post': self.other.pk}, format='json')
+        self.assertEqual(self.count(self.post), 0)
+        self.assertEqual(self.count(self.other), 1)
+
+        self.client.delete(reverse('comment-detail', args=[comment_id]))
+        self.assertEqual(self.count(self.other), 0)
+
+    def test_cascade_from_user_delete_decrements(self):
+        Comment.objects.create(post=self.post, user=self.bob, content='x')
+        Comment.objects.create(post=self.post, user=self.alice, content='y')
+        self.bob.delete()
+        self.assertEqual(self.count(self.post), 1)
+
+    def test_post_delete_cascades_without_error(self):
+        Comment.objects.create(post=self.post, user=self.bob, content='x')
+        response = self.client.delete(reverse('delete-post', args=[self.post.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_recount_command_repairs_drift(self):
+        Comment.objects.bulk_create([Comment(post=self.post, user=self.bob, content='x') for _ in range(3)])
+        Post.objects.filter(pk=self.other.pk).update(comments_count=7)
+        out = StringIO()
+        call_command('recount_comments', '--verify', '--batch-size', '1', stdout=out)
+        self.assertEqual(self.count(self.post), 3)
+        self.assertEqual(self.count(self.other), 0)
+        self.assertIn('2 repaired', out.getvalue())
+
+
+class ResponseCacheTests(PostsAPITestCase):
+    """Feed and comment pages are served from cache until a write bumps the version"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='alice')
+        self.post = make_posts(self.user, 1)[0]
+
+    def test_repeat_feed_request_only_reads_the_etag(self):
+        url = reverse('get-posts')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        # Just the newest event id for the ETag; the body comes from cache
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(response.data['count'], 1)
+        stats = self.client.get(reverse('cache-stats')).data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_writes_invalidate_feed_and_thread(self):
+        feed_url = reverse('get-posts')
+        thread_url = reverse('get-comments', args=[self.post.pk])
+        self.client.get(feed_url)
+        self.client.get(thread_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add-comment', args=[self.post.pk]), {'content': 'hi'}, format='json')
+        self.assertEqual(self.client.get(feed_url).data['posts'][0]['comments_count'], 1)
+        self.assertEqual(self.client.get(thread_url).data['count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('create-post'), {'content': 'second'})
+        self.assertEqual(self.client.get(feed_url).data['count'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('delete-post', args=[self.post.pk]))
+        self.assertEqual(self.client.get(feed_url).data['count'], 1)
+        self.assertEqual(self.client.get(thread_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_viewset_writes_invalidate_feed(self):
+        url = reverse('get-posts')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('post-detail', args=[self.post.pk]), {'content': 'edited'}, format='json')
+        self.assertEqual(self.client.get(url).data['posts'][0]['content'], 'edited')
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+            with override_settings(CACHES={'default': backend}):
+                url = reverse('get-posts')
+                self.client.get(url)
+                with CaptureQueriesContext(connection) as ctx:
+                    self.client.get(url)
+                self.assertEqual(len(ctx.captured_queries), 1)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post(reverse('create-post'), {'content': 'second'})
+                self.assertEqual(self.client.get(url).data['count'], 2)
+
+
+class ConditionalGetTests(PostsAPITestCase):
+    """Read endpoints answer If-None-Match / If-Modified-Since with 304"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='alice')
+        self.post = make_posts(self.user, 1)[0]
+        self.comment = Comment.objects.create(post=self.post, user=self.user, content='hi')
+
+    def assertRevalidates(self, url, last_modified=True):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertTrue(first.has_header('ETag'))
+        self.assertEqual(first.has_header('Last-Modified'), last_modified)
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        if last_modified:
+            again = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+            self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        return first['ETag']
+
+    def test_endpoints_return_304(self):
+        # The feed is validated by the cache's feed version alone
+        self.assertRevalidates(reverse('get-posts'), last_modified=False)
+        for url in (
+            reverse('get-comments', args=[self.post.pk]),
+            reverse('post-detail', args=[self.post.pk]),
+            reverse('comment-detail', args=[self.comment.pk]),
+        ):
+            with self.subTest(url=url):
+                self.assertRevalidates(url)
+
+    def test_304_skips_serialization_queries(self):
+        url = reverse('get-posts')
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_pages_have_distinct_etags(self):
+        url = reverse('get-posts')
+        self.assertNotEqual(self.client.get(url, {'limit': 1})['ETag'], self.client.get(url)['ETag'])
+
+    def test_writes_change_the_etag(self):
+        url = reverse('get-posts')
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add-comment', args=[self.post.pk]), {'content': 'more'}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_writes_in_other_processes_change_the_etag(self):
+        url = reverse('get-posts')
+        etag = self.client.get(url)['ETag']
+        # Without its on-commit callbacks this process's cache versions stay
+        # put, as they do for a write handled by another worker
+        Post.objects.create(user=self.user, content='elsewhere')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        # And the new ETag comes with the new body, not the cached one
+        self.assertEqual(response.data['posts'][0]['content'], 'elsewhere')
+
+    def test_renaming_the_author_changes_the_etag(self):
+        urls = [reverse('get-posts'), reverse('post-detail', args=[self.post.pk]),
+                reverse('comment-detail', args=[self.comment.pk])]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = 'alicia'
+            self.user.save()
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_missing_post_is_not_cached(self):
+        response = self.client.get(reverse('get-comments', args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ImageVariantTests(PostsAPITestCase):
+    """Uploads get resized WebP/JPEG derivatives and recorded dimensions"""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_override = override_settings(MEDIA_ROOT=self.media.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+    def create_and_process(self, **image_kwargs):
+        response = self.client.post(reverse('create-post'), {'content': 'pic', 'image': make_image(**image_kwargs)})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(run_pending(), 1)
+        return self.client.get(reverse('post-detail', args=[response.data['post']['id']])).data
+
+    def test_create_post_generates_variants(self):
+        post = self.create_and_process()
+        self.assertEqual((post['image_width'], post['image_height']), (2000, 1000))
+        variants = post['image_variants']
+        self.assertEqual(
+            sorted((v['width'], v['format']) for v in variants),
+            sorted((w, f) for w in settings.IMAGE_VARIANT_WIDTHS for f in settings.IMAGE_VARIANT_FORMATS),
+        )
+        self.assertTrue(all(v['url'].startswith('http://testserver/media/') for v in variants))
+
+        stored = Post.objects.get(pk=post['id']).image_variants
+        for variant in stored:
+            with default_storage.open(variant['path']) as f:
+                image = Image.open(f)
+                self.assertEqual(image.size, (variant['width'], variant['height']))
+
+    def test_small_images_are_not_upscaled(self):
+        post = self.create_and_process(size=(200, 100), mode='RGBA')
+        widths = {v['width'] for v in post['image_variants']}
+        self.assertEqual(widths, {200})
+
+    def test_delete_removes_variants(self):
+        post = Post.objects.get(pk=self.create_and_process()['id'])
+        paths = [v['path'] for v in post.image_variants]
+        self.client.delete(reverse('delete-post', args=[post.pk]))
+        self.assertTrue(all(default_storage.exists(path) for path in paths))
+        self.assertEqual(run_pending(), 1)
+        self.assertFalse(any(default_storage.exists(path) for path in paths))
+
+    def test_clearing_the_image_drops_variants(self):
+        post = self.create_and_process()
+        paths = [v['path'] for v in Post.objects.get(pk=post['id']).image_variants]
+        response = self.client.patch(reverse('post-detail', args=[post['id']]), {'image': None}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['image'])
+        post = Post.objects.get(pk=post['id'])
+        self.assertEqual((post.image_width, post.image_height, post.image_variants), (None, None, []))
+        run_pending()
+        self.assertFalse(any(default_storage.exists(path) for path in paths))
+
+    def test_posts_without_images_have_no_variants(self):
+        response = self.client.post(reverse('create-post'), {'content': 'text only'})
+        post = response.data['post']
+        self.assertEqual(post['image_variants'], [])
+        self.assertIsNone(post['image_width'])
+
+
+class JobTests(PostsAPITestCase):
+    """The database-backed job queue behind create_post and delete_post"""
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+
+        @task('test_record')
+        def record(value, fail_times=0):
+            self.calls.append(value)
+            if len(self.calls) <= fail_times:
+                raise RuntimeError('boom')
+
+    def test_create_post_returns_before_processing(self):
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            response = self.client.post(reverse('create-post'), {'content': 'pic', 'image': make_image()})
+            self.assertEqual(response.data['post']['image_variants'], [])
+            job = self.client.get(reverse('get-job', args=[response.data['job_id']])).data
+            self.assertEqual(job['status'], Job.PENDING)
+            run_pending()
+            job = self.client.get(reverse('get-job', args=[response.data['job_id']])).data
+            self.assertEqual(job['status'], Job.SUCCEEDED)
+
+    def test_keys_make_enqueue_idempotent(self):
+        first = enqueue('test_record', {'value': 1}, key='same')
+        second = enqueue('test_record', {'value': 2}, key='same')
+        self.assertEqual(first.pk, second.pk)
+        run_pending()
+        self.assertEqual(self.calls, [1])
+
+    def test_failures_are_retried_with_backoff(self):
+        job = enqueue('test_record', {'value': 'x', 'fail_times': 1}, max_attempts=2)
+        with self.assertLogs('posts.jobs', 'WARNING'):
+            run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('boom', job.last_error)
+        self.assertIn('Traceback', job.last_error)
+        # The API shows only the exception, not the traceback
+        data = self.client.get(reverse('get-job', args=[job.pk])).data
+        self.assertEqual(data['last_error'], 'RuntimeError: boom')
+        self.assertGreater(job.run_after, timezone.now())
+        # Not due yet
+        self.assertEqual(run_pending(), 0)
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.SUCCEEDED, 2))
+
+    def test_exhausted_jobs_fail(self):
+        job = enqueue('test_record', {'value': 'x', 'fail_times': 5}, max_attempts=1)
+        with self.assertLogs('posts.jobs', 'ERROR'):
+            run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_unknown_job_status_is_404(self):
+        self.assertEqual(self.client.get(reverse('get-job', args=[999])).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RunJobsCommandTests(TransactionTestCase):
+    """Worker threads need committed rows, so no wrapping transaction here"""
+
+    def test_workers_drain_queue_once(self):
+        calls = []
+        task('test_collect')(lambda value: calls.append(value))
+        for i in range(6):
+            enqueue('test_collect', {'value': i})
+        call_command('run_jobs', '--once', '--workers', '3', stdout=StringIO())
+        self.assertEqual(sorted(calls), list(range(6)))
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 6)
+
+
+class StatsAndHealthTests(PostsAPITestCase):
+    """Sidebar counts and liveness without downloading the feed"""
+
+    def test_stats_counts_in_one_query(self):
+        alice = User.objects.create(username='alice')
+        User.objects.create(username='bob')
+        posts = make_posts(alice, 3)
+        Post.objects.filter(pk=posts[0].pk).update(image='posts/a.png')
+        Comment.objects.create(post=posts[1], user=alice, content='hi')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('stats'))
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(response.data, {'posts': 3, 'images': 1, 'comments': 1, 'users': 2})
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('stats'))
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_health_does_not_touch_posts(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'ok')
+        self.assertFalse(any('posts_post' in q['sql'] for q in ctx.captured_queries))
+
+
+class BatchWriteTests(PostsAPITestCase):
+    """Batch endpoints validate everything first and insert in bulk"""
+
+    def test_batch_create_posts_in_constant_queries(self):
+        User.objects.create(username='alice')
+        items = [{'content': f'post {i}', 'username': f'user{i % 7}'} for i in range(200)]
+        items.append({'content': 'mine', 'username': 'alice'})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('batch-create-posts'), {'posts': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # One INSERT for the posts and one for their change events
+        self.assertLessEqual(len(ctx.captured_queries), 9)
+        self.assertEqual(Post.objects.count(), 201)
+        self.assertEqual(User.objects.count(), 8)
+        ids = [r['id'] for r in response.data['results']]
+        self.assertEqual(Post.objects.get(pk=ids[-1]).user.username, 'alice')
+
+    def test_invalid_item_rejects_whole_batch(self):
+        items = [{'content': 'ok'}, {'content': ''}, {'username': 'x'}]
+        response = self.client.post(reverse('batch-create-posts'), {'posts': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([e['index'] for e in response.data['errors']], [1, 2])
+        self.assertFalse(Post.objects.exists())
+
+    def test_batch_add_comments_updates_counters(self):
+        alice = User.objects.create(username='alice')
+        first, second = make_posts(alice, 2)
+        items = [{'post': first.pk, 'content': str(i)} for i in range(5)]
+        items += [{'post': second.pk, 'content': 'x', 'username': 'bob'}]
+        response = self.client.post(reverse('batch-add-comments'), {'comments': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.comments_count, second.comments_count), (5, 1))
+
+    def test_batch_comments_on_missing_post_are_rejected(self):
+        alice = User.objects.create(username='alice')
+        post = make_posts(alice, 1)[0]
+        items = [{'post': post.pk, 'content': 'ok'}, {'post': 999, 'content': 'lost'}]
+        response = self.client.post(reverse('batch-add-comments'), {'comments': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_batch_size_is_limited(self):
+        with override_settings(BATCH_MAX_ITEMS=2):
+            items = [{'content': 'x'}] * 3
+            response = self.client.post(reverse('batch-create-posts'), {'posts': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UserCacheTests(PostsAPITestCase):
+    """Username lookups on the write paths go through a shared LRU"""
+
+    def test_repeat_writes_skip_user_lookup(self):
+        url = reverse('create-post')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'content': 'one', 'username': 'alice'})
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(url, {'content': 'two', 'username': 'alice'})
+        self.assertFalse(any('FROM "auth_user"' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(Post.objects.filter(user__username='alice').count(), 2)
+
+    def test_comments_share_the_cache(self):
+        post = make_posts(User.objects.create(username='alice'), 1)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user('bob')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('add-comment', args=[post.pk]), {'content': 'hi', 'username': 'bob'},
+                             format='json')
+        self.assertFalse(any('FROM "auth_user"' in q['sql'] for q in ctx.captured_queries))
+
+    def test_rename_and_delete_evict(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = get_user('carol')
+        user.username = 'caroline'
+        user.save()
+        self.assertIsNone(user_cache.get('carol'))
+        self.assertNotEqual(get_user('carol').pk, user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user('dave')
+        User.objects.get(username='dave').delete()
+        self.assertIsNone(user_cache.get('dave'))
+
+    def test_other_processes_drop_users_renamed_elsewhere(self):
+        # A second process: its own LRU, the same Django cache
+        other = type(user_cache)(maxsize=10)
+        other.sync(get_version(USERS_VERSION_KEY))
+        user = User.objects.create(username='frank')
+        other.put(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.username = 'francis'
+            user.save()
+        other.sync(get_version(USERS_VERSION_KEY))
+        self.assertIsNone(other.get('frank'))
+
+        expiring = type(user_cache)(maxsize=10, timeout=0)
+        expiring.put(user)
+        self.assertIsNone(expiring.get('francis'))
+
+    def test_creation_race_falls_back_to_existing_row(self):
+        existing = User.objects.create(username='erin')
+        real_filter = User.objects.filter
+        calls = []
+
+        def racing_filter(*args, **kwargs):
+            # The first lookup misses, as if another request had not committed yet
+            calls.append(1)
+            queryset = real_filter(*args, **kwargs)
+            return queryset.none() if len(calls) == 1 else queryset
+
+        with mock.patch.object(User.objects, 'filter', side_effect=racing_filter):
+            self.assertEqual(get_user('erin').pk, existing.pk)
+
+    def test_cache_is_bounded(self):
+        small = type(user_cache)(maxsize=2)
+        for name in ('a', 'b', 'c'):
+            small.put(User.objects.create(username=name))
+        self.assertIsNone(small.get('a'))
+        self.assertIsNotNone(small.get('c'))
+
+
+class SearchTests(PostsAPITestCase):
+    """FTS5 index kept in sync by triggers, /api/search/ and the admin search"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username='alice')
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+
+    def test_index_follows_every_write_path(self):
+        post = Post.objects.create(user=self.alice, content='Sourdough starter notes')
+        self.client.post(reverse('batch-add-comments'), {'comments': [
+            {'post': post.pk, 'content': 'My sourdough never rises'},
+        ]}, format='json')
+        hits = self.search(q='sourdough')['results']
+        self.assertEqual({(h['type'], h['post_id']) for h in hits}, {('post', post.pk), ('comment', post.pk)})
+        self.assertIn('<mark>', hits[0]['snippet'])
+
+        post.content = 'Rye bread notes'
+        post.save()
+        self.assertEqual([h['type'] for h in self.search(q='sourdough')['results']], ['comment'])
+        self.assertEqual(self.search(q='rye', type='post')['results'][0]['username'], 'alice')
+
+        post.delete()
+        self.assertEqual(self.search(q='sourdough')['results'], [])
+
+    def test_snippets_escape_content(self):
+        Post.objects.create(user=self.alice, content='<script>alert(1)</script> exploit & "quotes"')
+        snippet = self.search(q='exploit')['results'][0]['snippet']
+        self.assertNotIn('<script>', snippet)
+        self.assertIn('&lt;script&gt;', snippet)
+        self.assertIn('<mark>exploit</mark> &amp;', snippet)
+
+    def test_results_are_ranked_and_paginated(self):
+        Post.objects.bulk_create(
+            [Post(user=self.alice, content=f'cats {i} ' + 'filler ' * i) for i in range(7)]
+        )
+        seen, cursor = [], None
+        while True:
+            params = {'q': 'cats', 'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.search(**params)
+            seen += data['results']
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len({h['id'] for h in seen}), 7)
+        ranks = [h['rank'] for h in seen]
+        self.assertEqual(ranks, sorted(ranks))
+        # The shortest document is the most relevant
+        self.assertEqual(seen[0]['content'], 'cats 0 ')
+
+    def test_user_input_is_never_parsed_as_fts_syntax(self):
+        Post.objects.create(user=self.alice, content='AND NEAR quoted "text"')
+        self.assertEqual(len(self.search(q='"AND (NEAR')['results']), 1)
+        self.assertEqual(self.search(q='NEA*')['count'], 1)
+        self.assertEqual(self.search(q='!!!')['results'], [])
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({}, {'q': 'x', 'type': 'user'}, {'q': 'x', 'cursor': 'nope'}):
+            response = self.client.get(reverse('search'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser('root', password='pw')
+        self.client.force_login(admin)
+        match = Post.objects.create(user=self.alice, content='Tomato harvest')
+        Post.objects.create(user=self.alice, content='Potatoes')
+        Comment.objects.create(post=match, user=admin, content='nice')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('admin:posts_post_changelist'), {'q': 'tomato'})
+        self.assertEqual(list(response.context['cl'].result_list), [match])
+        self.assertTrue(any('MATCH' in q['sql'] for q in ctx.captured_queries))
+        self.assertFalse(any('LIKE' in q['sql'] for q in ctx.captured_queries))
+
+        response = self.client.get(reverse('admin:posts_comment_changelist'), {'q': 'tomato'})
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        response = self.client.get(reverse('admin:posts_post_changelist'), {'q': 'alice'})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+
+    def test_rebuild_command_restores_index(self):
+        post = Post.objects.create(user=self.alice, content='lost words')
+        Comment.objects.create(post=post, user=self.alice, content='more lost words')
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_search')
+            cursor.execute("INSERT INTO posts_search(rowid, content, post_id) VALUES (9998, 'ghost', 4999)")
+        out = StringIO()
+        call_command('rebuild_search_index', '--batch-size', '1', stdout=out)
+        self.assertIn('1 posts and 1 comments', out.getvalue())
+        self.assertEqual(self.search(q='lost')['count'], 2)
+        self.assertEqual(self.search(q='ghost')['count'], 0)
+
+
+class AdminChangelistTests(PostsAPITestCase):
+    """Changelists avoid per-row lookups, full counts and user enumeration"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('root', password='pw')
+        self.client.force_login(self.admin)
+
+    def load(self, name, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(f'admin:posts_{name}_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, [q['sql'] for q in ctx.captured_queries]
+
+    def test_query_count_does_not_grow_with_rows(self):
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(30)])
+        for user in users:
+            post = make_posts(user, 1)[0]
+            Comment.objects.create(post=post, user=user, content='hi')
+        _, post_queries = self.load('post')
+        _, comment_queries = self.load('comment')
+
+        for user in users:
+            make_posts(user, 2)
+        self.assertEqual(len(self.load('post')[1]), len(post_queries))
+        self.assertEqual(len(self.load('comment')[1]), len(comment_queries))
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=10)
+    def test_large_tables_are_counted_from_the_key_range(self):
+        posts = make_posts(self.admin, 25)
+        Post.objects.filter(pk=posts[3].pk).delete()
+        response, queries = self.load('post')
+        self.assertEqual(response.context['cl'].result_count, 25)
+        self.assertFalse(any(
+            'COUNT(*)' in sql and 'LIMIT' not in sql for sql in queries
+        ))
+        # Filtered lists stop counting at the limit
+        response, _ = self.load('post', q='post')
+        self.assertEqual(response.context['cl'].result_count, 10)
+
+    def test_user_filter_uses_autocomplete(self):
+        bob = User.objects.create(username='bob')
+        User.objects.create(username='carol')
+        make_posts(bob, 2)
+        make_posts(self.admin, 1)
+        response, _ = self.load('post', user__id__exact=bob.pk)
+        self.assertEqual(response.context['cl'].result_count, 2)
+        html = response.content.decode()
+        self.assertIn('admin-autocomplete', html)
+        self.assertNotIn('carol', html)
+
+
+class ExportTests(PostsAPITestCase):
+    """Streaming NDJSON export endpoint and export_ndjson command"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username='alice')
+        self.posts = make_posts(self.alice, 5)[::-1]  # oldest first
+        for i, post in enumerate(self.posts):
+            for j in range(i):
+                Comment.objects.create(post=post, user=self.alice, content=f'c{i}.{j}')
+
+    def read(self, response):
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    def test_posts_stream_oldest_first_with_nested_comments(self):
+        response = self.client.get(reverse('export'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = self.read(response)
+        self.assertEqual([r['id'] for r in records], [p.pk for p in self.posts])
+        self.assertEqual({r['type'] for r in records}, {'post'})
+        self.assertEqual([len(r['comments']) for r in records], [0, 1, 2, 3, 4])
+        self.assertEqual(records[2]['comments'][1]['content'], 'c2.1')
+        self.assertEqual(records[0]['username'], 'alice')
+
+    def test_batches_are_chunks_with_bounded_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            chunks = list(export.ndjson_chunks(chunk_size=2))
+        # Three post batches of at most two, each with one comment query
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(ctx.captured_queries), 6)
+
+    def test_separate_comment_records_and_time_window(self):
+        since = self.posts[1].created_at.isoformat()
+        response = self.client.get(reverse('export'), {'comments': 'separate', 'since': since})
+        records = self.read(response)
+        posts = [r for r in records if r['type'] == 'post']
+        comments = [r for r in records if r['type'] == 'comment']
+        self.assertEqual([r['id'] for r in posts], [p.pk for p in self.posts[1:]])
+        self.assertNotIn('comments', posts[0])
+        # Comments were all created after the posts, so none fall outside
+        self.assertEqual(len(comments), 10)
+        self.assertEqual(records.index(comments[0]), len(posts))
+
+        until = self.posts[2].created_at.isoformat()
+        records = self.read(self.client.get(reverse('export'), {'until': until}))
+        self.assertEqual([r['id'] for r in records], [p.pk for p in self.posts[:3]])
+
+    def test_gzip_when_accepted(self):
+        response = self.client.get(reverse('export'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(self.read(response)), 5)
+        for refused in ('gzip;q=0, deflate', 'identity', '*;q=1, gzip; q=0.0'):
+            response = self.client.get(reverse('export'), HTTP_ACCEPT_ENCODING=refused)
+            self.assertFalse(response.has_header('Content-Encoding'), refused)
+        self.assertTrue(export.accepts_gzip('deflate, *;q=0.5'))
+
+    async def test_streams_over_asgi(self):
+        response = await self.async_client.get(reverse('export'), headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.is_async)
+        body = gzip.decompress(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual(len(body.decode().splitlines()), 5)
+
+    def test_invalid_parameters_are_rejected(self):
+        response = self.client.get(reverse('export'), {'since': 'yesterday', 'comments': 'inline'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data['errors']), {'since', 'comments'})
+
+    def test_command_writes_stdout_and_gzip_files(self):
+        out = StringIO()
+        call_command('export_ndjson', '--comments', 'separate', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 15)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/dump.ndjson.gz'
+            call_command('export_ndjson', '--gzip', '--output', path, '--chunk-size', '2', stderr=StringIO())
+            with gzip.open(path, 'rt') as handle:
+                self.assertEqual(len(handle.readlines()), 5)
+
+
+class ImportTests(PostsAPITestCase):
+    """import_data command: NDJSON and CSV, skips, counters and resume"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.state = os.path.join(self.directory, 'state.json')
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as handle:
+            handle.write(text)
+        return path
+
+    def run_import(self, *args):
+        out = StringIO()
+        call_command('import_data', *args, '--state', self.state, stdout=out)
+        return out.getvalue()
+
+    def test_export_round_trip_keeps_ids_and_counters(self):
+        alice = User.objects.create(username='alice')
+        posts = make_posts(alice, 3)
+        for post in posts:
+            Comment.objects.create(post=post, user=alice, content=f'hello on {post.pk}')
+        for mode in ('nested', 'separate'):
+            out = StringIO()
+            call_command('export_ndjson', '--comments', mode, stdout=out)
+            path = self.write(f'{mode}.ndjson', out.getvalue())
+            Post.objects.all().delete()
+
+            output = self.run_import(path, '--batch-size', '2')
+            self.assertIn('Done: 3 comments, 3 posts', output)
+            self.assertEqual(sorted(Post.objects.values_list('pk', flat=True)), sorted(p.pk for p in posts))
+            self.assertEqual(set(Post.objects.values_list('comments_count', flat=True)), {1})
+            self.assertEqual(Comment.objects.get(post=posts[0]).user, alice)
+            self.assertFalse(os.path.exists(self.state))
+        response = self.client.get(reverse('search'), {'q': 'hello', 'type': 'comment'})
+        self.assertEqual(response.data['count'], 3)
+
+        # Running the same file again changes nothing
+        self.run_import(path)
+        self.assertEqual(Comment.objects.count(), 3)
+
+    def test_csv_creates_users_and_skips_invalid_rows(self):
+        path = self.write('posts.csv', 'username,content,created_at\n'
+                          'bob,first,2024-01-01T10:00:00Z\n'
+                          'bob,,\n'
+                          'carol,second,not a date\n'
+                          ',third,\n')
+        output = self.run_import(path, '--type', 'post')
+        self.assertIn('Done: 2 posts', output)
+        self.assertIn('Skipped 2 invalid records: post', output)
+        self.assertEqual(
+            sorted(Post.objects.values_list('user__username', 'content')),
+            [('admin', 'third'), ('bob', 'first')],
+        )
+        post = Post.objects.get(content='first')
+        self.assertEqual(post.created_at.isoformat(), '2024-01-01T10:00:00+00:00')
+
+        comments = self.write('comments.ndjson', '\n'.join(json.dumps(record) for record in [
+            {'type': 'comment', 'post_id': post.pk, 'username': 'dave', 'content': 'nice'},
+            {'type': 'comment', 'post_id': post.pk + 100, 'content': 'orphan'},
+            {'type': 'like', 'post_id': post.pk},
+        ]))
+        # Cached before the import, then invalidated by it
+        self.assertEqual(self.client.get(reverse('get-comments', args=[post.pk])).data['count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            output = self.run_import(comments)
+        self.assertEqual(self.client.get(reverse('get-comments', args=[post.pk])).data['count'], 1)
+        self.assertIn('Skipped 1 invalid records: comment (missing post)', output)
+        self.assertIn('Skipped 1 invalid records: unknown type', output)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(Comment.objects.get().user.username, 'dave')
+
+    def test_existing_ids_skip_their_nested_comments_and_events(self):
+        taken = Post.objects.create(user=User.objects.create(username='alice'), content='already here')
+        path = self.write('clash.ndjson', '\n'.join(json.dumps(record) for record in [
+            {'type': 'post', 'id': taken.pk, 'username': 'bob', 'content': 'clash',
+             'comments': [{'username': 'bob', 'content': 'not yours'}]},
+            {'type': 'post', 'id': taken.pk + 1, 'username': 'bob', 'content': 'new',
+             'comments': [{'username': 'bob', 'content': 'mine'}]},
+        ]))
+        before = ChangeEvent.objects.count()
+        output = self.run_import(path)
+        self.assertIn('Done: 1 comments, 1 posts', output)
+        self.assertIn('Skipped 1 invalid records: post (id exists)', output)
+        self.assertIn('Skipped 1 invalid records: comment (post not imported)', output)
+        taken.refresh_from_db()
+        self.assertEqual((taken.content, taken.comments_count), ('already here', 0))
+        self.assertEqual(list(Comment.objects.values_list('post_id', 'content')), [(taken.pk + 1, 'mine')])
+        self.assertEqual(
+            sorted(ChangeEvent.objects.filter(pk__gt=before).values_list('kind', 'post_id')),
+            sorted([(ChangeEvent.POST, taken.pk + 1), (ChangeEvent.COMMENT, taken.pk + 1)]),
+        )
+
+    def test_resume_after_unreadable_record(self):
+        records = [json.dumps({'type': 'post', 'username': 'erin', 'content': f'post {i}'}) for i in range(5)]
+        records[3] = '{broken'
+        path = self.write('posts.ndjson', '\n'.join(records))
+        with self.assertRaisesMessage(CommandError, 'record 4 is not valid JSON'):
+            self.run_import(path, '--batch-size', '2')
+        # The first batch was committed and checkpointed
+        self.assertEqual(Post.objects.count(), 2)
+        with open(self.state) as handle:
+            self.assertEqual(list(json.load(handle).values()), [{'records': 2, 'done': False}])
+
+        records[3] = json.dumps({'type': 'post', 'username': 'erin', 'content': 'fixed'})
+        self.write('posts.ndjson', '\n'.join(records))
+        output = self.run_import(path, '--resume')
+        self.assertIn('resuming after record 2', output)
+        self.assertEqual(
+            list(Post.objects.order_by('id').values_list('content', flat=True)),
+            ['post 0', 'post 1', 'post 2', 'fixed', 'post 4'],
+        )
+        self.assertEqual(User.objects.filter(username='erin').count(), 1)
+
+
+class ImportRetryTests(TransactionTestCase):
+    """retry_on_lock only retries outside a transaction, so none wraps these"""
+
+    def test_retried_batch_recreates_users_it_rolled_back(self):
+        importer = Importer()
+        importer.add({'type': 'post', 'username': 'frank', 'content': 'hi'})
+        insert = Importer._insert
+        calls = []
+
+        def locked_once(model, fields, rows):
+            calls.append(model)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return insert(model, fields, rows)
+
+        with override_settings(SQLITE_LOCK_RETRY_DELAY=0), \
+                mock.patch.object(Importer, '_insert', side_effect=locked_once):
+            importer.flush()
+        frank = User.objects.get(username='frank')
+        self.assertEqual(importer.user_ids, {'frank': frank.pk})
+        self.assertEqual(Post.objects.get().user, frank)
+
+
+class EndpointBenchmarkTests(PostsAPITestCase):
+    """Synthetic data generator and the endpoint benchmark harness"""
+
+    def snapshot(self):
+        return list(Post.objects.order_by('id').values_list(
+            'user__username', 'content', 'created_at', 'image', 'image_variants', 'comments_count',
+        ))
+
+    def test_generator_is_deterministic(self):
+        options = {'users': 3, 'posts': 20, 'comments_per_post': 2, 'image_ratio': 0.5, 'seed': 7}
+        written = synthetic.generate(**options, batch_size=8)
+        self.assertEqual(written['posts'], 20)
+        self.assertEqual(written['comments'], Comment.objects.count())
+        self.assertFalse(Post.objects.with_stale_comments_count().exists())
+        self.assertTrue(0 < Post.objects.exclude(image='').count() < 20)
+        first = self.snapshot()
+
+        Post.objects.all().delete()
+        synthetic.generate(**options)
+        self.assertEqual(self.snapshot(), first)
+        synthetic.generate(**dict(options, seed=8))
+        self.assertNotEqual(self.snapshot()[20:], first)
+
+    def test_every_endpoint_has_a_case(self):
+        self.assertIn('get-posts', benchmark.url_names())
+        self.assertEqual(benchmark.missing_endpoints(), set())
+
+    def test_measure_and_compare(self):
+        synthetic.generate(users=2, posts=5, comments_per_post=2, seed=1)
+        results = benchmark.measure(requests=3, warmup=0)
+        self.assertEqual(set(results), {url_name for url_name, _, _ in benchmark.CASES})
+        self.assertEqual(results['health']['queries'], 1)
+        self.assertGreater(results['export']['bytes'], 0)
+        self.assertLessEqual(results['get-posts']['p50'], results['get-posts']['p99'])
+        self.assertEqual(benchmark.compare(results, results), [])
+
+        faster = {'get-posts': dict(results['get-posts'], p50=results['get-posts']['p50'] / 3 - 1, queries=1)}
+        self.assertEqual(len(benchmark.compare(results, faster)), 2)
+
+
+@override_settings(SERVER_TIMING=True, METRICS_ENABLED=True)
+class RequestMetricsTests(PostsAPITestCase):
+    """Server-Timing header and the Prometheus /metrics endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        alice = User.objects.create(username='alice')
+        self.post = make_posts(alice, 3)[0]
+        Comment.objects.create(post=self.post, user=alice, content='hi')
+
+    def server_timing(self, response):
+        parts = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            parts[name] = dict(param.split('=', 1) for param in params)
+        return parts
+
+    def test_server_timing_splits_sql_and_serialization(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('get-posts'))
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {'sql', 'serialize', 'total'})
+        self.assertEqual(timing['sql']['desc'], f'"{len(ctx.captured_queries)} queries"')
+        self.assertGreater(float(timing['serialize']['dur']), 0)
+        spent = float(timing['sql']['dur']) + float(timing['serialize']['dur'])
+        self.assertLessEqual(spent, float(timing['total']['dur']) + 0.2)
+
+    def test_metrics_endpoint_renders_histograms(self):
+        self.client.get(reverse('get-posts'))
+        self.client.get(reverse('get-posts'))
+        self.client.get(reverse('get-comments', args=[self.post.pk]))
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count{endpoint="get-posts",method="GET"} 2', body)
+        self.assertIn('http_request_sql_queries_bucket{endpoint="get-comments",method="GET",le="+Inf"} 1', body)
+        self.assertNotIn('endpoint="metrics"', body)
+
+    def test_disabled(self):
+        with override_settings(METRICS_ENABLED=False):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+        with override_settings(SERVER_TIMING=False, METRICS_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                metrics.RequestMetricsMiddleware(lambda request: None)
+
+
+# URLconf for AsyncReadTests: the API with the async read views in front
+urlpatterns = [path('api/', include(posts_urls.async_read_patterns() + posts_urls.urlpatterns))]
+
+
+@override_settings(SERVER_TIMING=True)
+class AsyncReadTests(PostsAPITestCase):
+    """The async read views answer exactly like the sync ones"""
+
+    def setUp(self):
+        super().setUp()
+        alice = User.objects.create(username='alice')
+        self.posts = make_posts(alice, 4)
+        self.posts[0].image = 'posts/photo.jpg'
+        self.posts[0].image_variants = [{'width': 320, 'height': 160, 'format': 'webp', 'path': 'posts/v.webp'}]
+        self.posts[0].save()
+        for i in range(3):
+            Comment.objects.create(post=self.posts[0], user=alice, content=f'comment {i}')
+
+    def get_both(self, path, **extra):
+        cache.clear()
+        sync = self.client.get(path, **extra)
+        # Drop the cached bodies, but keep the versions the ETags come from
+        versions = cache.get_many([FEED_VERSION_KEY, USERS_VERSION_KEY])
+        cache.clear()
+        cache.set_many(versions, timeout=None)
+        with override_settings(ROOT_URLCONF=__name__):
+            self.assertTrue(iscoroutinefunction(resolve(path.split('?')[0]).func))
+            response = self.client.get(path, **extra)
+        return sync, response
+
+    def test_same_responses_as_sync_views(self):
+        post, comment = self.posts[0], self.posts[0].comments.first()
+        paths = [
+            reverse('get-posts') + '?limit=2',
+            reverse('get-comments', args=[post.pk]) + '?limit=2',
+            reverse('post-list') + '?limit=3',
+            reverse('post-detail', args=[post.pk]),
+            reverse('comment-list'),
+            reverse('comment-detail', args=[comment.pk]),
+            reverse('get-posts') + '?cursor=bogus',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                sync, response = self.get_both(path)
+                self.assertEqual(response.status_code, sync.status_code)
+                self.assertEqual(response.content, sync.content)
+                self.assertEqual(response['Content-Type'], sync['Content-Type'])
+                self.assertEqual(response.get('ETag'), sync.get('ETag'))
+                self.assertIn('queries', response['Server-Timing'])
+
+    def test_conditional_get_and_fallbacks(self):
+        post = self.posts[1]
+        sync, response = self.get_both(reverse('post-detail', args=[post.pk]))
+        with override_settings(ROOT_URLCONF=__name__):
+            response = self.client.get(reverse('post-detail', args=[post.pk]), HTTP_IF_NONE_MATCH=sync['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            # Missing objects and writes are answered by the sync views
+            sync_missing = self.client.get('/api/posts/999999/')
+            self.assertEqual(sync_missing.status_code, status.HTTP_404_NOT_FOUND)
+            response = self.client.post(reverse('post-list'), {'content': 'async mode', 'username': 'bob'})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.get('/api/posts/999999/').content, sync_missing.content)
+
+    async def test_served_over_asgi(self):
+        with override_settings(ROOT_URLCONF=__name__):
+            response = await self.async_client.get(reverse('get-posts'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['posts']), 4)
+        timing = response['Server-Timing']
+        self.assertNotIn('desc="0 queries"', timing)
+
+
+@override_settings(EVENTS_POLL_INTERVAL=0.01)
+class ChangeEventTests(PostsAPITestCase):
+    """Every post and comment write is logged and can be read back in order"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username='alice')
+
+    def read(self, since, **params):
+        response = self.client.get(reverse('events'), {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_every_write_path_appends_events(self):
+        start = self.client.get(reverse('events')).data
+        self.assertEqual(start, {'events': [], 'cursor': 0})
+
+        post_id = self.client.post(reverse('create-post'), {'content': 'one', 'username': 'alice'}).data['post']['id']
+        comment_id = self.client.post(
+            reverse('add-comment', args=[post_id]), {'content': 'hi', 'username': 'bob'}, format='json'
+        ).data['comment']['id']
+        self.client.patch(reverse('post-detail', args=[post_id]), {'content': 'one, edited'}, format='json')
+        batch = self.client.post(
+            reverse('batch-create-posts'), {'posts': [{'content': 'two'}, {'content': 'three'}]}, format='json'
+        ).data['results']
+        self.client.post(
+            reverse('batch-add-comments'), {'comments': [{'post': batch[0]['id'], 'content': 'x'}]}, format='json'
+        )
+        self.client.delete(reverse('comment-detail', args=[comment_id]))
+        self.client.delete(reverse('delete-post', args=[batch[0]['id']]))
+
+        data = self.read(0)
+        self.assertEqual(
+            [(event['type'], event['post']) for event in data['events']],
+            [
+                ('post.created', post_id),
+                ('comment.created', post_id),
+                ('post.updated', post_id),
+                ('post.created', batch[0]['id']),
+                ('post.created', batch[1]['id']),
+                ('comment.created', batch[0]['id']),
+                ('comment.deleted', post_id),
+                # The batch comment goes with its post, covered by its event
+                ('post.deleted', batch[0]['id']),
+            ]
+        )
+        self.assertEqual(data['cursor'], data['events'][-1]['seq'])
+        self.assertEqual(data['events'][0]['data']['content'], 'one, edited')
+        # Objects deleted since carry no data
+        self.assertIsNone(data['events'][1]['data'])
+        self.assertIsNone(data['events'][3]['data'])
+        self.assertEqual(data['events'][4]['data']['content'], 'three')
+        # Comment events bring their post as it is now
+        self.assertEqual(data['events'][1]['post_data']['comments_count'], 0)
+        self.assertIsNone(data['events'][5]['post_data'])
+        self.assertNotIn('post_data', data['events'][0])
+
+    def test_moving_a_comment_updates_both_posts(self):
+        first, second = make_posts(self.alice, 2)
+        comment = Comment.objects.create(post=first, user=self.alice, content='moving')
+        cursor = self.client.get(reverse('events')).data['cursor']
+        response = self.client.patch(reverse('comment-detail', args=[comment.pk]), {'post': second.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted((event['type'], event['post']) for event in self.read(cursor)['events']),
+            sorted([('comment.updated', second.pk), ('post.updated', first.pk)]),
+        )
+
+    def test_cursor_paging_and_long_poll(self):
+        make_posts(self.alice, 1)  # bulk_create: not logged
+        for i in range(5):
+            Post.objects.create(user=self.alice, content=f'post {i}')
+        head = self.client.get(reverse('events')).data['cursor']
+        first = self.read(0, limit=2)
+        self.assertEqual(len(first['events']), 2)
+        rest = self.read(first['cursor'])
+        self.assertEqual(rest['cursor'], head)
+        self.assertEqual(len(rest['events']), 3)
+
+        # Nothing new: an empty answer once the wait is over, cursor unchanged
+        self.assertEqual(self.read(head, wait=0.05), {'events': [], 'cursor': head})
+        for params in ({'since': 'x'}, {'since': -1}, {'since': 0, 'wait': 'soon'}):
+            response = self.client.get(reverse('events'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(EVENTS_STREAM_SECONDS=0)
+    def test_server_sent_events(self):
+        posts = [Post.objects.create(user=self.alice, content=f'post {i}') for i in range(3)]
+        response = self.client.get(reverse('event-stream'), {'since': 0})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        messages = body.strip().split('\n\n')
+        self.assertTrue(messages[0].startswith('retry: '))
+        ids = [int(message.split('\n')[0][len('id: '):]) for message in messages[1:]]
+        self.assertEqual(len(ids), 3)
+        self.assertIn('event: post.created', messages[1])
+        self.assertEqual(json.loads(messages[3].split('data: ', 1)[1])['id'], posts[2].pk)
+
+        # A reconnecting EventSource resumes after Last-Event-ID
+        response = self.client.get(reverse('event-stream'), HTTP_LAST_EVENT_ID=str(ids[1]))
+        self.assertEqual(b''.join(response.streaming_content).decode().count('id: '), 1)
+        self.assertEqual(self.client.post(reverse('event-stream')).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_importer_and_generator_log_events(self):
+        synthetic.generate(users=2, posts=3, comments_per_post=1)
+        path = os.path.join(tempfile.mkdtemp(), 'posts.ndjson')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as handle:
+            handle.write(json.dumps({'type': 'post', 'content': 'imported', 'comments': [{'content': 'c'}]}) + '\n')
+        call_command('import_data', path, stdout=StringIO())
+        kinds = [event['type'] for event in self.read(0, limit=100)['events']]
+        self.assertEqual(kinds.count('post.created'), 4)
+        self.assertEqual(kinds.count('comment.created'), Comment.objects.count())
+        self.assertEqual(kinds[-2:], ['post.created', 'comment.created'])
+
+    async def test_async_views_over_asgi(self):
+        await Post.objects.acreate(user=self.alice, content='async')
+        with override_settings(ROOT_URLCONF=__name__, EVENTS_STREAM_SECONDS=0):
+            self.assertTrue(iscoroutinefunction(resolve(reverse('event-stream')).func))
+            response = await self.async_client.get(reverse('events'), {'since': 0, 'wait': 1})
+            self.assertEqual(response.json()['events'][0]['data']['content'], 'async')
+            response = await self.async_client.get(reverse('event-stream'), {'since': 0})
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('event: post.created', body)
+
+
+class ChangeSyncTests(PostsAPITestCase):
+    """The changes endpoint, tombstones and compaction of the log"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username='alice')
+
+    def changes(self, since, **params):
+        response = self.client.get(reverse('changes'), {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_changes_collapse_to_current_state_and_tombstones(self):
+        kept, removed = [Post.objects.create(user=self.alice, content=f'post {i}') for i in range(2)]
+        old_comment = Comment.objects.create(post=kept, user=self.alice, content='old')
+        gone_with_post = Comment.objects.create(post=removed, user=self.alice, content='gone')
+        cursor = self.client.get(reverse('changes')).data['cursor']
+
+        kept.content = 'edited'
+        kept.save()
+        kept.save()
+        new = Post.objects.create(user=self.alice, content='new')
+        reply = Comment.objects.create(post=new, user=self.alice, content='reply')
+        Comment.objects.create(post=removed, user=self.alice, content='doomed')
+        old_comment_id, removed_id = old_comment.pk, removed.pk
+        old_comment.delete()
+        removed.delete()
+
+        data = self.changes(cursor)
+        self.assertEqual([post['id'] for post in data['posts']], [kept.pk, new.pk])
+        self.assertEqual(data['posts'][0]['content'], 'edited')
+        self.assertEqual([comment['id'] for comment in data['comments']], [reply.pk])
+        self.assertEqual(data['deleted']['posts'], [removed_id])
+        # The comment made and cascaded away in the window has a tombstone;
+        # one from before the window is covered by its post's
+        deleted_comments = data['deleted']['comments']
+        self.assertEqual(len(deleted_comments), 2)
+        self.assertIn(old_comment_id, deleted_comments)
+        self.assertNotIn(gone_with_post.pk, deleted_comments)
+        self.assertFalse(data['has_more'])
+        self.assertEqual(self.changes(data['cursor'])['posts'], [])
+
+        # Paging: at most limit events are read per call
+        first = self.changes(cursor, limit=2)
+        self.assertTrue(first['has_more'])
+        self.assertEqual([post['id'] for post in first['posts']], [kept.pk])
+        self.assertEqual(self.client.get(reverse('changes'), {'since': 'x'}).status_code, 400)
+
+    def test_cost_follows_changes_not_tables(self):
+        make_posts(self.alice, 300)
+        cursor = self.client.get(reverse('changes')).data['cursor']
+        Post.objects.create(user=self.alice, content='one')
+        with CaptureQueriesContext(connection) as ctx:
+            self.changes(cursor)
+        for query in ctx.captured_queries:
+            self.assertNotIn('COUNT', query['sql'])
+        plan = ChangeEvent.objects.filter(id__gt=cursor).order_by('id').explain()
+        self.assertIn('PRIMARY KEY', plan)
+
+    def test_compaction_expires_old_cursors(self):
+        posts = [Post.objects.create(user=self.alice, content=f'post {i}') for i in range(5)]
+        deleted_id = posts[0].pk
+        posts[0].delete()
+        old = timezone.now() - timedelta(days=30)
+        first_kept = ChangeEvent.objects.order_by('id')[3].pk
+        ChangeEvent.objects.filter(pk__lt=first_kept).update(created_at=old)
+
+        out = StringIO()
+        call_command('compact_events', '--days', '7', '--batch-size', '2', stdout=out)
+        self.assertIn('3 events', out.getvalue())
+        self.assertEqual(ChangeEvent.objects.count(), 3)
+
+        for name in ('changes', 'events'):
+            response = self.client.get(reverse(name), {'since': 0})
+            self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        response = self.client.get(reverse('event-stream'), HTTP_LAST_EVENT_ID='1')
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        data = self.changes(first_kept - 1)
+        self.assertEqual(data['deleted']['posts'], [deleted_id])
+
+        # Even with everything expired, the newest event stays
+        ChangeEvent.objects.update(created_at=old)
+        call_command('compact_events', stdout=StringIO())
+        self.assertEqual(list(ChangeEvent.objects.values_list('pk', flat=True)), [events.latest_seq()])
+
+
+class FastSerializerTests(PostsAPITestCase):
+    """The .values() serializers and the orjson renderer match the ModelSerializers byte for byte"""
+
+    def setUp(self):
+        super().setUp()
+        alice = User.objects.create(username='alice', first_name='Zoë', email='alice@example.com')
+        bob = User.objects.create(username='bob')
+        self.posts = make_posts(alice, 5)
+        self.posts[0].content = 'line\u2028separator, émoji 🎉 and "quotes"'
+        self.posts[0].image = 'posts/photo.jpg'
+        self.posts[0].image_width, self.posts[0].image_height = 640, 480
+        self.posts[0].image_variants = [
+            {'width': 320, 'height': 240, 'format': 'webp', 'path': 'posts/variants/photo-320.webp'},
+        ]
+        self.posts[0].save()
+        for i in range(settings.COMMENT_PREVIEW_SIZE + 2):
+            Comment.objects.create(post=self.posts[0], user=bob, content=f'comment {i} \u2029')
+        Comment.objects.create(post=self.posts[2], user=alice, content='only one')
+        self.request = self.client.get('/').wsgi_request
+
+    def assertSameBytes(self, fast, reference):
+        self.assertEqual(fast, reference)
+        self.assertEqual(ORJSONRenderer().render(fast), JSONRenderer().render(reference))
+
+    def test_posts_match_post_serializer(self):
+        for request in (self.request, None):
+            with self.subTest(request=request):
+                reference = PostSerializer(Post.objects.for_feed(), many=True, context={'request': request}).data
+                rows = list(fast_serializers.post_values(Post.objects.all()))
+                self.assertSameBytes(fast_serializers.serialize_posts(rows, request), reference)
+        self.assertEqual(fast_serializers.serialize_posts([]), [])
+
+    def test_comments_match_comment_serializer(self):
+        queryset = Comment.objects.order_by('id')
+        reference = CommentSerializer(queryset.select_related('user'), many=True).data
+        rows = fast_serializers.comment_values(queryset)
+        self.assertSameBytes(fast_serializers.serialize_comments(rows), reference)
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            1: [timezone.now(), Decimal('1.50'), uuid.UUID(int=7), 2 ** 70, 0.1, None],
+            'text': 'a\u2028b\u2029c </script>',
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            ORJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'),
+        )
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_list_endpoints_keep_cursors(self):
+        for url_name, key in (('get-posts', 'posts'), ('post-list', 'results')):
+            with self.subTest(url_name=url_name):
+                first = self.client.get(reverse(url_name), {'limit': 3}).json()
+                second = self.client.get(reverse(url_name), {'limit': 3, 'cursor': first['next_cursor']}).json()
+                ids = [post['id'] for post in first[key] + second[key]]
+                self.assertEqual(ids, [post.pk for post in self.posts])
+        post = self.client.get(reverse('post-list'), {'limit': 1}).json()['results'][0]
+        self.assertEqual(post['image'], 'http://testserver/media/posts/photo.jpg')
+        self.assertEqual(len(post['comments']), settings.COMMENT_PREVIEW_SIZE)
+
+
+class MediaURLTests(PostsAPITestCase):
+    """Media URLs come from the caching storage, on the request host or MEDIA_BASE_URL"""
+
+    def setUp(self):
+        super().setUp()
+        self.post = make_posts(User.objects.create(username='alice'), 1)[0]
+        self.post.image = 'posts/summer photo é.jpg'
+        self.post.image_variants = [{'width': 320, 'height': 160, 'format': 'webp', 'path': 'posts/v/a b.webp'}]
+        self.post.save()
+        self.request = self.client.get('/').wsgi_request
+
+    def test_same_urls_as_build_absolute_uri(self):
+        plain = FileSystemStorage()
+        url = media_urls(self.request)
+        for name in ('posts/summer photo é.jpg', 'posts/v/a b.webp', 'posts/a%20b.jpg'):
+            with self.subTest(name=name):
+                self.assertEqual(url(name), self.request.build_absolute_uri(plain.url(name)))
+                self.assertEqual(media_urls()(name), plain.url(name))
+
+    def test_storage_caches_urls(self):
+        self.assertIsInstance(default_storage, MediaStorage)
+        storage = MediaStorage()
+        storage.url('posts/x.jpg')
+        storage.url('posts/x.jpg')
+        self.assertEqual(storage._urls.cache_info().hits, 1)
+        with override_settings(MEDIA_URL='/uploads/'):
+            self.assertEqual(storage.url('posts/x.jpg'), '/uploads/posts/x.jpg')
+        self.assertEqual(storage.url('posts/x.jpg'), '/media/posts/x.jpg')
+
+    def test_base_url_prefixes_every_endpoint(self):
+        with override_settings(MEDIA_BASE_URL='https://cdn.example.com/m'):
+            for url_name in ('get-posts', 'post-list'):
+                cache.clear()
+                data = self.client.get(reverse(url_name)).json()
+                post = (data.get('posts') or data.get('results'))[0]
+                self.assertEqual(post['image'], 'https://cdn.example.com/m/posts/summer%20photo%20%C3%A9.jpg')
+                self.assertEqual(post['image_variants'][0]['url'], 'https://cdn.example.com/m/posts/v/a%20b.webp')
+            detail = self.client.get(reverse('post-detail', args=[self.post.pk])).json()
+            self.assertTrue(detail['image'].startswith('https://cdn.example.com/m/'))
+        cache.clear()
+        post = self.client.get(reverse('post-list')).json()['results'][0]
+        self.assertEqual(post['image'], 'http://testserver/media/posts/summer%20photo%20%C3%A9.jpg')
+
+
+class ContentAddressedMediaTests(PostsAPITestCase):
+    """Uploads are stored once per content, counted, and checked before decoding"""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_override = override_settings(MEDIA_ROOT=self.media.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+    def upload(self, image=None, **extra):
+        image = image or make_image(size=(800, 400))
+        return self.client.post(reverse('create-post'), {'content': 'pic', 'image': image, **extra})
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media.name)
+            for root, _, names in os.walk(self.media.name) for name in names
+        )
+
+    def refcounts(self):
+        return dict(MediaBlob.objects.values_list('name', 'refcount'))
+
+    @override_settings(MEDIA_UPLOAD_CHUNK_SIZE=1000)
+    def test_save_streams_and_names_by_hash(self):
+        data = os.urandom(5500)
+        name = default_storage.save('posts/Holiday.JPG', ContentFile(data))
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(name, f'posts/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(default_storage.save('posts/other.jpg', ContentFile(data)), name)
+        self.assertEqual(self.stored_files(), [name])
+        self.assertEqual(MediaBlob.objects.get(name=name).size, 5500)
+
+    def test_same_image_is_stored_once_and_deleted_with_its_last_post(self):
+        first, second = self.upload().data['post'], self.upload().data['post']
+        self.assertEqual(run_pending(), 2)
+        self.assertEqual(first['image'], second['image'])
+        posts = Post.objects.in_bulk([first['id'], second['id']])
+        names = storage.post_media(posts[first['id']].image.name, posts[first['id']].image_variants)
+        self.assertEqual(names, storage.post_media(posts[second['id']].image.name, posts[second['id']].image_variants))
+        self.assertEqual(self.stored_files(), sorted(names))
+        self.assertEqual(self.refcounts(), dict.fromkeys(names, 2))
+
+        self.client.delete(reverse('delete-post', args=[first['id']]))
+        run_pending()
+        self.assertEqual(self.stored_files(), sorted(names))
+        self.assertEqual(self.refcounts(), dict.fromkeys(names, 1))
+
+        self.client.delete(reverse('delete-post', args=[second['id']]))
+        run_pending()
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_replacing_an_image_releases_the_old_one(self):
+        post = self.upload().data['post']
+        run_pending()
+        old = Post.objects.get(pk=post['id'])
+        old_names = storage.post_media(old.image.name, old.image_variants)
+        response = self.client.patch(
+            reverse('post-detail', args=[post['id']]), {'image': make_image(size=(300, 300))}, format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        run_pending()
+        new = Post.objects.get(pk=post['id'])
+        new_names = storage.post_media(new.image.name, new.image_variants)
+        self.assertFalse(old_names & new_names)
+        self.assertEqual(self.stored_files(), sorted(new_names))
+        self.assertEqual(self.refcounts(), dict.fromkeys(new_names, 1))
+
+    def test_imported_posts_count_their_media(self):
+        post_id = self.upload().data['post']['id']
+        run_pending()
+        post = Post.objects.get(pk=post_id)
+        names = storage.post_media(post.image.name, post.image_variants)
+        record = {
+            'type': 'post', 'username': 'bob', 'content': 'same pic',
+            'image': post.image.name, 'image_variants': post.image_variants,
+        }
+        path = os.path.join(self.media.name, 'posts.ndjson')
+        with open(path, 'w') as handle:
+            handle.write(json.dumps(record) + '\n')
+        call_command('import_data', path, '--state', os.path.join(self.media.name, 'state.json'), stdout=StringIO())
+        self.assertEqual(self.refcounts(), dict.fromkeys(names, 2))
+
+        post.delete()
+        run_pending()
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+
+    def test_clean_media_removes_rolled_back_files(self):
+        kept = default_storage.save('posts/kept.jpg', ContentFile(b'kept'))
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            orphan = default_storage.save('posts/orphan.jpg', ContentFile(b'orphan'))
+            raise RuntimeError
+        incoming = os.path.join(self.media.name, storage.INCOMING_DIR, 'stale')
+        open(incoming, 'wb').close()
+        for name in self.stored_files():
+            os.utime(os.path.join(self.media.name, name), (0, 0))
+        self.assertFalse(MediaBlob.objects.filter(name=orphan).exists())
+
+        out = StringIO()
+        call_command('clean_media', '--dry-run', stdout=out)
+        self.assertIn('2 orphaned media files would be deleted', out.getvalue())
+        self.assertEqual(len(self.stored_files()), 3)
+        call_command('clean_media', stdout=StringIO())
+        self.assertEqual(self.stored_files(), [kept])
+
+    @override_settings(MEDIA_MAX_UPLOAD_BYTES=2000)
+    def test_oversized_upload_is_rejected_unstored(self):
+        upload = SimpleUploadedFile('big.bin', os.urandom(50000), content_type='image/png')
+        response = self.upload(upload)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('at most', str(response.data['errors']['image']))
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_upload_handler_stops_storing_past_the_limit(self):
+        handler = LimitedUploadHandler()
+        handler.new_file('image', 'big.png', 'image/png', None)
+        with override_settings(MEDIA_MAX_UPLOAD_BYTES=10):
+            self.assertEqual(handler.receive_data_chunk(b'x' * 8, 0), b'x' * 8)
+            self.assertIsNone(handler.receive_data_chunk(b'x' * 8, 8))
+            upload = handler.file_complete(16)
+        self.assertEqual((upload.size, upload.read()), (16, b''))
+
+    @override_settings(MEDIA_MAX_IMAGE_PIXELS=100 * 100)
+    def test_pixel_limit_is_checked_from_the_header(self):
+        image = make_image(size=(101, 100))
+        with mock.patch.object(ImageFile.ImageFile, 'load', side_effect=AssertionError('decoded')):
+            response = self.upload(image)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pixels', str(response.data['errors']['image']))
+        self.assertEqual(self.upload(make_image(size=(100, 100))).status_code, status.HTTP_201_CREATED)
+
+
+class ConcurrentWriteTests(SimpleTestCase):
+    """The production SQLite profile survives several writer processes"""
+
+    def test_stress_writes_has_no_lock_errors(self):
+        out = StringIO()
+        call_command('stress_writes', '--processes', '3', '--writes', '20', stdout=out)
+        self.assertIn('lock errors: 0', out.getvalue())
+        self.assertIn('succeeded:   60', out.getvalue())
+
+    def test_retry_on_lock_retries_only_lock_errors(self):
+        attempts = []
+
+        @retry_on_lock
+        def flaky(error):
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise OperationalError(error)
+            return 'done'
+
+        with override_settings(SQLITE_LOCK_RETRY_DELAY=0):
+            self.assertEqual(flaky('database is locked'), 'done')
+            attempts.clear()
+            with self.assertRaises(OperationalError):
+                flaky('no such table: posts_post')
+
+
+class AdminBenchmarkTests(SimpleTestCase):
+    """benchmark_admin seeds a scratch database and times each changelist"""
+
+    def test_benchmark_reports_every_size(self):
+        out = StringIO()
+        call_command('benchmark_admin', '--sizes', '50', '200', '--requests', '1', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(sum(line.split()[0] in ('50', '200') for line in lines[1:7]), 6)
+        self.assertIn('comments:', out.getvalue())
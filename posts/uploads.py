@@ -0,0 +1,78 @@
+"""
+Limits on uploaded images, enforced before anything decodes them.
+
+LimitedUploadHandler runs first among FILE_UPLOAD_HANDLERS and counts every
+file's bytes as the request body is parsed. Once a file passes
+MEDIA_MAX_UPLOAD_BYTES it stops handing chunks on to the handlers that keep
+them in memory or on disk, so an oversized upload costs neither. The file
+then arrives as an empty OversizedUpload that still knows its real size,
+and check_upload() rejects it.
+
+check_upload() also reads the image header, which gives the dimensions
+without decoding a pixel, and rejects images with more than
+MEDIA_MAX_IMAGE_PIXELS pixels, so a small file that would decompress to
+gigabytes never reaches Pillow's decoder in the image job.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+
+class OversizedUpload(UploadedFile):
+    """An upload cut off at the size limit: no content, only its size"""
+
+    def __init__(self, name, content_type, size, charset=None, content_type_extra=None):
+        super().__init__(BytesIO(), name, content_type, size, charset, content_type_extra)
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """Stops storing a file once it passes MEDIA_MAX_UPLOAD_BYTES"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.MEDIA_MAX_UPLOAD_BYTES:
+            # Later handlers get nothing more; the rest is read and dropped
+            return None
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.received > settings.MEDIA_MAX_UPLOAD_BYTES:
+            return OversizedUpload(
+                self.file_name, self.content_type, self.received, self.charset, self.content_type_extra,
+            )
+        # Within the limit the next handler returns the file
+        return None
+
+
+def check_upload(upload):
+    """Raise ValidationError if upload is over the size or pixel limit"""
+    if upload.size > settings.MEDIA_MAX_UPLOAD_BYTES:
+        raise ValidationError(
+            f'Image files can be at most {filesizeformat(settings.MEDIA_MAX_UPLOAD_BYTES)}.',
+            code='file_too_large',
+        )
+    try:
+        # Only parses the header; pixels are decoded on load()
+        with Image.open(upload) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        width = height = None
+    except Exception:
+        # Not an image Pillow knows; the ImageField reports that
+        return
+    finally:
+        upload.seek(0)
+    if width is None or width * height > settings.MEDIA_MAX_IMAGE_PIXELS:
+        raise ValidationError(
+            f'Images can have at most {settings.MEDIA_MAX_IMAGE_PIXELS:,} pixels.',
+            code='too_many_pixels',
+        )
@@ -1,6 +1,7 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register(r'posts', views.PostViewSet, basename='post')
@@ -13,4 +14,47 @@ urlpatterns = [
     path('delete-post/<int:pk>/', views.delete_post, name='delete-post'),
     path('add-comment/<int:post_id>/', views.add_comment, name='add-comment'),
     path('get-comments/<int:post_id>/', views.get_comments, name='get-comments'),
-]
\ No newline at end of file
+    path('batch/create-posts/', views.batch_create_posts, name='batch-create-posts'),
+    path('batch/add-comments/', views.batch_add_comments, name='batch-add-comments'),
+    path('search/', views.search_content, name='search'),
+    path('export/', views.export_content, name='export'),
+    path('cache-stats/', views.get_cache_stats, name='cache-stats'),
+    path('jobs/<int:pk>/', views.get_job, name='get-job'),
+    path('events/', views.get_events, name='events'),
+    path('events/stream/', views.stream_events, name='event-stream'),
+    path('changes/', views.get_changes, name='changes'),
+    path('stats/', views.get_stats, name='stats'),
+    path('health/', views.health, name='health'),
+]
+
+
+def async_read_patterns():
+    """
+    Async GET routes for the read endpoints (see posts.async_views), to go
+    in front of urlpatterns; other requests fall back to the sync views.
+    """
+    sync_views = {pattern.name: pattern.callback for pattern in router.urls}
+    sync_views.update({
+        'get-posts': views.get_posts,
+        'get-comments': views.get_comments,
+        'events': views.get_events,
+        'event-stream': views.stream_events,
+    })
+    routes = [
+        ('posts/', async_views.list_posts, 'post-list'),
+        ('posts/<int:pk>/', async_views.retrieve_post, 'post-detail'),
+        ('comments/', async_views.list_comments, 'comment-list'),
+        ('comments/<int:pk>/', async_views.retrieve_comment, 'comment-detail'),
+        ('get-posts/', async_views.get_posts, 'get-posts'),
+        ('get-comments/<int:post_id>/', async_views.get_comments, 'get-comments'),
+        ('events/', async_views.get_events, 'events'),
+        ('events/stream/', async_views.stream_events, 'event-stream'),
+    ]
+    return [
+        path(route, async_views.read_view(view, sync_views[name]), name=name)
+        for route, view, name in routes
+    ]
+
+
+if settings.ASYNC_READS:
+    urlpatterns = async_read_patterns() + urlpatterns
@@ -0,0 +1,156 @@
+"""
+Username to User resolution shared by the write paths.
+
+Both serializers and the batch endpoints look users up here instead of
+calling get_or_create on every write. Resolved users are kept in a bounded,
+per-process LRU cache; posts.signals evicts a user whenever it is saved or
+deleted (e.g. renamed in the admin).
+
+Other processes learn of the change through USERS_VERSION_KEY, which the
+same signal bumps in the Django cache: every lookup compares it with the
+version the entries were cached under and drops them all when it moved.
+That only reaches other processes when the cache backend is shared between
+them (Redis, Memcached, a file cache); with the default LocMemCache each
+process has its own version, and USER_CACHE_TIMEOUT is what bounds how long
+a rename or deletion elsewhere goes unnoticed.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from .cache import USERS_VERSION_KEY, get_version
+
+
+class UserCache:
+    """Thread-safe LRU of username -> User, each entry trusted for timeout seconds"""
+
+    def __init__(self, maxsize, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.version = None
+        self._users = OrderedDict()
+        self._names = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def sync(self, version):
+        """Drop every entry if version differs from the one they were cached under"""
+        with self._lock:
+            if version != self.version:
+                self._users.clear()
+                self._names.clear()
+                self.version = version
+
+    def get(self, username):
+        with self._lock:
+            user, expires = self._users.get(username, (None, None))
+            if user is not None and expires is not None and expires <= time.monotonic():
+                self._users.pop(username)
+                self._names.pop(user.pk, None)
+                user = None
+            if user is None:
+                self.misses += 1
+                return None
+            self._users.move_to_end(username)
+            self.hits += 1
+        # Hand out copies so callers can't mutate the shared instance
+        return _copy(user)
+
+    def put(self, user):
+        expires = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._lock:
+            previous = self._names.get(user.pk)
+            if previous is not None and previous != user.username:
+                self._users.pop(previous, None)
+            self._users[user.username] = (_copy(user), expires)
+            self._users.move_to_end(user.username)
+            self._names[user.pk] = user.username
+            while len(self._users) > self.maxsize:
+                _, (evicted, _) = self._users.popitem(last=False)
+                self._names.pop(evicted.pk, None)
+
+    def forget(self, user_id):
+        with self._lock:
+            username = self._names.pop(user_id, None)
+            if username is not None:
+                self._users.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._names.clear()
+            self.version = None
+            self.hits = self.misses = 0
+
+
+def _copy(user):
+    # Model.__getstate__ copies _state and its fields cache, so the clone
+    # shares nothing mutable with the original
+    return copy.copy(user)
+
+
+user_cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TIMEOUT)
+
+
+def _remember(user):
+    # Only cache users once their row is committed, so a rolled-back
+    # creation can never leave a dangling id behind
+    transaction.on_commit(lambda: user_cache.put(user))
+
+
+def _get_or_create(username, retries=3):
+    """get_or_create that relies on the unique constraint to settle races"""
+    for _ in range(retries):
+        user = User.objects.filter(username=username).first()
+        if user is not None:
+            return user
+        try:
+            with transaction.atomic():
+                return User.objects.create(username=username)
+        except IntegrityError:
+            # Another request created it between our read and insert
+            continue
+    return User.objects.get(username=username)
+
+
+def get_user(username):
+    """Return the User for username, creating it if needed"""
+    user_cache.sync(get_version(USERS_VERSION_KEY))
+    user = user_cache.get(username)
+    if user is None:
+        user = _get_or_create(username)
+        _remember(user)
+    return user
+
+
+def resolve_usernames(usernames):
+    """
+    Map every username to a user id, creating missing users, in at most
+    three queries however many names are given.
+    """
+    names = set(usernames)
+    found = {}
+    user_cache.sync(get_version(USERS_VERSION_KEY))
+    for name in names:
+        user = user_cache.get(name)
+        if user is not None:
+            found[name] = user.pk
+    missing = names - found.keys()
+    if not missing:
+        return found
+
+    users = list(User.objects.filter(username__in=missing))
+    absent = missing - {user.username for user in users}
+    if absent:
+        # ignore_conflicts: a concurrent request may create the same user
+        User.objects.bulk_create([User(username=name) for name in absent], ignore_conflicts=True)
+        users += User.objects.filter(username__in=absent)
+    for user in users:
+        found[user.username] = user.pk
+        _remember(user)
+    return found
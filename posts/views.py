@@ -1,32 +1,130 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, transaction
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_GET
 from rest_framework import viewsets, status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from .models import Post, Comment
-from .serializers import PostSerializer, CommentSerializer
+from .models import ChangeEvent, Post, Comment, Job
+from .serializers import (
+    PostSerializer, CommentSerializer, JobSerializer, BatchPostItemSerializer,
+)
+from .images import process_post_image
+from .jobs import queue_image_processing
+from .db import retry_on_lock
+from . import batch, events, export, fast_serializers, metrics, search
+from .pagination import KeysetPagination, PostPagination, CommentPagination
+from .conditional import comment_condition, feed_condition, feed_position, post_condition
+from .cache import (
+    FEED_VERSION_KEY, bump_comments_version, cache_stats, cached_data,
+    comments_version_key, get_version, response_key,
+)
 
 
 class PostViewSet(viewsets.ModelViewSet):
     """API endpoint for CRUD operations on Posts"""
-    queryset = Post.objects.all().order_by('-created_at')
+    queryset = Post.objects.for_feed().order_by('-created_at', '-id')
     serializer_class = PostSerializer
+    pagination_class = PostPagination
     parser_classes = (MultiPartParser, FormParser, JSONParser)
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
+    
+    def list(self, request, *args, **kwargs):
+        # Read straight from .values() rows (see posts.fast_serializers)
+        rows = self.paginator.paginate_queryset(fast_serializers.post_values(Post.objects.all()), request)
+        return self.paginator.get_paginated_response(fast_serializers.serialize_posts(rows, request))
+    
+    @method_decorator(post_condition)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
+    # Image derivatives are generated by a background job queued in the
+    # same transaction as the post row
+    
+    def perform_create(self, serializer):
+        save_post(serializer)
+    
+    @retry_on_lock
+    @transaction.atomic
+    def perform_update(self, serializer):
+        image_changed = 'image' in serializer.validated_data
+        post = serializer.save()
+        if not image_changed:
+            return
+        if post.image:
+            queue_image_processing(post)
+        else:
+            # Nothing to decode: drop the old dimensions and variants now
+            process_post_image(post)
+    
+    @retry_on_lock
+    def perform_destroy(self, instance):
+        instance.delete()
 
 
 class CommentViewSet(viewsets.ModelViewSet):
     """API endpoint for CRUD operations on Comments"""
-    queryset = Comment.objects.all().order_by('created_at')
+    queryset = Comment.objects.select_related('user').order_by('created_at', 'id')
     serializer_class = CommentSerializer
+    pagination_class = CommentPagination
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
+    
+    def list(self, request, *args, **kwargs):
+        rows = self.paginator.paginate_queryset(fast_serializers.comment_values(Comment.objects.all()), request)
+        return self.paginator.get_paginated_response(fast_serializers.serialize_comments(rows))
+    
+    @method_decorator(comment_condition)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
+    # Post.comments_count is kept in step by posts.signals; the transactions
+    # keep the row write and the counter update together.
+    
+    @retry_on_lock
+    @transaction.atomic
+    def perform_create(self, serializer):
+        serializer.save()
+    
+    @retry_on_lock
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_post_id = serializer.instance.post_id
+        comment = serializer.save()
+        if comment.post_id != previous_post_id:
+            Post.objects.filter(pk=previous_post_id).add_to_comments_count(-1)
+            Post.objects.filter(pk=comment.post_id).add_to_comments_count(1)
+            bump_comments_version(previous_post_id)
+            # The comment's event names its new post; the old one lost a comment
+            events.record(ChangeEvent.POST, ChangeEvent.UPDATED, previous_post_id, previous_post_id)
+    
+    @retry_on_lock
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
+
+@retry_on_lock
+@transaction.atomic
+def save_post(serializer):
+    """Commit the post together with its image job; returns (post, job)"""
+    post = serializer.save()
+    job = queue_image_processing(post) if post.image else None
+    return post, job
 
 
 @api_view(['POST'])
@@ -53,14 +151,14 @@ def create_post(request):
         serializer = PostSerializer(data=post_data, context={'request': request})
         
         if serializer.is_valid():
-            serializer.save()
-            return Response(
-                {
-                    'message': 'Post created successfully',
-                    'post': serializer.data
-                },
-                status=status.HTTP_201_CREATED
-            )
+            post, job = save_post(serializer)
+            response_data = {
+                'message': 'Post created successfully',
+                'post': serializer.data
+            }
+            if job is not None:
+                response_data['job_id'] = job.id
+            return Response(response_data, status=status.HTTP_201_CREATED)
         else:
             return Response(
                 {'errors': serializer.errors},
@@ -74,18 +172,27 @@ def create_post(request):
         )
 
 
+@feed_condition
 @api_view(['GET'])
 def get_posts(request):
-    """Get all posts with comments"""
+    """Get one page of posts with comments, newest first"""
     try:
-        posts = Post.objects.all().order_by('-created_at')
-        serializer = PostSerializer(posts, many=True, context={'request': request})
+        def build():
+            paginator = PostPagination()
+            rows = paginator.paginate_queryset(fast_serializers.post_values(Post.objects.all()), request)
+            return {
+                'count': len(rows),
+                'next_cursor': paginator.next_cursor,
+                'posts': fast_serializers.serialize_posts(rows, request)
+            }
+        
+        version = f'{get_version(FEED_VERSION_KEY)}.{feed_position(request)}'
+        key = response_key('feed', version, request)
+        return Response(cached_data(key, build), status=status.HTTP_200_OK)
+    except ValidationError as e:
         return Response(
-            {
-                'count': posts.count(),
-                'posts': serializer.data
-            },
-            status=status.HTTP_200_OK
+            {'errors': e.detail},
+            status=status.HTTP_400_BAD_REQUEST
         )
     except Exception as e:
         return Response(
@@ -99,7 +206,7 @@ def delete_post(request, pk):
     """Delete a post"""
     try:
         post = Post.objects.get(pk=pk)
-        post.delete()
+        retry_on_lock(post.delete)()
         return Response(
             {'message': 'Post deleted successfully'},
             status=status.HTTP_200_OK
@@ -139,7 +246,7 @@ def add_comment(request, post_id):
         serializer = CommentSerializer(data=comment_data)
         
         if serializer.is_valid():
-            serializer.save()
+            retry_on_lock(transaction.atomic(serializer.save))()
             return Response(
                 {
                     'message': 'Comment added successfully',
@@ -165,19 +272,28 @@ def add_comment(request, post_id):
         )
 
 
+@post_condition
 @api_view(['GET'])
 def get_comments(request, post_id):
-    """Get all comments for a post"""
+    """Get one page of a post's comments, oldest first"""
     try:
-        post = Post.objects.get(pk=post_id)
-        comments = post.comments.all()
-        serializer = CommentSerializer(comments, many=True)
+        def build():
+            post = Post.objects.get(pk=post_id)
+            paginator = CommentPagination()
+            rows = paginator.paginate_queryset(fast_serializers.comment_values(post.comments.all()), request)
+            return {
+                'count': len(rows),
+                'next_cursor': paginator.next_cursor,
+                'comments': fast_serializers.serialize_comments(rows)
+            }
+        
+        version = get_version(comments_version_key(post_id))
+        key = response_key('comments', version, request)
+        return Response(cached_data(key, build), status=status.HTTP_200_OK)
+    except ValidationError as e:
         return Response(
-            {
-                'count': comments.count(),
-                'comments': serializer.data
-            },
-            status=status.HTTP_200_OK
+            {'errors': e.detail},
+            status=status.HTTP_400_BAD_REQUEST
         )
     except Post.DoesNotExist:
         return Response(
@@ -188,4 +304,320 @@ def get_comments(request, post_id):
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+
+@api_view(['GET'])
+def get_cache_stats(request):
+    """Hit/miss counters for the feed and comment response cache"""
+    return Response(cache_stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def get_job(request, pk):
+    """Get the status of a background job"""
+    try:
+        job = Job.objects.get(pk=pk)
+        return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+    except Job.DoesNotExist:
+        return Response(
+            {'error': 'Job not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+
+def _batch_items(request, field):
+    """Pull the item list out of a batch request, or return an error Response"""
+    items = request.data.get(field) if hasattr(request.data, 'get') else None
+    if not isinstance(items, list) or not items:
+        return None, Response(
+            {'error': f'"{field}" must be a non-empty list'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        return None, Response(
+            {'error': f'At most {settings.BATCH_MAX_ITEMS} items per request'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return items, None
+
+
+@api_view(['POST'])
+def batch_create_posts(request):
+    """Create many text posts in one request; nothing is written if any item is invalid"""
+    try:
+        items, error = _batch_items(request, 'posts')
+        if error:
+            return error
+        
+        validated, errors = batch.validate_items(items, BatchPostItemSerializer)
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        
+        posts = batch.create_posts(validated)
+        return Response(
+            {
+                'message': f'{len(posts)} posts created successfully',
+                'results': [{'index': i, 'id': post.pk} for i, post in enumerate(posts)]
+            },
+            status=status.HTTP_201_CREATED
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+def batch_add_comments(request):
+    """Add many comments in one request; nothing is written if any item is invalid"""
+    try:
+        items, error = _batch_items(request, 'comments')
+        if error:
+            return error
+        
+        validated, errors = batch.validate_comment_items(items)
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        
+        comments = batch.create_comments(validated)
+        return Response(
+            {
+                'message': f'{len(comments)} comments added successfully',
+                'results': [
+                    {'index': i, 'id': comment.pk, 'post': comment.post_id}
+                    for i, comment in enumerate(comments)
+                ]
+            },
+            status=status.HTTP_201_CREATED
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+def search_content(request):
+    """Full-text search over posts and comments, best matches first"""
+    try:
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {'error': 'Search query is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        hits, next_cursor = search.search(
+            query,
+            kind=request.query_params.get('type') or None,
+            limit=KeysetPagination().get_limit(request),
+            cursor=request.query_params.get('cursor'),
+        )
+        results = search.attach_objects(hits)
+        return Response(
+            {
+                'count': len(results),
+                'next_cursor': next_cursor,
+                'results': results
+            },
+            status=status.HTTP_200_OK
+        )
+    except ValidationError as e:
+        return Response(
+            {'errors': e.detail},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+def export_content(request):
+    """Stream every post (and its comments) as NDJSON, oldest first"""
+    params = request.query_params
+    errors = {}
+    bounds = {}
+    for name in ('since', 'until'):
+        if params.get(name):
+            try:
+                bounds[name] = export.parse_bound(params[name], end_of_day=name == 'until')
+            except ValueError as e:
+                errors[name] = str(e)
+    comments = params.get('comments', export.NESTED)
+    if comments not in export.COMMENT_MODES:
+        errors['comments'] = f"Must be one of: {', '.join(export.COMMENT_MODES)}"
+    if errors:
+        return Response(
+            {'errors': errors},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    compress = export.accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    chunks = export.ndjson_chunks(comments=comments, compress=compress, **bounds)
+    if isinstance(request._request, ASGIRequest):
+        # Django would otherwise read a sync iterator to the end before sending
+        chunks = export.achunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type='application/x-ndjson')
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    response['Content-Disposition'] = 'attachment; filename="export.ndjson"'
+    return response
+
+
+@api_view(['GET'])
+def get_events(request):
+    """Change events after ?since, oldest first, long-polling up to ?wait seconds for one"""
+    try:
+        params = request.query_params
+        limit = KeysetPagination().get_limit(request)
+        wait = events.parse_wait(params.get('wait'))
+        if params.get('since') in (None, ''):
+            # Where a new client starts: nothing yet, and the current position
+            return Response({'events': [], 'cursor': events.latest_seq()}, status=status.HTTP_200_OK)
+        since = events.parse_seq(params['since'])
+        events.check_cursor(since)
+        found = events.wait_for_events(since, limit, wait, request)
+        return Response(
+            {
+                'events': found,
+                'cursor': found[-1]['seq'] if found else since
+            },
+            status=status.HTTP_200_OK
+        )
+    except ValidationError as e:
+        return Response(
+            {'errors': e.detail},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except events.CursorExpired as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_410_GONE
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+def event_stream_response(body):
+    response = StreamingHttpResponse(body, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx-style proxies to pass events on as they are written
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+def stream_events(request):
+    """Change events as Server-Sent Events (see posts.events.EventStream)"""
+    try:
+        since = events.stream_start(request)
+    except ValidationError as e:
+        return JsonResponse({'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+    except events.CursorExpired as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_410_GONE)
+    return event_stream_response(iter(events.EventStream(since, request)))
+
+
+@api_view(['GET'])
+def get_changes(request):
+    """Posts and comments changed after ?since, plus tombstones for deletions"""
+    try:
+        params = request.query_params
+        limit = KeysetPagination().get_limit(request)
+        if params.get('since') in (None, ''):
+            return Response(
+                {
+                    'posts': [],
+                    'comments': [],
+                    'deleted': {'posts': [], 'comments': []},
+                    'cursor': events.latest_seq(),
+                    'has_more': False
+                },
+                status=status.HTTP_200_OK
+            )
+        since = events.parse_seq(params['since'])
+        events.check_cursor(since)
+        return Response(events.changes_since(since, limit, request), status=status.HTTP_200_OK)
+    except ValidationError as e:
+        return Response(
+            {'errors': e.detail},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except events.CursorExpired as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_410_GONE
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+STATS_CACHE_KEY = 'posts:stats'
+
+
+def compute_stats():
+    """Count posts, images, comments and users in one round trip"""
+    quote = connection.ops.quote_name
+    post_table = quote(Post._meta.db_table)
+    image_column = quote(Post._meta.get_field('image').column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT "
+            f"(SELECT COUNT(*) FROM {post_table}), "
+            f"(SELECT COUNT(*) FROM {post_table} "
+            f"WHERE {image_column} IS NOT NULL AND {image_column} != ''), "
+            f"(SELECT COUNT(*) FROM {quote(Comment._meta.db_table)}), "
+            f"(SELECT COUNT(*) FROM {quote(User._meta.db_table)})"
+        )
+        posts, images, comments, users = cursor.fetchone()
+    return {'posts': posts, 'images': images, 'comments': comments, 'users': users}
+
+
+@api_view(['GET'])
+def get_stats(request):
+    """Site-wide counts, cached for a few seconds"""
+    try:
+        stats = cache.get(STATS_CACHE_KEY)
+        if stats is None:
+            stats = compute_stats()
+            cache.set(STATS_CACHE_KEY, stats, settings.STATS_CACHE_TIMEOUT)
+        return Response(stats, status=status.HTTP_200_OK)
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+def health(request):
+    """Liveness check that only asks the database for SELECT 1"""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    except Exception as e:
+        return Response(
+            {'status': 'error', 'error': str(e)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    return Response({'status': 'ok'}, status=status.HTTP_200_OK)
+
+
+def get_metrics(request):
+    """Per-endpoint request histograms for Prometheus; 404 unless METRICS_ENABLED"""
+    if not settings.METRICS_ENABLED:
+        raise Http404('Metrics are disabled')
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -3,14 +3,31 @@ Streamlit Frontend for Mini Social Media
 COMPLETE VERSION WITH COMMENTS AND USERNAMES
 """
 
+import time
+
 import streamlit as st
 import requests
-from PIL import Image
-from io import BytesIO
 from datetime import datetime
 
+from api_client import ApiClient, CursorExpired
+
 # Configuration
 API_BASE_URL = "http://localhost:8000/api"
+FEED_PAGE_SIZE = 20
+COMMENTS_PAGE_SIZE = 20
+# Width the feed column renders images at; the smallest variant at least
+# this wide is downloaded instead of the original upload
+DISPLAY_IMAGE_WIDTH = 640
+PREFERRED_IMAGE_FORMATS = ['webp', 'jpeg']
+# Seconds a feed response is reused across reruns before revalidating
+RESPONSE_TTL = 5
+IMAGE_FETCH_WORKERS = 4
+# Live mode: seconds between checks for change events, and the most events
+# applied at once; a client further behind than that reloads the feed
+LIVE_POLL_SECONDS = 3
+EVENTS_PAGE_SIZE = 100
+# After a failed check, live mode waits twice as long each time, up to this
+LIVE_MAX_BACKOFF_SECONDS = 60
 
 # Page Configuration
 st.set_page_config(
@@ -56,11 +73,17 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+@st.cache_resource
+def get_client():
+    """One pooled client per Streamlit server process, shared across reruns"""
+    return ApiClient(API_BASE_URL, ttl=RESPONSE_TTL, image_workers=IMAGE_FETCH_WORKERS)
+
+
 def test_connection():
     """Test if Django server is running"""
     try:
-        response = requests.get(API_BASE_URL + "/get-posts/", timeout=2)
-        return response.status_code == 200
+        data = get_client().get_json("/health/", timeout=2)
+        return data is not None and data.get('status') == 'ok'
     except:
         return False
 
@@ -77,8 +100,8 @@ def create_post(content, username, image_file=None):
         if image_file is not None:
             files = {'image': image_file}
         
-        response = requests.post(
-            API_BASE_URL + "/create-post/",
+        response = get_client().post(
+            "/create-post/",
             data=data,
             files=files,
             timeout=10
@@ -87,7 +110,13 @@ def create_post(content, username, image_file=None):
         if response.status_code == 201:
             return True, "Post created successfully! 🎉"
         else:
-            error_msg = response.json().get('error', 'Unknown error')
+            body = response.json()
+            error_msg = body.get('error', 'Unknown error')
+            # Validation errors, e.g. an image over the size or pixel limit
+            if body.get('errors'):
+                error_msg = ' '.join(
+                    ' '.join(messages) for messages in body['errors'].values()
+                )
             return False, "Error: " + error_msg
     except requests.exceptions.ConnectionError:
         return False, "❌ Cannot connect to Django. Is it running?"
@@ -96,22 +125,45 @@ def create_post(content, username, image_file=None):
 
 
 def get_posts():
-    """Fetch all posts"""
+    """Fetch the first page of the feed"""
     try:
-        response = requests.get(API_BASE_URL + "/get-posts/", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
+        data = get_client().get_json("/get-posts/", params={'limit': FEED_PAGE_SIZE})
+        if data is not None:
             return data.get('posts', [])
         return []
     except:
         return []
 
 
+def get_stats():
+    """Fetch site-wide counts computed by the server"""
+    try:
+        data = get_client().get_json("/stats/")
+        return data or {}
+    except:
+        return {}
+
+
+def get_comments(post_id, cursor=None):
+    """Fetch one page of a post's comments, oldest first"""
+    try:
+        params = {'limit': COMMENTS_PAGE_SIZE}
+        if cursor:
+            params['cursor'] = cursor
+        path = "/get-comments/" + str(post_id) + "/"
+        data = get_client().get_json(path, params=params)
+        if data is not None:
+            return data.get('comments', []), data.get('next_cursor')
+        return [], None
+    except:
+        return [], None
+
+
 def delete_post(post_id):
     """Delete a post"""
     try:
-        url = API_BASE_URL + "/delete-post/" + str(post_id) + "/"
-        response = requests.delete(url, timeout=5)
+        path = "/delete-post/" + str(post_id) + "/"
+        response = get_client().delete(path, timeout=5)
         if response.status_code == 200:
             return True, "Post deleted!"
         return False, "Failed to delete"
@@ -126,8 +178,8 @@ def add_comment(post_id, content, username):
             'content': content,
             'username': username
         }
-        url = API_BASE_URL + "/add-comment/" + str(post_id) + "/"
-        response = requests.post(url, json=data, timeout=5)
+        path = "/add-comment/" + str(post_id) + "/"
+        response = get_client().post(path, json=data, timeout=5)
         if response.status_code == 201:
             return True, "Comment added!"
         return False, "Failed to add comment"
@@ -135,7 +187,146 @@ def add_comment(post_id, content, username):
         return False, "Error: " + str(e)
 
 
-def display_post(post):
+def pick_image_url(post, target_width=DISPLAY_IMAGE_WIDTH):
+    """Choose the smallest derivative that still fills target_width"""
+    variants = post.get('image_variants') or []
+    for fmt in PREFERRED_IMAGE_FORMATS:
+        candidates = sorted(
+            (v for v in variants if v.get('format') == fmt),
+            key=lambda v: v['width']
+        )
+        if candidates:
+            wide_enough = [v for v in candidates if v['width'] >= target_width]
+            return (wide_enough[0] if wide_enough else candidates[-1])['url']
+    return post.get('image')
+
+
+def image_url_for(post):
+    """Absolute URL of the image variant the feed should show, if any"""
+    if not post.get('image'):
+        return None
+    image_url = pick_image_url(post)
+    if not image_url.startswith('http'):
+        image_url = "http://localhost:8000" + image_url
+    return image_url
+
+
+def fetch_feed_images(posts):
+    """Download every image on the page concurrently: {url: bytes or None}"""
+    return get_client().fetch_images(image_url_for(post) for post in posts)
+
+
+def feed_order(post):
+    return (post['created_at'], post['id'])
+
+
+def apply_events(posts, events):
+    """
+    Apply change events (oldest first) to a feed page, newest post first.
+    Events carry the current state of what they touch, so each one replaces
+    a post wholesale and replaying an event changes nothing.
+    """
+    by_id = {post['id']: post for post in posts}
+    for event in events:
+        kind, action = event['type'].split('.')
+        if kind == 'post' and action == 'deleted':
+            by_id.pop(event['id'], None)
+        elif kind == 'post':
+            # Updates only matter for posts on the page; new posts join it
+            if event['data'] is not None and (action == 'created' or event['id'] in by_id):
+                by_id[event['id']] = event['data']
+        elif event['post'] in by_id:
+            if event['post_data'] is None:
+                by_id.pop(event['post'])
+            else:
+                by_id[event['post']] = event['post_data']
+            # A loaded thread is out of date; it is fetched again on demand
+            st.session_state.pop("thread_" + str(event['post']), None)
+    ordered = sorted(by_id.values(), key=feed_order, reverse=True)
+    if posts:
+        # Keep the page window: posts older than the page stay off it
+        oldest = min(feed_order(post) for post in posts)
+        ordered = [post for post in ordered if feed_order(post) >= oldest]
+    return ordered[:FEED_PAGE_SIZE]
+
+
+def load_live_feed():
+    """
+    Fetch the feed once and remember the event cursor it is current at.
+    Returns False, keeping any feed already remembered, if the server
+    didn't answer; the next tick tries again.
+    """
+    client = get_client()
+    # The cursor first: events between it and the fetch are applied again,
+    # which is harmless, where the other order could miss some
+    data = client.get_events()
+    if data is None:
+        return False
+    client.invalidate()
+    st.session_state['live_feed'] = {'posts': get_posts(), 'cursor': data['cursor']}
+    return True
+
+
+def sync_live_feed():
+    """
+    Bring the remembered feed up to date by applying new change events.
+    Raises RequestException when the server can't be reached and returns
+    None when it fails; live_feed backs off in both cases.
+    """
+    feed = st.session_state.get('live_feed')
+    if feed is None:
+        if not load_live_feed():
+            return None
+        feed = st.session_state['live_feed']
+    try:
+        data = get_client().get_events(feed['cursor'], limit=EVENTS_PAGE_SIZE)
+    except CursorExpired:
+        # The cursor predates the kept history
+        return st.session_state['live_feed']['posts'] if load_live_feed() else None
+    if data is None:
+        return None
+    if len(data['events']) == EVENTS_PAGE_SIZE:
+        # Too far behind to be worth replaying
+        if not load_live_feed():
+            return None
+    else:
+        feed['posts'] = apply_events(feed['posts'], data['events'])
+        feed['cursor'] = data['cursor']
+    return st.session_state['live_feed']['posts']
+
+
+@st.fragment(run_every=LIVE_POLL_SECONDS)
+def live_feed():
+    """The feed in live mode: reruns on its own, applying only what changed"""
+    backoff = st.session_state.setdefault('live_backoff', {'failures': 0, 'until': 0.0})
+    posts = None
+    if time.monotonic() >= backoff['until']:
+        try:
+            posts = sync_live_feed()
+        except requests.exceptions.RequestException:
+            posts = None
+        if posts is None:
+            backoff['failures'] += 1
+            delay = min(LIVE_POLL_SECONDS * 2 ** backoff['failures'], LIVE_MAX_BACKOFF_SECONDS)
+            backoff['until'] = time.monotonic() + delay
+        else:
+            backoff.update(failures=0, until=0.0)
+    if posts is None:
+        # Keep showing what we have while the server is unhappy
+        posts = st.session_state.get('live_feed', {}).get('posts', [])
+    show_feed(posts)
+
+
+def show_feed(posts):
+    if not posts:
+        st.info("📭 No posts yet. Be the first!")
+    else:
+        images = fetch_feed_images(posts)
+        for post in posts:
+            display_post(post, images)
+
+
+def display_post(post, images=None):
     """Display a single post with professional card design"""
     
     # Get username
@@ -165,22 +356,26 @@ def display_post(post):
     # Display image if exists (FIXED - use_container_width instead of use_column_width)
     if post.get('image'):
         try:
-            image_url = post['image']
-            if not image_url.startswith('http'):
-                image_url = "http://localhost:8000" + image_url
+            image_url = image_url_for(post)
+            if images is None:
+                images = fetch_feed_images([post])
             
-            response = requests.get(image_url, timeout=5)
-            if response.status_code == 200:
-                img = Image.open(BytesIO(response.content))
+            image_bytes = images.get(image_url)
+            if image_bytes:
                 st.markdown('<div style="margin-top: 20px; border-radius: 10px; overflow: hidden;">', unsafe_allow_html=True)
-                st.image(img, use_container_width=True)  # FIXED HERE
+                st.image(image_bytes, use_container_width=True)  # FIXED HERE
                 st.markdown('</div>', unsafe_allow_html=True)
         except Exception as e:
             st.warning("⚠️ Could not load image: " + str(e))
     
-    # Display comments
+    # Display comments - the feed only embeds the latest few, the rest of
+    # the thread is fetched page by page when the user asks for it
     comments = post.get('comments', [])
     comments_count = post.get('comments_count', 0)
+    thread_key = "thread_" + str(post['id'])
+    thread = st.session_state.get(thread_key)
+    if thread is not None:
+        comments = thread['comments']
     
     if comments_count > 0:
         st.markdown(
@@ -199,6 +394,17 @@ def display_post(post):
                 '</div>',
                 unsafe_allow_html=True
             )
+        can_load_more = thread is None or thread['cursor'] is not None
+        if comments_count > len(comments) and can_load_more:
+            label = "Show all comments" if thread is None else "Load more comments"
+            if st.button(label, key="more_comments_" + str(post['id'])):
+                if thread is None:
+                    thread = {'comments': [], 'cursor': None}
+                page, cursor = get_comments(post['id'], thread['cursor'])
+                thread['comments'] = thread['comments'] + page
+                thread['cursor'] = cursor
+                st.session_state[thread_key] = thread
+                st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
     
     # Add comment section
@@ -209,6 +415,7 @@ def display_post(post):
             if comment_text.strip():
                 success, msg = add_comment(post['id'], comment_text, comment_username)
                 if success:
+                    st.session_state.pop(thread_key, None)
                     st.success(msg)
                     st.rerun()
                 else:
@@ -312,15 +519,24 @@ def main():
                     else:
                         st.error(msg)
         
+        st.markdown("---")
+        live = st.toggle(
+            "⚡ Live updates",
+            help="Follow new posts and comments as they happen instead of refreshing"
+        )
+        if not live:
+            st.session_state.pop('live_feed', None)
+        
         st.markdown("---")
         st.markdown("### 📊 Stats")
-        posts = get_posts()
+        stats = get_stats()
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("Posts", len(posts))
+            st.metric("Posts", stats.get('posts', 0))
+            st.metric("Comments", stats.get('comments', 0))
         with col2:
-            images = len([p for p in posts if p.get('image')])
-            st.metric("Images", images)
+            st.metric("Images", stats.get('images', 0))
+            st.metric("Users", stats.get('users', 0))
     
     # Main Feed
     col1, col2 = st.columns([3, 1])
@@ -328,16 +544,16 @@ def main():
         st.header("📰 Feed")
     with col2:
         if st.button("🔄 Refresh", use_container_width=True):
+            get_client().invalidate()
+            st.session_state.pop('live_feed', None)
             st.rerun()
     
     st.markdown("---")
     
-    posts = get_posts()
-    if not posts:
-        st.info("📭 No posts yet. Be the first!")
+    if live:
+        live_feed()
     else:
-        for post in posts:
-            display_post(post)
+        show_feed(get_posts())
 
 
 if __name__ == "__main__":